@@ -1,16 +1,22 @@
+import secrets
 from hashlib import sha256
-from typing import Dict, Any, TypeVar
+from math import ceil
+from typing import Annotated, Dict, Any, Iterable, Optional, Set, TypeVar
 from datetime import datetime
 
 import jwt
-from sqlmodel import select, Session, col, SQLModel, delete, func, or_
+from sqlmodel import select, col, SQLModel, delete, func, or_
+from sqlmodel.ext.asyncio.session import AsyncSession
 from fastapi import HTTPException, Query, Request, Depends
+from fastapi.responses import ORJSONResponse
 from fastapi_pagination import Page
+from fastapi_pagination.api import resolve_params
 from fastapi_pagination.customization import CustomizedPage, UseParamsFields
 from apscheduler.schedulers.background import BackgroundScheduler
 
 from app.data.db import Coach, CoachSession
 from app.data.create import AuthCreate
+from app.core.cache import session_cache
 from app.core.config import settings
 from app.core.db import get_session
 
@@ -23,30 +29,128 @@ VolPage = CustomizedPage[
     ),
 ]
 
+Fields = Annotated[
+    Optional[str],
+    Query(description="Comma separated list of fields to return (id is always included)"),
+]
+
+
+def parse_fields(fields: Optional[str], available: Iterable[str]) -> Optional[Set[str]]:
+    """Validate a sparse `fields` query value, None means all fields."""
+    if not fields:
+        return None
+    requested = {field.strip() for field in fields.split(",") if field.strip()}
+    unknown = requested - set(available)
+    if unknown:
+        raise HTTPException(
+            status_code=400, detail="Unknown fields: " + ", ".join(sorted(unknown))
+        )
+    return requested | {"id"}
+
+
+async def paginate_rows(session: AsyncSession, statement: Any) -> Dict[str, Any]:
+    """Paginate a select in SQL, items are the raw rows to be shaped by the caller."""
+    params = resolve_params()
+    raw_params = params.to_raw_params().as_limit_offset()
+    count_statement = select(func.count()).select_from(
+        statement.order_by(None).subquery()
+    )
+    total = (await session.exec(count_statement)).one()
+    # on the connection, session.exec would turn a single column into scalars
+    connection = await session.connection()
+    rows = await connection.execute(
+        statement.limit(raw_params.limit).offset(raw_params.offset)
+    )
+    return {
+        "items": rows.all(),
+        "total": total,
+        "page": params.page,
+        "size": params.size,
+        "pages": ceil(total / params.size) if params.size else 0,
+    }
+
+
+def page_response(page: Dict[str, Any], partial: bool = False) -> Any:
+    """Return a pre-shaped page.
+
+    With FAST_RESPONSES enabled the page is serialized by orjson as is and
+    the route's response model is not validated again. Partial pages (sparse
+    fields) are always returned this way, they don't satisfy the full model.
+    """
+    if settings.FAST_RESPONSES or partial:
+        return ORJSONResponse(page)
+    return page
+
+
+def require_debug_endpoints():
+    """Hide diagnostic routes unless DEBUG_ENDPOINTS is enabled."""
+    if not settings.DEBUG_ENDPOINTS:
+        raise HTTPException(status_code=404, detail="Not Found")
+
 
-def get_coach(request: Request, session: Session = Depends(get_session)) -> Coach:
-    """Get coach from request."""
+def bearer_token(request: Request) -> str:
+    """Access token from the Authorization header."""
     auth_header = request.headers.get("Authorization")
     if not auth_header:
         raise HTTPException(status_code=401, detail="Authorization header missing")
-    auth_header = auth_header.replace("Bearer ", "")
-    coach_session = session.exec(
-        select(CoachSession).where(col(CoachSession.access_token) == auth_header)
+    return auth_header.replace("Bearer ", "")
+
+
+def decode_access_token(access_token: str) -> Dict[str, Any]:
+    """Claims of a signed, unexpired access token with a subject."""
+    try:
+        return jwt.decode(
+            access_token,
+            settings.SECRET_KEY,
+            algorithms=[settings.ALGORITHM],
+            options={"require": ["exp", "sub"]},
+        )
+    except jwt.ExpiredSignatureError:
+        raise HTTPException(status_code=401, detail="Token expired")
+    except jwt.InvalidTokenError:
+        raise HTTPException(status_code=401, detail="Invalid access token")
+
+
+async def get_coach(
+    request: Request, session: AsyncSession = Depends(get_session)
+) -> Coach:
+    """Get coach from request.
+
+    The token's signature and exp/sub claims are verified first. Whether the
+    session was revoked (logout, newer login or refresh) is checked against
+    session_cache; only a miss looks up the CoachSession row and the coach.
+    """
+    access_token = bearer_token(request)
+    claims = decode_access_token(access_token)
+    coach = session_cache.get(access_token)
+    if coach is not None:
+        return coach
+
+    coach_session = (
+        await session.exec(
+            select(CoachSession).where(col(CoachSession.access_token) == access_token)
+        )
     ).first()
-    if not coach_session:
+    if not coach_session or str(coach_session.coach) != claims["sub"]:
         raise HTTPException(status_code=401, detail="Invalid access token")
-    coach = session.get(Coach, coach_session.coach)
+    # expired rows stay until the cleanup job, they just stop working
+    if coach_session.expires_at <= datetime.now().timestamp():
+        raise HTTPException(status_code=401, detail="Token expired")
+    coach = await session.get(Coach, coach_session.coach)
     if not coach:
         raise HTTPException(status_code=401, detail="Coach not found")
+    session_cache.put(access_token, coach, coach_session.expires_at)
     return coach
 
 
-def auth_coach(session: Session, auth: AuthCreate) -> Coach:
+async def auth_coach(session: AsyncSession, auth: AuthCreate) -> Coach:
     """Get coach by username and password."""
-    coach = session.exec(
-        select(Coach).where(
-            col(Coach.username) == auth.username,
-            col(Coach.password) == sha256(auth.password.encode()).hexdigest(),
+    coach = (
+        await session.exec(
+            select(Coach).where(
+                col(Coach.username) == auth.username,
+                col(Coach.password) == sha256(auth.password.encode()).hexdigest(),
+            )
         )
     ).first()
     if not coach:
@@ -60,4 +164,17 @@ def create_jwt(payload: Dict[str, Any]) -> str:
         payload,
         settings.SECRET_KEY,
         algorithm=settings.ALGORITHM,
-    )
\ No newline at end of file
+    )
+
+
+def create_access_token(coach_id: int, expires_at: int) -> str:
+    """Signed access token for a coach session, valid until expires_at."""
+    return create_jwt(
+        {
+            "sub": str(coach_id),
+            "exp": expires_at,
+            "iat": int(datetime.now().timestamp()),
+            # tokens issued within the same second must differ
+            "jti": secrets.token_urlsafe(8),
+        }
+    )
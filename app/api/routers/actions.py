@@ -1,62 +1,335 @@
-from fastapi import APIRouter, HTTPException, Depends
-from fastapi_pagination import Page, paginate
-from sqlmodel import select, Session, col
+import csv
+import json
+from io import StringIO
+from itertools import groupby
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple, Union
+from uuid import UUID
 
-from app.core.db import get_session
-from app.data.db import Team, Game, Action, Player, Subtech, Coach
-from app.data.utils import Status, NameWithId
+from fastapi import (
+    APIRouter,
+    HTTPException,
+    Depends,
+    Query,
+    WebSocket,
+    WebSocketDisconnect,
+)
+from fastapi.responses import StreamingResponse
+from fastapi_pagination import Page
+from sqlmodel import SQLModel, col, insert, select, update
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core.algorithm import invalidate_player_sums
+from app.core.changes import record_changes
+from app.core.config import settings
+from app.core.db import create_read_session, create_session, get_session
+from app.core.dialect import insert_ignore
+from app.core.live import CommitResult, live_games
+from app.data.db import Team, Game, Action, Player, Subtech
+from app.data.utils import Entity, Status, ExportFormat
 from app.data.update import ActionUpdate, ActionsBatchUpdateOptions
 from app.data.create import ActionCreate
-from app.data.public import ActionPublic
-from app.core.logger import logger
-from app.api.deps import get_coach
+from app.data.public import (
+    ActionBulkErrorPublic,
+    ActionBulkPublic,
+    ActionPublic,
+    ActionsBatchUpdatePublic,
+)
+from app.api.deps import Fields, page_response, paginate_rows, parse_fields
 
 
 router = APIRouter()
 
 
+# relation field -> (joined model, name expression)
+action_relations = {
+    "game": (Game, Game.name),
+    "team": (Team, Team.name),
+    "player": (Player, Player.first_name + " " + Player.last_name),
+    "subtech": (Subtech, Subtech.name),
+}
+action_fields = [
+    "id",
+    "client_id",
+    "game",
+    "team",
+    "player",
+    "subtech",
+    "from_zone",
+    "to_zone",
+    "impact",
+]
+
+
 @router.get("/", response_model=Page[ActionPublic])
 async def get_actions(
-    *, session: Session = Depends(get_session), game_id: int
+    *, session: AsyncSession = Depends(get_session), game_id: int, fields: Fields = None
 ) -> Page[ActionPublic]:
-    """Get all actions for a game"""
-    
-    actions = []
+    """Get all actions for a game
+
+    :param fields: When provided, returns only these fields (names are joined
+        only for requested relations)
+    """
+    selected = parse_fields(fields, action_fields)
+    statement = actions_statement(game_id, None, selected).order_by(None).order_by(
+        col(Action.id).desc()
+    )
+    page = await paginate_rows(session, statement)
+    page["items"] = to_public_actions(page["items"])
+    return page_response(page, partial=selected is not None)
+
+
+def actions_statement(
+    game_id: Optional[int],
+    player_id: Optional[int],
+    fields: Optional[Set[str]] = None,
+):
+    """Select flat action rows, joining names only for the selected relations."""
+    columns = []
+    joins = []
+    for field in action_fields:
+        if fields is not None and field not in fields:
+            continue
+        columns.append(getattr(Action, field))
+        if field in action_relations:
+            model, name = action_relations[field]
+            columns.append(name.label(field + "_name"))
+            joins.append((model, col(model.id) == getattr(Action, field)))
+
+    statement = select(*columns).select_from(Action)
+    for model, onclause in joins:
+        statement = statement.outerjoin(model, onclause)
+    statement = statement.order_by(col(Action.id))
     if game_id:
-        db_actions = session.exec(
-            select(Action).where(col(Action.game) == game_id).order_by(Action.id.desc())
-        ).all()
+        statement = statement.where(col(Action.game) == game_id)
+    if player_id:
+        statement = statement.where(col(Action.player) == player_id)
+    return statement
+
+
+def to_public_actions(rows) -> List[Dict[str, Any]]:
+    """Shape joined action rows like ActionPublic."""
+    actions = []
+    for row in rows:
+        action = row._asdict()
+        for field in action_relations:
+            if field not in action:
+                continue
+            name = action.pop(field + "_name")
+            action[field] = (
+                {"id": action[field], "name": name} if name is not None else None
+            )
+        actions.append(action)
+    return actions
+
+
+async def stream_actions(
+    statement, export_format: ExportFormat
+) -> AsyncIterator[str]:
+    """Yield serialized action rows chunk by chunk from a server-side cursor."""
+    async with create_read_session() as session:
+        result = await session.stream(
+            statement.execution_options(yield_per=settings.EXPORT_YIELD_PER)
+        )
+        buffer = StringIO()
+        writer = csv.writer(buffer)
+        if export_format == ExportFormat.CSV:
+            writer.writerow(result.keys())
+        async for rows in result.partitions():
+            for row in rows:
+                data = row._asdict()
+                data["impact"] = data["impact"].value if data["impact"] else None
+                if data["client_id"] is not None:
+                    data["client_id"] = str(data["client_id"])
+                if export_format == ExportFormat.CSV:
+                    writer.writerow(data.values())
+                else:
+                    buffer.write(json.dumps(data, ensure_ascii=False) + "\n")
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+
+
+@router.get("/export")
+async def export_actions(
+    *,
+    game_id: Optional[int] = None,
+    player_id: Optional[int] = None,
+    export_format: ExportFormat = Query(ExportFormat.NDJSON, alias="format"),
+) -> StreamingResponse:
+    """Stream actions as NDJSON or CSV without loading them into memory
+
+    :param game_id: When provided, exports only actions of this game
+    :param player_id: When provided, exports only actions of this player
+    :param format: ndjson (default) or csv
+    """
+    statement = actions_statement(game_id, player_id)
+    if export_format == ExportFormat.CSV:
+        media_type = "text/csv"
     else:
-        db_actions = session.exec(select(Action).order_by(Action.id.desc())).all()
-    for db_action in db_actions:
-        action = ActionPublic(
-            **db_action.model_dump(exclude={"game", "team", "player", "subtech"})
+        media_type = "application/x-ndjson"
+    return StreamingResponse(
+        stream_actions(statement, export_format),
+        media_type=media_type,
+        headers={
+            "Content-Disposition": "attachment; filename=actions.{}".format(
+                export_format.value
+            )
+        },
+    )
+
+
+async def insert_live_rows(
+    session: AsyncSession, rows: List[Dict[str, Any]]
+) -> Tuple[List[Optional[int]], Set[int]]:
+    """Insert action rows, returning the id per row and the positions of rows
+    whose client_id another upload stored first.
+
+    Rows with a client_id go through ON CONFLICT (client_id) DO NOTHING, so a
+    concurrent upload of the same action (a resend racing its reconnect, or
+    another worker) is skipped instead of failing the whole group; skipped
+    rows get the id the other upload stored. Runs of rows with and without
+    client_id are inserted in order, so ids follow the event order.
+    """
+    ids: List[Optional[int]] = [None] * len(rows)
+    skipped = set()
+    for keyed, run in groupby(
+        range(len(rows)), key=lambda index: rows[index]["client_id"] is not None
+    ):
+        run = list(run)
+        params = [rows[index] for index in run]
+        if not keyed:
+            inserted = (
+                await session.exec(
+                    insert(Action).returning(
+                        col(Action.id), sort_by_parameter_order=True
+                    ),
+                    params=params,
+                )
+            ).scalars().all()
+            for index, action_id in zip(run, inserted):
+                ids[index] = action_id
+            continue
+
+        inserted = dict(
+            (
+                await session.exec(
+                    insert_ignore(Action, "client_id").returning(
+                        col(Action.client_id), col(Action.id)
+                    ),
+                    params=params,
+                )
+            ).all()
         )
-        action.game = NameWithId(
-            id=db_action.game, name=session.get(Game, db_action.game).name
+        concurrent = await stored_client_ids(
+            session, {row["client_id"] for row in params} - set(inserted)
         )
-        action.team = NameWithId(
-            id=db_action.team, name=session.get(Team, db_action.team).name
+        for index in run:
+            client_id = rows[index]["client_id"]
+            if client_id in inserted:
+                ids[index] = inserted[client_id]
+            else:
+                ids[index] = concurrent.get(client_id)
+                skipped.add(index)
+    return ids, skipped
+
+
+async def commit_live_actions(new_actions: List[ActionCreate]) -> List[CommitResult]:
+    """Store one group of live actions in a single transaction.
+
+    An action resent with a known client_id (e.g. after a reconnect) is
+    acked with the id it was stored under instead of being inserted again,
+    and marked as a duplicate so it is not pushed to the viewers twice. The
+    same holds when another upload stores it while this group commits.
+    """
+    async with create_session() as session:
+        errors = await check_action_references(session, new_actions)
+        stored = await stored_client_ids(
+            session, {action.client_id for action in new_actions} - {None}
         )
-        player = session.get(Player, db_action.player)
-        if player:
-            action.player = NameWithId(
-                id=db_action.player, name=player.first_name + " " + player.last_name
+        # CommitResult, or the index in rows for actions inserted below
+        results: List[Union[CommitResult, int]] = []
+        repeats = set()  # positions of repeats within the group
+        rows = []
+        pending = {}  # client_id -> index in rows, for repeats within the group
+        for action, error in zip(new_actions, errors):
+            if error is not None:
+                results.append(CommitResult(None, error))
+            elif action.client_id in stored:
+                results.append(
+                    CommitResult(stored[action.client_id], duplicate=True)
+                )
+            elif action.client_id in pending:
+                repeats.add(len(results))
+                results.append(pending[action.client_id])
+            else:
+                if action.client_id is not None:
+                    pending[action.client_id] = len(rows)
+                results.append(len(rows))
+                rows.append(action.model_dump())
+        ids: List[Optional[int]] = []
+        skipped: Set[int] = set()
+        if rows:
+            ids, skipped = await insert_live_rows(session, rows)
+            await record_changes(
+                session,
+                Entity.ACTION,
+                [ids[index] for index in range(len(rows)) if index not in skipped],
             )
-        action.subtech = NameWithId(
-            id=db_action.subtech, name=session.get(Subtech, db_action.subtech).name
+            await session.commit()
+    return [
+        CommitResult(
+            ids[result], duplicate=position in repeats or result in skipped
         )
-        actions.append(action)
+        if isinstance(result, int)
+        else result
+        for position, result in enumerate(results)
+    ]
+
 
-    return paginate(actions)
+@router.websocket("/ws/{game_id}")
+async def live_actions(websocket: WebSocket, game_id: int):
+    """Record actions of a running game over a websocket
+
+    Send {"ref": <any>, "action": {ActionCreate without game}} per action.
+    The server replies {"type": "ack", "ref", "id"} once the action is
+    committed (grouped, see LIVE_COMMIT_EVENTS/LIVE_COMMIT_MS) or
+    {"type": "error", "ref", "detail"}, and pushes
+    {"type": "actions", "actions": [...]} with actions sent by the other
+    viewers of the game.
+    """
+    async with create_read_session() as session:
+        game = await session.get(Game, game_id)
+    if game is None:
+        await websocket.close(code=1008, reason="Game not found")
+        return
+    await websocket.accept()
+    live_game = live_games.join(game_id, websocket, commit_live_actions)
+    try:
+        while True:
+            ref = None
+            try:
+                message = await websocket.receive_json()
+                ref = message.get("ref")
+                action = ActionCreate.model_validate(
+                    {**message.get("action", {}), "game": game_id}
+                )
+            except (ValueError, KeyError, AttributeError, TypeError) as e:
+                await websocket.send_json({"type": "error", "ref": ref, "detail": str(e)})
+                continue
+            await live_game.submit(websocket, ref, action)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        await live_games.leave(game_id, websocket)
 
 
 @router.get("/{action_id}")
 async def get_action(
-    *, session: Session = Depends(get_session), action_id: str
+    *, session: AsyncSession = Depends(get_session), action_id: int
 ) -> Action:
     """Get action by id"""
-    db_action = session.get(Action, action_id)
+    db_action = await session.get(Action, action_id)
     if not db_action:
         raise HTTPException(status_code=404, detail="Action not found")
     return db_action
@@ -64,36 +337,149 @@ async def get_action(
 
 @router.post("/", response_model=Status)
 async def create_action(
-    *, session: Session = Depends(get_session), new_action: ActionCreate
+    *, session: AsyncSession = Depends(get_session), new_action: ActionCreate
 ) -> Status:
-    """Create new action"""
-    action = Action(**new_action.model_dump())
+    """Create new action
 
-    session.add(action)
-    session.commit()
+    An action with an already uploaded client_id is not inserted again.
+    """
+    created = (
+        await session.exec(
+            insert_ignore(Action, "client_id")
+            .values(**new_action.model_dump())
+            .returning(col(Action.id))
+        )
+    ).scalar()
+    if created is not None:
+        await record_changes(session, Entity.ACTION, [created])
+    await session.commit()
 
+    if created is None:
+        return Status(status="success", detail="Action already exists")
     return Status(status="success", detail="Action created")
 
 
+async def existing_ids(
+    session: AsyncSession, model: SQLModel, ids: Set[int]
+) -> Set[int]:
+    """Subset of ids that exist in the model's table, in one query."""
+    if not ids:
+        return set()
+    rows = await session.exec(select(model.id).where(col(model.id).in_(ids)))
+    return set(rows.all())
+
+
+async def stored_client_ids(
+    session: AsyncSession, client_ids: Set[UUID]
+) -> Dict[UUID, int]:
+    """Action id per already stored client_id, in one query."""
+    if not client_ids:
+        return {}
+    rows = await session.exec(
+        select(Action.client_id, Action.id).where(col(Action.client_id).in_(client_ids))
+    )
+    return dict(rows.all())
+
+
+async def check_action_references(
+    session: AsyncSession, new_actions: List[ActionCreate]
+) -> List[Optional[str]]:
+    """Error detail per action (None when valid) for missing game, team,
+    player or subtech, with one query per relation for the whole list."""
+    known = {}
+    for field, (model, _) in action_relations.items():
+        ids = {getattr(action, field) for action in new_actions}
+        known[field] = await existing_ids(session, model, ids)
+
+    errors = []
+    for action in new_actions:
+        missing = [
+            field
+            for field in action_relations
+            if getattr(action, field) not in known[field]
+        ]
+        errors.append(
+            ", ".join(
+                "{} {} not found".format(field, getattr(action, field))
+                for field in missing
+            )
+            or None
+        )
+    return errors
+
+
+@router.post("/bulk", response_model=ActionBulkPublic)
+async def create_actions_bulk(
+    *, session: AsyncSession = Depends(get_session), new_actions: List[ActionCreate]
+) -> ActionBulkPublic:
+    """Create many actions at once, e.g. a whole match recorded offline
+
+    References are checked against the ids loaded once per relation and the
+    valid actions are inserted with a single executemany in one transaction.
+    Actions pointing to a missing game, team, player or subtech are returned
+    in errors by their position in the request and not inserted.
+
+    The insert is INSERT ... ON CONFLICT (client_id) DO NOTHING, so
+    re-uploading actions after a lost response only counts them as skipped.
+    """
+    if len(new_actions) > settings.BULK_ACTIONS_MAX:
+        raise HTTPException(
+            status_code=413,
+            detail="At most {} actions per request".format(settings.BULK_ACTIONS_MAX),
+        )
+
+    rows = []
+    errors = []
+    reference_errors = await check_action_references(session, new_actions)
+    for index, (action, detail) in enumerate(zip(new_actions, reference_errors)):
+        if detail is not None:
+            errors.append(ActionBulkErrorPublic(index=index, detail=detail))
+            continue
+        rows.append(action.model_dump())
+
+    created = 0
+    if rows:
+        ids = (
+            await session.exec(
+                insert_ignore(Action, "client_id").returning(col(Action.id)),
+                params=rows,
+            )
+        ).scalars().all()
+        created = len(ids)
+        await record_changes(session, Entity.ACTION, ids)
+        await session.commit()
+
+    return ActionBulkPublic(
+        status="success" if not errors else "partial",
+        created=created,
+        skipped=len(rows) - created,
+        errors=errors,
+    )
+
+
 @router.delete("/{action_id}")
 async def delete_action(
-    *, session: Session = Depends(get_session), action_id: str
+    *, session: AsyncSession = Depends(get_session), action_id: int
 ) -> Status:
     """Delete action by id"""
-    action = session.get(Action, action_id)
+    action = await session.get(Action, action_id)
     if action is None:
         raise HTTPException(status_code=404, detail="Action not found")
-    session.delete(action)
-    session.commit()
+    await session.delete(action)
+    await record_changes(session, Entity.ACTION, [action_id], deleted=True)
+    await session.commit()
     return Status(status="success", detail="Action deleted")
 
 
 @router.put("/update/{action_id}")
 async def update_action(
-    *, session: Session = Depends(get_session), action_id: str, new_action: ActionUpdate
+    *,
+    session: AsyncSession = Depends(get_session),
+    action_id: int,
+    new_action: ActionUpdate,
 ) -> Status:
     """Update action by id"""
-    action = session.get(Action, action_id)
+    action = await session.get(Action, action_id)
     if action is None:
         raise HTTPException(status_code=404, detail="Action not found")
 
@@ -101,26 +487,69 @@ async def update_action(
         setattr(action, field, value)
 
     session.add(action)
-    session.commit()
+    await record_changes(session, Entity.ACTION, [action_id])
+    await session.commit()
 
     return Status(status="success", detail="Action updated")
 
-@router.put("/batch_update")
+@router.put("/batch_update", response_model=ActionsBatchUpdatePublic)
 async def batch_update_actions(
-    *, session: Session = Depends(get_session), actions_batch_update_options: ActionsBatchUpdateOptions
-):
-    """Batch update actions by ids"""
-    actions = session.exec(
-        select(Action).where(Action.id.in_(actions_batch_update_options.actions))
-    ).all()
-    if not actions:
-        raise HTTPException(status_code=404, detail="No actions found for the provided IDs")
+    *,
+    session: AsyncSession = Depends(get_session),
+    actions_batch_update_options: ActionsBatchUpdateOptions,
+) -> ActionsBatchUpdatePublic:
+    """Batch update actions by ids or by filter
 
-    for action in actions:
-        for field, value in actions_batch_update_options.main_action.model_dump(exclude_none=True).items():
-            setattr(action, field, value)
-        session.add(action)
+    Runs UPDATE action SET ... WHERE id IN (...) in chunks of
+    BATCH_UPDATE_CHUNK ids, or a single UPDATE for the filter (game, player,
+    subtech, impact, all given fields must match). Sums of the affected
+    players are invalidated in the same transaction.
+
+    Returns:
+        ActionsBatchUpdatePublic: updated is the number of changed actions
+    """
+    options = actions_batch_update_options
+    values = options.main_action.model_dump(exclude_none=True)
+
+    if options.actions:
+        ids = options.actions
+        conditions = [
+            [col(Action.id).in_(ids[start : start + settings.BATCH_UPDATE_CHUNK])]
+            for start in range(0, len(ids), settings.BATCH_UPDATE_CHUNK)
+        ]
+    elif options.filter and options.filter.model_dump(exclude_none=True):
+        conditions = [
+            [
+                col(getattr(Action, field)) == value
+                for field, value in options.filter.model_dump(exclude_none=True).items()
+            ]
+        ]
+    else:
+        raise HTTPException(status_code=400, detail="Provide action ids or a filter")
+
+    if not values:
+        return ActionsBatchUpdatePublic(status="success", detail="Nothing to update")
+
+    updated: List[int] = []
+    players = set()
+    for where in conditions:
+        players.update(
+            (await session.exec(select(Action.player).where(*where).distinct())).all()
+        )
+        # RETURNING, the update may change the filtered fields
+        result = await session.exec(
+            update(Action).where(*where).values(**values).returning(col(Action.id))
+        )
+        updated.extend(result.scalars().all())
+    if not updated:
+        raise HTTPException(status_code=404, detail="No actions found")
 
-    session.commit()
+    if "player" in values:
+        players.add(values["player"])
+    await invalidate_player_sums(session, players)
+    await record_changes(session, Entity.ACTION, updated)
+    await session.commit()
 
-    return Status(status="success", detail="Actions batch updated")
\ No newline at end of file
+    return ActionsBatchUpdatePublic(
+        status="success", detail="Actions batch updated", updated=len(updated)
+    )
@@ -1,8 +1,12 @@
+from typing import List, Optional
+
 from fastapi import APIRouter, Depends, HTTPException
-from sqlmodel import Session, SQLModel, and_, col, delete, select
+from sqlmodel import and_, col, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
+from app.core import statements
 from app.core.algorithm import PlanCreator, calculate_sums
-from app.core.db import get_session
+from app.core.db import get_session, get_write_session
 from app.core.logger import logger
 from app.data.algorithm import *
 from app.data.db import *
@@ -14,9 +18,9 @@ router = APIRouter()
 
 @router.get("/stats/calculate/{player_id}")
 async def calculate_stats_player(
-    player_id: int, session: CoachSession = Depends(get_session)
+    player_id: int, session: AsyncSession = Depends(get_write_session)
 ):
-    player = session.get(Player, player_id)
+    player = await session.get(Player, player_id)
     if not player:
         raise HTTPException(status_code=404, detail="Player not found")
 
@@ -29,20 +33,22 @@ async def calculate_stats_player(
 
 @router.get("/stats/{player_id}", response_model=PlayerStatsPublic)
 async def get_stats_player(
-    player_id: int, session: CoachSession = Depends(get_session)
+    player_id: int, session: AsyncSession = Depends(get_session)
 ):
-    player = session.get(Player, player_id)
+    player = await session.get(Player, player_id)
     if not player:
         raise HTTPException(status_code=404, detail="Player not found")
 
     # Get stats
-    player_sum_db = session.exec(
-        select(PlayerSum).where(col(PlayerSum.player) == player_id)
+    player_sum_db = (
+        await session.exec(statements.player_sum, params={"player": player_id})
     ).first()
-    tech_top_rows = session.exec(
-        select(TechSum)
-        .where(col(TechSum.player) == player_id)
-        .order_by(col(TechSum.prozent).desc())
+    if player_sum_db is None:
+        raise HTTPException(status_code=404, detail="Stats not calculated")
+    tech_top_rows = (
+        await session.exec(
+            statements.tech_sums_by_player, params={"player": player_id}
+        )
     ).all()
 
     # Create the public model with the correct NameWithId object
@@ -57,7 +63,9 @@ async def get_stats_player(
     tech_ids = [ts.tech for ts in tech_top_rows]
     techs = {
         tech.id: tech
-        for tech in session.exec(select(Tech).where(Tech.id.in_(tech_ids))).all()
+        for tech in (
+            await session.exec(statements.techs_by_id, params={"ids": tech_ids})
+        ).all()
     }
 
     tech_sums = []
@@ -80,27 +88,23 @@ async def get_stats_player(
 
 @router.get("/stats/{player_id}/{tech_id}", response_model=TechStatsPublic)
 async def get_stats_tech(
-    player_id: int, tech_id: int, session: CoachSession = Depends(get_session)
+    player_id: int, tech_id: int, session: AsyncSession = Depends(get_session)
 ):
-    player = session.get(Player, player_id)
+    player = await session.get(Player, player_id)
     if not player:
         raise HTTPException(status_code=404, detail="Player not found")
 
-    tech = session.get(Tech, tech_id)
+    tech = await session.get(Tech, tech_id)
     if not tech:
         raise HTTPException(status_code=404, detail="Tech not found")
 
     # Get stats
-    tech_top_db = session.exec(
-        select(TechSum)
-        .where(col(TechSum.player) == player_id)
-        .where(col(TechSum.tech) == tech_id)
-    ).first()
-    subtech_top_rows = session.exec(
-        select(SubtechSum)
-        .where(col(SubtechSum.player) == player_id)
-        .where(col(SubtechSum.tech) == tech_id)
-        .order_by(col(SubtechSum.prozent).desc())
+    params = {"player": player_id, "tech": tech_id}
+    tech_top_db = (await session.exec(statements.tech_sum, params=params)).first()
+    if tech_top_db is None:
+        raise HTTPException(status_code=404, detail="Stats not calculated")
+    subtech_top_rows = (
+        await session.exec(statements.subtech_sums_by_tech, params=params)
     ).all()
 
     # Create the public model with the correct NameWithId object
@@ -113,8 +117,10 @@ async def get_stats_tech(
     subtech_ids = [ss.subtech for ss in subtech_top_rows]
     subtechs = {
         subtech.id: subtech
-        for subtech in session.exec(
-            select(Subtech).where(Subtech.id.in_(subtech_ids))
+        for subtech in (
+            await session.exec(
+                statements.subtechs_by_id, params={"ids": subtech_ids}
+            )
         ).all()
     }
 
@@ -145,33 +151,29 @@ async def get_stats_subtech(
     player_id: int,
     tech_id: int,
     subtech_id: int,
-    session: CoachSession = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
 ):
-    player = session.get(Player, player_id)
+    player = await session.get(Player, player_id)
     if not player:
         raise HTTPException(status_code=404, detail="Player not found")
 
-    tech = session.get(Tech, tech_id)
+    tech = await session.get(Tech, tech_id)
     if not tech:
         raise HTTPException(status_code=404, detail="Tech not found")
 
-    subtech = session.get(Subtech, subtech_id)
+    subtech = await session.get(Subtech, subtech_id)
     if not subtech:
         raise HTTPException(status_code=404, detail="Subtech not found")
 
     # Get stats
-    subtech_top_db = session.exec(
-        select(SubtechSum)
-        .where(col(SubtechSum.player) == player_id)
-        .where(col(SubtechSum.tech) == tech_id)
-        .where(col(SubtechSum.subtech) == subtech_id)
+    params = {"player": player_id, "tech": tech_id, "subtech": subtech_id}
+    subtech_top_db = (
+        await session.exec(statements.subtech_sum, params=params)
     ).first()
-    impact_top_rows = session.exec(
-        select(ImpactSum)
-        .where(col(ImpactSum.player) == player_id)
-        .where(col(ImpactSum.tech) == tech_id)
-        .where(col(ImpactSum.subtech) == subtech_id)
-        .order_by(col(ImpactSum.prozent).desc())
+    if subtech_top_db is None:
+        raise HTTPException(status_code=404, detail="Stats not calculated")
+    impact_top_rows = (
+        await session.exec(statements.impact_sums_by_subtech, params=params)
     ).all()
 
     # Create the public model with the correct NameWithId object
@@ -196,17 +198,17 @@ async def get_stats_impact(
     tech_id: int,
     subtech_id: int,
     impact: str,
-    session: CoachSession = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
 ):
-    player = session.get(Player, player_id)
+    player = await session.get(Player, player_id)
     if not player:
         raise HTTPException(status_code=404, detail="Player not found")
 
-    tech = session.get(Tech, tech_id)
+    tech = await session.get(Tech, tech_id)
     if not tech:
         raise HTTPException(status_code=404, detail="Tech not found")
 
-    subtech = session.get(Subtech, subtech_id)
+    subtech = await session.get(Subtech, subtech_id)
     if not subtech:
         raise HTTPException(status_code=404, detail="Subtech not found")
 
@@ -218,20 +220,17 @@ async def get_stats_impact(
         raise HTTPException(status_code=404, detail="Impact not found")
 
     # Get stats
-    impact_top = session.exec(
-        select(ImpactSum)
-        .where(col(ImpactSum.player) == player_id)
-        .where(col(ImpactSum.tech) == tech_id)
-        .where(col(ImpactSum.subtech) == subtech_id)
-        .where(col(ImpactSum.impact) == impact)
-    ).first()
-    zone_top_rows = session.exec(
-        select(ZoneSum)
-        .where(col(ZoneSum.player) == player_id)
-        .where(col(ZoneSum.tech) == tech_id)
-        .where(col(ZoneSum.subtech) == subtech_id)
-        .where(col(ZoneSum.impact) == impact)
-        .order_by(col(ZoneSum.prozent).desc())
+    params = {
+        "player": player_id,
+        "tech": tech_id,
+        "subtech": subtech_id,
+        "impact": impact,
+    }
+    impact_top = (await session.exec(statements.impact_sum, params=params)).first()
+    if impact_top is None:
+        raise HTTPException(status_code=404, detail="Stats not calculated")
+    zone_top_rows = (
+        await session.exec(statements.zone_sums_by_impact, params=params)
     ).all()
 
     # Return stats
@@ -245,9 +244,9 @@ async def get_stats_impact(
 async def generate_plan_player(
     player_id: int,
     amplua: Amplua,
-    session: CoachSession = Depends(get_session),
+    session: AsyncSession = Depends(get_write_session),
 ):
-    player = session.get(Player, player_id)
+    player = await session.get(Player, player_id)
     if not player:
         raise HTTPException(status_code=404, detail="Player not found")
     plan_creator = PlanCreator(session, player_id)
@@ -256,44 +255,86 @@ async def generate_plan_player(
     return Status(status="success", detail="Plan generated successfully")
 
 
+async def get_plan_weeks(
+    session: AsyncSession, player_id: int, week_number: Optional[int] = None
+) -> List[PlanWeekPublic]:
+    """Build plan weeks with their exercises and subtechs from one joined query."""
+    statement = (
+        select(PlanWeek.week, PlanExercise, Exercise, Subtech)
+        .outerjoin(
+            PlanExercise,
+            and_(
+                col(PlanExercise.player) == col(PlanWeek.player),
+                col(PlanExercise.plan) == col(PlanWeek.plan),
+                col(PlanExercise.week) == col(PlanWeek.week),
+            ),
+        )
+        .outerjoin(Exercise, col(Exercise.id) == col(PlanExercise.exercise))
+        .outerjoin(
+            ExerciseToSubtech, col(ExerciseToSubtech.exercise_id) == col(Exercise.id)
+        )
+        .outerjoin(Subtech, col(Subtech.id) == col(ExerciseToSubtech.subtech_id))
+        .where(col(PlanWeek.player) == player_id, col(PlanWeek.plan) == 1)
+        .order_by(col(PlanWeek.week), col(PlanExercise.id))
+    )
+    if week_number is not None:
+        statement = statement.where(col(PlanWeek.week) == week_number)
+
+    plan_weeks = {}
+    exercises = {}
+    rows = await session.exec(statement)
+    for week, plan_exercise, db_exercise, db_subtech in rows.all():
+        plan_week_public = plan_weeks.get(week)
+        if plan_week_public is None:
+            plan_week_public = PlanWeekPublic(week=week, exercises=[])
+            plan_weeks[week] = plan_week_public
+        if plan_exercise is None or db_exercise is None:
+            continue
+
+        exercise = exercises.get((week, plan_exercise.id))
+        if exercise is None:
+            exercise = PlanExercisePublic(**db_exercise.model_dump(exclude=["subtechs"]))
+            exercise.plan_exercise_id = plan_exercise.id
+            exercise.subtechs = []
+            exercise.checked = plan_exercise.checked
+            exercise.from_zone = plan_exercise.from_zone
+            exercise.to_zone = plan_exercise.to_zone
+            exercises[(week, plan_exercise.id)] = exercise
+            plan_week_public.exercises.append(exercise)
+        if db_subtech is not None:
+            subtech = NameWithId(id=db_subtech.id, name=db_subtech.name)
+            exercise.subtechs.append(ExerciseToSubtechPublic(subtech=subtech))
+
+    return list(plan_weeks.values())
+
+
+@router.get("/plan/{player_id}", response_model=List[PlanWeekPublic])
+async def get_plan_player(
+    player_id: int,
+    session: AsyncSession = Depends(get_session),
+):
+    player_plan = await session.get(Plan, (player_id, 1))
+    if not player_plan:
+        raise HTTPException(status_code=404, detail="Player or PlayerPlan not found")
+
+    return await get_plan_weeks(session, player_id)
+
+
 @router.get("/plan/{player_id}/{week_number}")
 async def get_plan_player_week(
     player_id: int,
     week_number: int,
-    session: CoachSession = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
 ):
-    player_plan = session.get(Plan, (player_id, 1))
+    player_plan = await session.get(Plan, (player_id, 1))
     if not player_plan:
         raise HTTPException(status_code=404, detail="Player or PlayerPlan not found")
 
-    plan_week = session.get(PlanWeek, (player_id, 1, week_number))
-    if not plan_week:
+    plan_weeks = await get_plan_weeks(session, player_id, week_number)
+    if not plan_weeks:
         raise HTTPException(status_code=404, detail="Plan for this week not found")
 
-    plan_week_public = PlanWeekPublic(week=week_number, exercises=[])
-
-    for plan_exercise in session.exec(
-        select(PlanExercise).where(
-            and_(
-                col(PlanExercise.player) == player_id,
-                col(PlanExercise.week) == week_number,
-            )
-        )
-    ).all():
-        db_exercise = session.get(Exercise, plan_exercise.exercise)
-        exercise = PlanExercisePublic(**db_exercise.model_dump(exclude=["subtechs"]))
-        exercise.plan_exercise_id = plan_exercise.id
-        exercise.subtechs = []
-        exercise.checked = plan_exercise.checked
-        for exr_to_sub in db_exercise.subtechs:
-            subtech = NameWithId(id=exr_to_sub.subtech.id, name=exr_to_sub.subtech.name)
-            exr_to_sub_public = ExerciseToSubtechPublic(subtech=subtech)
-            exercise.subtechs.append(exr_to_sub_public)
-        exercise.from_zone = plan_exercise.from_zone
-        exercise.to_zone = plan_exercise.to_zone
-        plan_week_public.exercises.append(exercise)
-
-    return plan_week_public
+    return plan_weeks[0]
 
 
 @router.get("/plan/check/{player_id}/{week_number}/{plan_exercise}")
@@ -301,16 +342,16 @@ async def check_plan_exercise(
     player_id: int,
     week_number: int,
     plan_exercise: int,
-    session: CoachSession = Depends(get_session),
+    session: AsyncSession = Depends(get_write_session),
 ):
-    plan_exercise_db = session.get(
+    plan_exercise_db = await session.get(
         PlanExercise, (player_id, 1, week_number, plan_exercise)
     )
     if not plan_exercise_db:
         raise HTTPException(status_code=404, detail="Plan exercise not found")
     plan_exercise_db.checked = not plan_exercise_db.checked
     session.add(plan_exercise_db)
-    session.commit()
+    await session.commit()
     return Status(
         status="success",
         detail="Plan exercise checked successfully ({})".format(
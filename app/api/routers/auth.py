@@ -1,22 +1,24 @@
 from hashlib import sha256
 from datetime import datetime, timedelta
 
-from fastapi import APIRouter, HTTPException, Depends
-from sqlmodel import select, Session, delete, col
+from fastapi import APIRouter, HTTPException, Depends, Request
+from sqlmodel import select, delete, col
+from sqlmodel.ext.asyncio.session import AsyncSession
 
+from app.core.cache import session_cache
 from app.core.db import get_session
 from app.data.create import AuthCreate, TokenCreate, CoachCreate
 from app.data.db import Coach, CoachSession
 from app.data.utils import Status
 from app.data.public import CoachSessionPublic
-from app.api.deps import auth_coach, create_jwt
+from app.api.deps import auth_coach, bearer_token, create_access_token, create_jwt
 from app.core.config import settings
 
 router = APIRouter()
 
 
 @router.post("/login")
-def post_login(*, session: Session = Depends(get_session), auth: AuthCreate):
+async def post_login(*, session: AsyncSession = Depends(get_session), auth: AuthCreate):
     """
     Authenticates a coach and returns both access and refresh tokens.
     
@@ -31,33 +33,34 @@ def post_login(*, session: Session = Depends(get_session), auth: AuthCreate):
         HTTPException: If authentication fails (handled by auth_coach dependency)
     """
     # Authenticate the coach using provided credentials
-    coach = auth_coach(session, auth)
+    coach = await auth_coach(session, auth)
 
     # Generate refresh token containing username and password for persistence
     refresh_token = create_jwt({"username": auth.username, "password": auth.password})
     
-    # Generate access token containing refresh token reference and current timestamp
-    access_token = create_jwt(
-        {"refresh_token": refresh_token, "timestamp": int(datetime.now().timestamp())}
-    )
+    # Generate access token for the coach, expiring with the session
+    expires_at = int(datetime.now().timestamp()) + settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60
+    access_token = create_access_token(coach.id, expires_at)
 
     # Check if a session already exists for this refresh token
-    coach_session = session.get(CoachSession, refresh_token)
+    coach_session = await session.get(CoachSession, refresh_token)
     if not coach_session:
         # Create new session record if none exists
         coach_session = CoachSession(
             coach=coach.id,
             access_token=access_token,
             refresh_token=refresh_token,
-            expires_at=int(datetime.now().timestamp()) + settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+            expires_at=expires_at,
         )
-        session.add(coach_session)
-        session.commit()
-        session.refresh(coach_session)
     else:
-        # Update existing session with new access token and expiration
+        # Update existing session with new access token and expiration,
+        # the previous access token stops working
+        session_cache.discard(coach_session.access_token)
         coach_session.access_token = access_token
-        coach_session.expires_at = int(datetime.now().timestamp()) + settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60
+        coach_session.expires_at = expires_at
+    session.add(coach_session)
+    await session.commit()
+    session_cache.put(access_token, coach, expires_at)
 
     # Create public response object excluding sensitive fields
     coach_session_public = CoachSessionPublic(
@@ -68,7 +71,9 @@ def post_login(*, session: Session = Depends(get_session), auth: AuthCreate):
 
 
 @router.post("/token")
-def post_token(*, session: Session = Depends(get_session), token: TokenCreate):
+async def post_token(
+    *, session: AsyncSession = Depends(get_session), token: TokenCreate
+):
     """
     Refreshes an access token using a valid refresh token.
     
@@ -83,31 +88,61 @@ def post_token(*, session: Session = Depends(get_session), token: TokenCreate):
         HTTPException: 401 if token is invalid, expired, or username doesn't match
     """
     # Retrieve the existing coach session using the refresh token
-    coach_session = session.get(CoachSession, token.refresh_token)
+    coach_session = await session.get(CoachSession, token.refresh_token)
     if not coach_session:
         raise HTTPException(401, "Unauthorized")
 
     # Verify that the username matches the session owner
-    if session.get(Coach, coach_session.coach).username != token.username:
+    coach = await session.get(Coach, coach_session.coach)
+    if coach is None or coach.username != token.username:
         raise HTTPException(401, "Unauthorized")
 
     # Check if the session has expired
     if datetime.now().timestamp() > coach_session.expires_at:
         raise HTTPException(401, "Token expired")
 
-    # Create new session data with refreshed access token
-    coach_session = CoachSessionPublic(
-        access_token=create_jwt(
-            {"refresh_token": token.refresh_token, "timestamp": datetime.now().timestamp()}
-        ),
+    # Replace the session's access token and extend the session
+    expires_at = int(datetime.now().timestamp()) + settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60
+    session_cache.discard(coach_session.access_token)
+    coach_session.access_token = create_access_token(coach.id, expires_at)
+    coach_session.expires_at = expires_at
+    session.add(coach_session)
+    await session.commit()
+    session_cache.put(coach_session.access_token, coach, expires_at)
+
+    return CoachSessionPublic(
+        access_token=coach_session.access_token,
         refresh_token=token.refresh_token,
         expires_in=settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60,
     )
-    return coach_session
+
+
+@router.post("/logout", response_model=Status)
+async def post_logout(
+    *, request: Request, session: AsyncSession = Depends(get_session)
+) -> Status:
+    """
+    Ends the session of the access token in the Authorization header.
+
+    Args:
+        session: Database session dependency
+
+    Returns:
+        Status: success, also when the session had already ended
+    """
+    access_token = bearer_token(request)
+    await session.exec(
+        delete(CoachSession).where(col(CoachSession.access_token) == access_token)
+    )
+    await session.commit()
+    session_cache.discard(access_token)
+    return Status(status="success", detail="Logged out")
 
 
 @router.post("/register")
-def post_register(*, session: Session = Depends(get_session), new_coach: CoachCreate):
+async def post_register(
+    *, session: AsyncSession = Depends(get_session), new_coach: CoachCreate
+):
     """
     Registers a new coach and returns a session.
     
@@ -122,7 +157,10 @@ def post_register(*, session: Session = Depends(get_session), new_coach: CoachCr
         HTTPException: 400 if username already exists
     """
     # Check if username already exists in the database
-    if session.exec(select(Coach).where(col(Coach.username) == new_coach.username)).first():
+    existing_coach = await session.exec(
+        select(Coach).where(col(Coach.username) == new_coach.username)
+    )
+    if existing_coach.first():
         raise HTTPException(status_code=400, detail="Username already exists")
 
     # Create new coach record with hashed password
@@ -131,7 +169,7 @@ def post_register(*, session: Session = Depends(get_session), new_coach: CoachCr
         password=sha256(new_coach.password.encode()).hexdigest()
     )
     session.add(coach)
-    session.commit()
-    session.refresh(coach)
+    await session.commit()
+    await session.refresh(coach)
 
     return Status(status="success", detail="Coach registered successfully")
@@ -1,42 +1,96 @@
-from typing import List
+from typing import Any, Dict, List
 
-from fastapi import APIRouter, Depends, HTTPException
-from fastapi_pagination import paginate
-from sqlmodel import Session, col, select
+from fastapi import APIRouter, Depends, HTTPException, Request
+from sqlalchemy.orm import selectinload
+from sqlmodel import col, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from app.api.deps import VolPage
+from app.api.deps import Fields, VolPage, paginate_rows, parse_fields
+from app.core.cache import catalog_cache
+from app.core.changes import record_changes
 from app.core.db import get_session
 from app.core.logger import logger
 from app.data.create import ExerciseCreate
 from app.data.db import Exercise, ExerciseToSubtech, Subtech
 from app.data.public import ExercisePublic, ExerciseToSubtechPublic
 from app.data.update import ExerciseUpdate
-from app.data.utils import NameWithId, Status
+from app.data.utils import Entity, NameWithId, Status
 
 router = APIRouter()
 
+# load exercise -> subtechs -> subtech in a fixed number of queries
+exercise_load_options = (
+    selectinload(Exercise.subtechs).selectinload(ExerciseToSubtech.subtech),
+)
+exercise_public_columns = [
+    column
+    for column in Exercise.__table__.columns
+    if column.name in ExercisePublic.model_fields
+]
+
+
+async def to_public_exercises(
+    session: AsyncSession, rows, with_subtechs: bool = True
+) -> List[Dict[str, Any]]:
+    """Shape exercise rows like ExercisePublic, loading subtech links in one query."""
+    exercises = {row.id: row._asdict() for row in rows}
+    if not with_subtechs:
+        return list(exercises.values())
+
+    for exercise in exercises.values():
+        exercise["subtechs"] = []
+    links = await session.exec(
+        select(ExerciseToSubtech.exercise_id, Subtech.id, Subtech.name)
+        .join(Subtech, col(Subtech.id) == col(ExerciseToSubtech.subtech_id))
+        .where(col(ExerciseToSubtech.exercise_id).in_(exercises))
+        .order_by(col(ExerciseToSubtech.subtech_id))
+    )
+    for exercise_id, subtech_id, subtech_name in links.all():
+        exercises[exercise_id]["subtechs"].append(
+            {"exercise": None, "subtech": {"id": subtech_id, "name": subtech_name}}
+        )
+    return list(exercises.values())
+
 
 @router.get("/")
 async def get_exercises(
-    *, session: Session = Depends(get_session)
+    *,
+    request: Request,
+    session: AsyncSession = Depends(get_session),
+    fields: Fields = None,
 ) -> VolPage[ExercisePublic]:
-    """Get all exercises"""
-    db_exercises = session.exec(select(Exercise).where(col(Exercise.id) >= 0)).all()
-    exersises = []
-    for db_exercise in db_exercises:
-        exercise = ExercisePublic(**db_exercise.model_dump(exclude=["subtech", "tech"]))
-        exercise.subtechs = []
-        for exr_to_sub in db_exercise.subtechs:
-            subtech = NameWithId(id=exr_to_sub.subtech.id, name=exr_to_sub.subtech.name)
-            exr_to_sub_public = ExerciseToSubtechPublic(subtech=subtech)
-            exercise.subtechs.append(exr_to_sub_public)
-        exersises.append(exercise)
-    return paginate(exersises)
+    """Get all exercises
+
+    :param fields: When provided, returns only these fields (subtechs are
+        loaded only when requested)
+    """
+    selected = parse_fields(fields, ExercisePublic.model_fields)
+    statement = (
+        select(
+            *[
+                column
+                for column in exercise_public_columns
+                if selected is None or column.name in selected
+            ]
+        )
+        .where(col(Exercise.id) >= 0)
+        .order_by(col(Exercise.id))
+    )
+    with_subtechs = selected is None or "subtechs" in selected
+
+    async def build() -> Dict[str, Any]:
+        page = await paginate_rows(session, statement)
+        page["items"] = await to_public_exercises(session, page["items"], with_subtechs)
+        return page
+
+    # sparse pages don't satisfy the full model, see page_response
+    model = VolPage[ExercisePublic] if selected is None else None
+    return await catalog_cache.response(request, session, build, model)
 
 
 @router.get("/{exercise_id}")
 async def get_exercise(
-    *, session: Session = Depends(get_session), exercise_id: str
+    *, request: Request, session: AsyncSession = Depends(get_session), exercise_id: int
 ) -> ExercisePublic:
     """
     Retrieve an exercise by its ID.
@@ -53,26 +107,33 @@ async def get_exercise(
         HTTPException: If the exercise with the given ID is not found, raises a 404 error.
     """
     """Get exercise by id"""
-    db_exercise = session.get(Exercise, exercise_id)
-    if not db_exercise:
-        raise HTTPException(status_code=404, detail="Exercise not found")
-    exercise = ExercisePublic(**db_exercise.model_dump(exclude=["subtechs"]))
-    exercise.subtechs = []
-    for exr_to_sub in db_exercise.subtechs:
-        subtech = NameWithId(id=exr_to_sub.subtech.id, name=exr_to_sub.subtech.name)
-        exr_to_sub_public = ExerciseToSubtechPublic(subtech=subtech)
-        exercise.subtechs.append(exr_to_sub_public)
-    return exercise
+
+    async def build() -> ExercisePublic:
+        db_exercise = await session.get(
+            Exercise, exercise_id, options=exercise_load_options
+        )
+        if not db_exercise:
+            raise HTTPException(status_code=404, detail="Exercise not found")
+        exercise = ExercisePublic(**db_exercise.model_dump(exclude=["subtechs"]))
+        exercise.subtechs = []
+        for exr_to_sub in db_exercise.subtechs:
+            subtech = NameWithId(
+                id=exr_to_sub.subtech.id, name=exr_to_sub.subtech.name
+            )
+            exr_to_sub_public = ExerciseToSubtechPublic(subtech=subtech)
+            exercise.subtechs.append(exr_to_sub_public)
+        return exercise
+
+    return await catalog_cache.response(request, session, build, ExercisePublic)
 
 
 @router.post("/", response_model=Status)
 async def create_exercise(
-    *, session: Session = Depends(get_session), new_exercise: ExerciseCreate
+    *, session: AsyncSession = Depends(get_session), new_exercise: ExerciseCreate
 ) -> Status:
     """Create new exercise"""
-    new_id = (
-        session.exec(select(col(Exercise.id)).order_by(Exercise.id.desc())).first() or 0
-    ) + 1
+    last_id = await session.exec(select(col(Exercise.id)).order_by(Exercise.id.desc()))
+    new_id = (last_id.first() or 0) + 1
     if new_id < 0:
         new_id = 0
     logger.debug("Creating new exersice with id %s", new_id)
@@ -84,44 +145,48 @@ async def create_exercise(
         raise HTTPException(status_code=404, detail="Subtechs must be unique")
 
     statement = select(Subtech).where(Subtech.id.in_(subtech_ids))
-    subtechs: List[Subtech] = session.exec(statement).all()
+    subtechs: List[Subtech] = (await session.exec(statement)).all()
 
     if len(subtechs) != len(subtech_ids) or None in subtechs:
         raise HTTPException(status_code=404, detail="Subtech not found")
 
     session.add(db_exercise)
-    session.flush()
+    await session.flush()
 
     for subtech in subtech_ids:
         relation = ExerciseToSubtech(exercise_id=new_id, subtech_id=subtech)
         session.add(relation)
         logger.debug("creating new relation: %s - %s", new_id, subtech)
-    session.commit()
+    await record_changes(session, Entity.EXERCISE, [new_id])
+    await catalog_cache.bump(session)
+    await session.commit()
     return Status(status="success", detail="Exercise created")
 
 
 @router.delete("/{exercise_id}")
 async def delete_exercise(
-    *, session: Session = Depends(get_session), exercise_id: str
+    *, session: AsyncSession = Depends(get_session), exercise_id: int
 ) -> Status:
     """Delete exercise by id"""
-    exercise = session.get(Exercise, exercise_id)
+    exercise = await session.get(Exercise, exercise_id)
     if exercise is None:
         raise HTTPException(status_code=404, detail="Exercise not found")
-    session.delete(exercise)
-    session.commit()
+    await session.delete(exercise)
+    await record_changes(session, Entity.EXERCISE, [exercise_id], deleted=True)
+    await catalog_cache.bump(session)
+    await session.commit()
     return Status(status="success", detail="Exercise deleted")
 
 
 @router.put("/{exercise_id}")
 async def update_exercise(
     *,
-    session: Session = Depends(get_session),
-    exercise_id: str,
+    session: AsyncSession = Depends(get_session),
+    exercise_id: int,
     new_exercise: ExerciseUpdate
 ) -> Status:
     """Update exercise by id"""
-    exercise = session.get(Exercise, exercise_id)
+    exercise = await session.get(Exercise, exercise_id)
     if exercise is None:
         raise HTTPException(status_code=404, detail="Exercise not found")
 
@@ -134,13 +199,15 @@ async def update_exercise(
     # Handle subtechs relationship if provided
     if new_exercise.subtechs is not None:
         # Delete existing relationships
-        existing_relations = session.exec(
-            select(ExerciseToSubtech).where(
-                ExerciseToSubtech.exercise_id == exercise.id
+        existing_relations = (
+            await session.exec(
+                select(ExerciseToSubtech).where(
+                    ExerciseToSubtech.exercise_id == exercise.id
+                )
             )
         ).all()
         for relation in existing_relations:
-            session.delete(relation)
+            await session.delete(relation)
 
         # Create new relationships
         for subtech_data in new_exercise.subtechs:
@@ -161,6 +228,8 @@ async def update_exercise(
                 session.add(exercise_to_subtech)
 
     session.add(exercise)
-    session.commit()
+    await record_changes(session, Entity.EXERCISE, [exercise_id])
+    await catalog_cache.bump(session)
+    await session.commit()
 
     return Status(status="success", detail="Exercise updated")
@@ -1,74 +1,130 @@
-from typing import List
+from typing import Any, Dict, List, Optional, Set
 
 from fastapi import APIRouter, HTTPException, Depends
-from fastapi_pagination import Page, paginate
-from sqlmodel import select, Session, delete, col, or_
-
-from app.core.db import engine, get_session
-from app.data.db import Team, Game, Player, Action
-from app.data.utils import Status, NameWithId
-from app.data.update import GameUpdate
+from fastapi_pagination import Page
+from sqlalchemy.orm import aliased
+from sqlmodel import (
+    case,
+    col,
+    delete,
+    func,
+    insert,
+    literal,
+    or_,
+    select,
+    update,
+)
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.api.deps import Fields, page_response, paginate_rows, parse_fields
+from app.core.algorithm import invalidate_player_sums
+from app.core.changes import record_changes
+from app.core.db import get_session, get_write_session
+from app.core.dialect import insert_ignore, temp_id_map
+from app.data.db import Team, Game, Player, Action, TeamToPlayer
+from app.data.utils import Entity, Status
+from app.data.update import GameCloneOptions, GameUpdate
 from app.data.create import GameCreate
 from app.data.public import GamePublic
 from app.core.logger import logger
 
 router = APIRouter()
 
+game_public_columns = [
+    column
+    for column in Game.__table__.columns
+    if column.name in GamePublic.model_fields
+]
+
+
+def to_public_games(rows, fields: Optional[Set[str]] = None) -> List[Dict[str, Any]]:
+    """Shape game rows like GamePublic."""
+    games = []
+    for row in rows:
+        game = row._asdict()
+        if fields is not None and "from_timestamp" not in fields:
+            # only selected for ordering
+            game.pop("from_timestamp")
+        for team in ("team_a", "team_b"):
+            if team not in game:
+                continue
+            name = game.pop(team + "_name")
+            game[team] = {"id": game[team], "name": name} if name is not None else None
+        games.append(game)
+    return games
+
+
+def games_statement(fields: Optional[Set[str]] = None):
+    """Select flat game rows, joining team names only when they are selected."""
+    statement = select(
+        *[
+            column
+            for column in game_public_columns
+            if fields is None
+            or column.name in fields
+            # DISTINCT needs the ORDER BY column in the select list
+            or column.name == "from_timestamp"
+        ]
+    )
+    for team in ("team_a", "team_b"):
+        if fields is not None and team not in fields:
+            continue
+        team_alias = aliased(Team)
+        statement = statement.add_columns(
+            team_alias.name.label(team + "_name")
+        ).outerjoin(team_alias, col(team_alias.id) == getattr(Game, team))
+    return statement
+
 
 @router.get("/", response_model=Page[GamePublic])
 async def get_games(
     *,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
     player_id: int = None,
     team_id: int = None,
+    fields: Fields = None,
 ) -> Page[GamePublic]:
     """Get all games
 
     :param player_id: When provided, returns games where player is in team
     :param team_id: When provided, returns games where team is playing
+    :param fields: When provided, returns only these fields (team names are
+        joined only when team_a/team_b are requested)
 
-    :return: List of games (if nether player_id nor team_id provided, returns all games)
+    :return: List of games (if nether player_id nor team_id provided, returns all games),
+        ordered by from_timestamp
     """
-    games = []
+    selected = parse_fields(fields, GamePublic.model_fields)
+    statement = games_statement(selected)
     if player_id:
-        db_games = []
-        db_games_ids = set()
-        player = session.get(Player, player_id)
-        for team_to_player in player.teams:
-            t_games = session.exec(
-                select(Game).where(
-                    or_(
-                        Game.team_a == team_to_player.team_id,
-                        Game.team_b == team_to_player.team_id,
-                    )
-                )
-            ).all()
-            for t_game in t_games:
-                if t_game.id not in db_games_ids:
-                    db_games_ids.add(t_game.id)
-                    db_games.append(t_game)
+        statement = (
+            statement.join(
+                TeamToPlayer,
+                or_(
+                    col(TeamToPlayer.team_id) == col(Game.team_a),
+                    col(TeamToPlayer.team_id) == col(Game.team_b),
+                ),
+            )
+            .where(col(TeamToPlayer.player_id) == player_id)
+            .distinct()
+        )
     elif team_id:
-        db_games = session.exec(
-            select(Game).where(or_(Game.team_a == team_id, Game.team_b == team_id))
-        ).all()
-    else:
-        db_games = session.exec(select(Game)).all()
-    for db_game in db_games:
-        game = GamePublic(**db_game.model_dump(exclude={"team_a", "team_b"}))
-        team_a = session.get(Team, db_game.team_a)
-        if team_a:
-            game.team_a = NameWithId(id=db_game.team_a, name=team_a.name)
-        team_b = session.get(Team, db_game.team_b)
-        if team_b:
-            game.team_b = NameWithId(id=db_game.team_b, name=team_b.name)
-        games.append(game)
-    return paginate(games)
+        statement = statement.where(
+            or_(col(Game.team_a) == team_id, col(Game.team_b) == team_id)
+        )
+    statement = statement.order_by(col(Game.from_timestamp), col(Game.id))
+
+    page = await paginate_rows(session, statement)
+    page["items"] = to_public_games(page["items"], selected)
+    return page_response(page, partial=selected is not None)
 
 
 @router.get("/{game_id}")
-async def get_game(*, session: Session = Depends(get_session), game_id: str) -> Game:
+async def get_game(
+    *, session: AsyncSession = Depends(get_session), game_id: int
+) -> Game:
     """Get game by id"""
-    game = session.get(Game, game_id)
+    game = await session.get(Game, game_id)
     if not game:
         raise HTTPException(status_code=404, detail="Game not found")
     return game
@@ -76,17 +132,20 @@ async def get_game(*, session: Session = Depends(get_session), game_id: str) ->
 
 @router.post("/", response_model=Status)
 async def create_game(
-    *, session: Session = Depends(get_session), new_game: GameCreate
+    *, session: AsyncSession = Depends(get_session), new_game: GameCreate
 ) -> Status:
-    """Create new game"""
+    """Create new game
+
+    A game with an already uploaded client_id is not inserted again.
+    """
     game = Game(**new_game.model_dump(exclude={"team_a", "team_b"}))
 
     if game.from_timestamp and game.to_timestamp:
         if game.from_timestamp > game.to_timestamp:
             raise HTTPException(status_code=400, detail="Incorrect timestamp")
 
-    team_a = session.get(Team, new_game.team_a)
-    team_b = session.get(Team, new_game.team_b)
+    team_a = await session.get(Team, new_game.team_a)
+    team_b = await session.get(Team, new_game.team_b)
 
     if not team_a:
         raise HTTPException(status_code=404, detail="Team A not found")
@@ -99,37 +158,51 @@ async def create_game(
     game.team_a = team_a.id
     game.team_b = team_b.id
 
-    session.add(game)
-    session.commit()
-
+    created = (
+        await session.exec(
+            insert_ignore(Game, "client_id")
+            .values(**game.model_dump(exclude={"id"}))
+            .returning(col(Game.id))
+        )
+    ).scalar()
+    if created is not None:
+        await record_changes(session, Entity.GAME, [created])
+    await session.commit()
+
+    if created is None:
+        return Status(status="success", detail="Game already exists")
     return Status(status="success", detail="Game created")
 
 
 @router.delete("/{game_id}")
 async def delete_game(
-    *, session: Session = Depends(get_session), game_id: str
+    *, session: AsyncSession = Depends(get_session), game_id: int
 ) -> Status:
     """Delete game by id"""
-    game = session.get(Game, game_id)
+    game = await session.get(Game, game_id)
     if game is None:
         raise HTTPException(status_code=404, detail="Game not found")
 
     # Delete related actions
-    session.exec(delete(Action).where(Action.game == game_id))
-    session.commit()
+    deleted = await session.exec(
+        delete(Action).where(Action.game == game_id).returning(col(Action.id))
+    )
+    await record_changes(session, Entity.ACTION, deleted.scalars().all(), deleted=True)
+    await session.commit()
 
     # Delete the game
-    session.delete(game)
-    session.commit()
+    await session.delete(game)
+    await record_changes(session, Entity.GAME, [game_id], deleted=True)
+    await session.commit()
     return Status(status="success", detail="Game deleted")
 
 
 @router.put("/{game_id}")
 async def update_game(
-    *, session: Session = Depends(get_session), game_id: str, new_game: GameUpdate
+    *, session: AsyncSession = Depends(get_session), game_id: int, new_game: GameUpdate
 ) -> Status:
     """Update game by id"""
-    game: Game = session.get(Game, game_id)
+    game: Game = await session.get(Game, game_id)
     if game is None:
         raise HTTPException(status_code=404, detail="Game not found")
 
@@ -139,58 +212,186 @@ async def update_game(
 
     session.add(game)
 
-    team_a: Team = session.get(Team, new_game.team_a)
-    team_b: Team = session.get(Team, new_game.team_b)
-    
-    team_a_players = list(map(lambda x: x.player_id, team_a.players))
-    team_b_players = list(map(lambda x: x.player_id, team_b.players))
-
     if new_game.player_updates:
-        db_actions: List[Action] = session.exec(
-            select(Action).where(col(Action.game) == game_id)
+        player_map = {
+            update.player_before: update.player_after
+            for update in new_game.player_updates
+        }
+        found = (
+            await session.exec(
+                select(Player.id).where(col(Player.id).in_(player_map.values()))
+            )
         ).all()
-        for action in db_actions:
-            for player_update in new_game.player_updates:
-                if action.player != player_update.player_before:
-                    continue
-
-                action.player = player_update.player_after
-
-                if player_update.player_after in team_a_players:
-                    action.team = team_a.id
-                elif player_update.player_after in team_b_players:
-                    action.team = team_b.id
+        if len(found) != len(set(player_map.values())):
+            raise HTTPException(status_code=404, detail="Player not found")
+        # moved actions go to the new player's team in this game, if any
+        memberships = (
+            await session.exec(
+                select(TeamToPlayer.player_id, TeamToPlayer.team_id).where(
+                    col(TeamToPlayer.player_id).in_(player_map.values()),
+                    col(TeamToPlayer.team_id).in_([game.team_a, game.team_b]),
+                )
+            )
+        ).all()
+        new_teams = {}
+        for team in (game.team_b, game.team_a):
+            for player_id, team_id in memberships:
+                if team_id == team:
+                    new_teams[player_id] = team_id
+        team_map = {
+            before: new_teams[after]
+            for before, after in player_map.items()
+            if after in new_teams
+        }
+
+        async with temp_id_map(
+            session, "game_player_map", player_map
+        ) as players, temp_id_map(session, "game_team_map", team_map) as teams:
+            new_player = (
+                select(players.c.new_id)
+                .where(players.c.old_id == col(Action.player))
+                .scalar_subquery()
+            )
+            new_team = (
+                select(teams.c.new_id)
+                .where(teams.c.old_id == col(Action.player))
+                .scalar_subquery()
+            )
+            moved = await session.exec(
+                update(Action)
+                .where(
+                    col(Action.game) == game_id,
+                    col(Action.player).in_(select(players.c.old_id)),
+                )
+                .values(
+                    player=new_player,
+                    team=func.coalesce(new_team, col(Action.team)),
+                )
+                .returning(col(Action.id))
+            )
+            moved_ids = moved.scalars().all()
+        await invalidate_player_sums(
+            session, set(player_map) | set(player_map.values())
+        )
+        await record_changes(session, Entity.ACTION, moved_ids)
 
-            session.add(action)
+    await record_changes(session, Entity.GAME, [game_id])
+    await session.commit()
 
-    session.commit()
+    return Status(status="success", detail="Game updated")
 
-    return Status(status="success", detail="Team updated")
 
+async def clone_game(
+    session: AsyncSession, game_id: int, options: GameCloneOptions
+) -> int:
+    """Copy a game and its actions in one transaction, return the new game id.
 
-@router.get("/clone/{game_id}")
-async def deep_clone_game(
-    *, session: Session = Depends(get_session), game_id: str
-) -> Status:
-    """Deep clone game"""
-    game = session.get(Game, game_id)
+    Actions are copied with a single INSERT ... SELECT. Actions of the
+    source teams move to the replacement teams, players are swapped through
+    a temporary mapping table.
+    """
+    game = await session.get(Game, game_id)
     if game is None:
         raise HTTPException(status_code=404, detail="Game not found")
 
-    game_clone = game.model_dump(exclude={"id"})
-    new_game = Game(**game_clone)
+    team_map = {}
+    for team in ("team_a", "team_b"):
+        new_team = getattr(options, team)
+        if new_team is None or new_team == getattr(game, team):
+            continue
+        if await session.get(Team, new_team) is None:
+            raise HTTPException(status_code=404, detail="Team not found")
+        team_map[getattr(game, team)] = new_team
+    player_map = {
+        update.player_before: update.player_after for update in options.players
+    }
+    if player_map:
+        found = (
+            await session.exec(
+                select(Player.id).where(col(Player.id).in_(player_map.values()))
+            )
+        ).all()
+        if len(found) != len(set(player_map.values())):
+            raise HTTPException(status_code=404, detail="Player not found")
 
+    new_game = Game(**game.model_dump(exclude={"id", "client_id"}))
+    new_game.team_a = team_map.get(game.team_a, game.team_a)
+    new_game.team_b = team_map.get(game.team_b, game.team_b)
     session.add(new_game)
-    session.commit()
-    session.refresh(new_game)
+    await session.flush()
     logger.debug(f"Cloning game {game_id} with data: {new_game}")
 
-    for action in session.exec(select(Action).where(Action.game == game_id)).all():
-        action_clone = action.model_dump(exclude={"id", "game"})
-        action_clone["game"] = new_game.id
-        new_action = Action(**action_clone)
-        session.add(new_action)
+    async with temp_id_map(session, "clone_player_map", player_map) as players:
+        team = col(Action.team)
+        if team_map:
+            team = case(team_map, value=col(Action.team), else_=col(Action.team))
+        rows = (
+            select(
+                col(Action.subtech),
+                col(Action.from_zone),
+                col(Action.to_zone),
+                col(Action.impact),
+                col(Action.coach),
+                literal(new_game.id),
+                team,
+                func.coalesce(players.c.new_id, col(Action.player)),
+            )
+            .outerjoin(players, players.c.old_id == col(Action.player))
+            .where(col(Action.game) == game_id)
+            .order_by(col(Action.id))
+        )
+        await session.exec(
+            insert(Action).from_select(
+                [
+                    "subtech",
+                    "from_zone",
+                    "to_zone",
+                    "impact",
+                    "coach",
+                    "game",
+                    "team",
+                    "player",
+                ],
+                rows,
+            )
+        )
+    await record_changes(session, Entity.GAME, [new_game.id])
+    await record_changes(
+        session,
+        Entity.ACTION,
+        select(Action.id).where(col(Action.game) == new_game.id),
+    )
+    await session.commit()
+    return new_game.id
+
+
+@router.get("/clone/{game_id}", deprecated=True)
+async def deep_clone_game(
+    *, session: AsyncSession = Depends(get_write_session), game_id: int
+) -> Status:
+    """Deep clone game
+
+    Deprecated, a GET should not write: use POST /games/clone/{game_id},
+    with {} as the body for a plain copy.
+
+    Returns:
+        Status: detail is the id of the new game
+    """
+    new_game_id = await clone_game(session, game_id, GameCloneOptions())
+    return Status(status="success", detail=str(new_game_id))
 
-    session.commit()
 
-    return Status(status="success", detail="Game cloned successfully")
+@router.post("/clone/{game_id}")
+async def deep_clone_game_with_options(
+    *,
+    session: AsyncSession = Depends(get_session),
+    game_id: int,
+    options: GameCloneOptions,
+) -> Status:
+    """Deep clone game into other teams and/or with other players
+
+    Returns:
+        Status: detail is the id of the new game
+    """
+    new_game_id = await clone_game(session, game_id, options)
+    return Status(status="success", detail=str(new_game_id))
@@ -1,10 +1,16 @@
-from fastapi import APIRouter, HTTPException, Depends
-from fastapi_pagination import Page, paginate
-from sqlmodel import select, Session
+from typing import Any, Dict, List
 
-from app.core.db import engine
-from app.data.db import Player
-from app.data.utils import Status
+from fastapi import APIRouter, HTTPException, Depends
+from fastapi_pagination import Page
+from sqlalchemy.orm import selectinload
+from sqlmodel import select, col
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.api.deps import Fields, page_response, paginate_rows, parse_fields
+from app.core.cache import bootstrap_cache
+from app.core.changes import record_changes
+from app.data.db import Player, Team, TeamToPlayer
+from app.data.utils import Entity, Status
 from app.data.create import PlayerCreate
 from app.data.update import PlayerUpdate
 from app.data.public import PlayerPublic, TeamToPlayerPublic
@@ -15,32 +21,82 @@ from app.core.logger import logger
 
 router = APIRouter()
 
+# load player -> teams -> team/player in a fixed number of queries
+player_load_options = (
+    selectinload(Player.teams).selectinload(TeamToPlayer.team),
+    selectinload(Player.teams).selectinload(TeamToPlayer.player),
+)
+player_public_columns = [
+    column
+    for column in Player.__table__.columns
+    if column.name in PlayerPublic.model_fields
+]
+
+
+async def to_public_players(
+    session: AsyncSession, rows, with_teams: bool = True
+) -> List[Dict[str, Any]]:
+    """Shape player rows like PlayerPublic, loading team relations in one query."""
+    players = {row.id: row._asdict() for row in rows}
+    if not with_teams:
+        return list(players.values())
+
+    for player in players.values():
+        player["teams"] = []
+    links = await session.exec(
+        select(
+            TeamToPlayer.player_id,
+            Player.first_name,
+            TeamToPlayer.team_id,
+            Team.name,
+            TeamToPlayer.amplua,
+        )
+        .join(Player, col(Player.id) == col(TeamToPlayer.player_id))
+        .join(Team, col(Team.id) == col(TeamToPlayer.team_id))
+        .where(col(TeamToPlayer.player_id).in_(players))
+        .order_by(col(TeamToPlayer.team_id))
+    )
+    for player_id, first_name, team_id, team_name, amplua in links.all():
+        players[player_id]["teams"].append(
+            {
+                "team": {"id": team_id, "name": team_name},
+                "player": {"id": player_id, "name": first_name},
+                "amplua": amplua,
+            }
+        )
+    return list(players.values())
+
 
 @router.get("/", response_model=Page[PlayerPublic])
-async def get_players(*, session: Session = Depends(get_session)) -> Page[PlayerPublic]:
+async def get_players(
+    *, session: AsyncSession = Depends(get_session), fields: Fields = None
+) -> Page[PlayerPublic]:
     """Get all players
     
     Returns: 
         Page[PlayerPublic]: list of players
         player.teams: list of teams where player played (see NameWithId and TeamToPlayerPublic)
+
+    :param fields: When provided, returns only these fields (teams are loaded
+        only when requested)
     """
-    db_players = session.exec(select(Player)).all()
-    players = []
-    for t_player in db_players:
-        player = PlayerPublic(**t_player.model_dump(exclude={"teams"}))
-        player.teams = []
-        for t_team_player in t_player.teams:
-            team_player_player = NameWithId(id=t_team_player.player.id, name=t_team_player.player.first_name)
-            team_player_team = NameWithId(id=t_team_player.team.id, name=t_team_player.team.name)
-            team_player = TeamToPlayerPublic(player=team_player_player, team=team_player_team, amplua=t_team_player.amplua)
-            player.teams.append(team_player)
-        players.append(player)
-    return paginate(players)
+    selected = parse_fields(fields, PlayerPublic.model_fields)
+    statement = select(
+        *[
+            column
+            for column in player_public_columns
+            if selected is None or column.name in selected
+        ]
+    ).order_by(col(Player.id))
+    with_teams = selected is None or "teams" in selected
+    page = await paginate_rows(session, statement)
+    page["items"] = await to_public_players(session, page["items"], with_teams)
+    return page_response(page, partial=selected is not None)
 
 
 @router.get("/{player_id}", response_model=PlayerPublic)
 async def get_player(
-    *, session: Session = Depends(get_session), player_id: str
+    *, session: AsyncSession = Depends(get_session), player_id: int
 ) -> PlayerPublic:
     """Get player by id
     
@@ -48,7 +104,7 @@ async def get_player(
         PlayerPublic: player
         player.teams: list of teams where player played (see NameWithId and TeamToPlayerPublic)
     """
-    db_player = session.get(Player, player_id)
+    db_player = await session.get(Player, player_id, options=player_load_options)
 
     if db_player is None:
         raise HTTPException(status_code=404, detail="Player not found")
@@ -66,35 +122,49 @@ async def get_player(
 
 @router.post("/")
 async def new_player(
-    *, session: Session = Depends(get_session), player: PlayerCreate
+    *, session: AsyncSession = Depends(get_session), player: PlayerCreate
 ) -> Status:
     """Create new player"""
     new_player = Player(**player.model_dump())
-    with Session(engine) as session:
-        session.add(new_player)
-        session.commit()
+    session.add(new_player)
+    await session.flush()
+    await record_changes(session, Entity.PLAYER, [new_player.id])
+    await bootstrap_cache.bump(session)
+    await session.commit()
     return Status(status="success")
 
 
 @router.delete("/{player_id}")
 async def delete_player(
-    *, session: Session = Depends(get_session), player_id: str
+    *, session: AsyncSession = Depends(get_session), player_id: int
 ) -> Status:
     """Delete player by id"""
-    player = session.get(Player, player_id)
+    player = await session.get(Player, player_id)
     if player is None:
         raise HTTPException(status_code=404, detail="Player not found")
-    session.delete(player)
-    session.commit()
+    # the player leaves the rosters of these teams
+    team_ids = (
+        await session.exec(
+            select(TeamToPlayer.team_id).where(col(TeamToPlayer.player_id) == player_id)
+        )
+    ).all()
+    await session.delete(player)
+    await record_changes(session, Entity.TEAM, team_ids)
+    await record_changes(session, Entity.PLAYER, [player_id], deleted=True)
+    await bootstrap_cache.bump(session)
+    await session.commit()
     return Status(status="success")
 
 
 @router.put("/{player_id}")
 async def update_player(
-    *, session: Session = Depends(get_session), player_id: str, new_player: PlayerUpdate
+    *,
+    session: AsyncSession = Depends(get_session),
+    player_id: int,
+    new_player: PlayerUpdate,
 ) -> Status:
     """Update player by id"""
-    player = session.get(Player, player_id)
+    player = await session.get(Player, player_id)
     if player is None:
         raise HTTPException(status_code=404, detail="Player not found")
     else:
@@ -103,6 +173,8 @@ async def update_player(
                 continue
             setattr(player, field, value)
         session.add(player)
-        session.commit()
-        session.refresh(player)
+        await record_changes(session, Entity.PLAYER, [player_id])
+        await bootstrap_cache.bump(session)
+        await session.commit()
+        await session.refresh(player)
     return Status(status="success")
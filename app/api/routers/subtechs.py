@@ -1,12 +1,15 @@
 from typing import Optional
 
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Request
 from fastapi_pagination import Page, paginate
-from sqlmodel import select, Session
+from sqlmodel import col, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
+from app.core.cache import catalog_cache
+from app.core.changes import record_changes
 from app.core.db import get_session
-from app.data.db import Subtech, Tech
-from app.data.utils import Status
+from app.data.db import ExerciseToSubtech, Subtech, Tech
+from app.data.utils import Entity, Status
 from app.data.update import SubtechUpdate
 from app.data.create import SubtechCreate
 from app.data.public import SubtechPublic
@@ -18,82 +21,117 @@ router = APIRouter()
 
 @router.get("/", response_model=Page[SubtechPublic])
 async def get_subtechs(
-    *, session: Session = Depends(get_session), tech_id: Optional[str] = None
+    *,
+    request: Request,
+    session: AsyncSession = Depends(get_session),
+    tech_id: Optional[int] = None
 ) -> Page[SubtechPublic]:
     """Get all subtechs"""
-    if tech_id:
-        db_subtechs = session.exec(select(Subtech).where(Subtech.tech == tech_id)).all()
-    else:
-        db_subtechs = session.exec(select(Subtech)).all()
-    subtechs = []
-    for db_subtech in db_subtechs:
-        logger.debug(f"DB Subtech: {db_subtech}")
-        subtech = SubtechPublic(**db_subtech.model_dump(exclude={"tech"}))
-        subtech.tech = NameWithId(
-            id=db_subtech.tech, name=session.get(Tech, db_subtech.tech).name
-        )
-        subtechs.append(subtech)
 
-    logger.info(f"Subtechs: {subtechs}")
-    return paginate(subtechs)
+    async def build() -> Page[SubtechPublic]:
+        statement = select(Subtech).order_by(col(Subtech.id))
+        if tech_id:
+            statement = statement.where(Subtech.tech == tech_id)
+        db_subtechs = (await session.exec(statement)).all()
+        subtechs = []
+        for db_subtech in db_subtechs:
+            logger.debug(f"DB Subtech: {db_subtech}")
+            subtech = SubtechPublic(**db_subtech.model_dump(exclude={"tech"}))
+            subtech.tech = NameWithId(
+                id=db_subtech.tech, name=(await session.get(Tech, db_subtech.tech)).name
+            )
+            subtechs.append(subtech)
+
+        logger.info(f"Subtechs: {subtechs}")
+        return paginate(subtechs)
+
+    return await catalog_cache.response(
+        request, session, build, Page[SubtechPublic]
+    )
 
 
 @router.get("/{subtech_id}")
 async def get_subtech(
-    *, session: Session = Depends(get_session), subtech_id: str
+    *, request: Request, session: AsyncSession = Depends(get_session), subtech_id: int
 ) -> SubtechPublic:
     """Get subtech by id"""
-    db_subtech = session.get(Subtech, subtech_id)
-    if not db_subtech:
-        raise HTTPException(status_code=404, detail="Subtech not found")
 
-    subtech = SubtechPublic(**db_subtech.model_dump(exclude={"tech"}))
-    subtech.tech = NameWithId(
-        id=db_subtech.tech, name=session.get(Subtech, db_subtech.tech).name
-    )
-    return subtech
+    async def build() -> SubtechPublic:
+        db_subtech = await session.get(Subtech, subtech_id)
+        if not db_subtech:
+            raise HTTPException(status_code=404, detail="Subtech not found")
+
+        subtech = SubtechPublic(**db_subtech.model_dump(exclude={"tech"}))
+        subtech.tech = NameWithId(
+            id=db_subtech.tech, name=(await session.get(Subtech, db_subtech.tech)).name
+        )
+        return subtech
+
+    return await catalog_cache.response(request, session, build, SubtechPublic)
 
 
 @router.post("/", response_model=Status)
 async def create_subtech(
-    *, session: Session = Depends(get_session), new_subtech: SubtechCreate
+    *, session: AsyncSession = Depends(get_session), new_subtech: SubtechCreate
 ) -> Status:
     """Create new subtech"""
     subtech = Subtech(**new_subtech.model_dump())
     session.add(subtech)
-    session.commit()
+    await catalog_cache.bump(session)
+    await session.commit()
     return Status(status="success", detail="Subtech created")
 
 
 @router.delete("/{subtech_id}")
 async def delete_subtech(
-    *, session: Session = Depends(get_session), subtech_id: str
+    *, session: AsyncSession = Depends(get_session), subtech_id: int
 ) -> Status:
     """Delete subtech by id"""
-    subtech = session.get(Subtech, subtech_id)
+    subtech = await session.get(Subtech, subtech_id)
     if subtech is None:
         raise HTTPException(status_code=404, detail="Subtech not found")
-    session.delete(subtech)
-    session.commit()
+    # the subtech drops out of these exercises' subtech lists
+    exercise_ids = (
+        await session.exec(
+            select(ExerciseToSubtech.exercise_id).where(
+                col(ExerciseToSubtech.subtech_id) == subtech_id
+            )
+        )
+    ).all()
+    await session.delete(subtech)
+    await record_changes(session, Entity.EXERCISE, exercise_ids)
+    await catalog_cache.bump(session)
+    await session.commit()
     return Status(status="success", detail="Subtech deleted")
 
 
 @router.put("/{subtech_id}")
 async def update_subtech(
     *,
-    session: Session = Depends(get_session),
-    subtech_id: str,
+    session: AsyncSession = Depends(get_session),
+    subtech_id: int,
     new_subtech: SubtechUpdate
 ) -> Status:
     """Update subtech by id"""
-    subtech = session.get(Subtech, subtech_id)
+    subtech = await session.get(Subtech, subtech_id)
     if subtech is None:
         raise HTTPException(status_code=404, detail="Subtech not found")
 
+    renamed = new_subtech.name is not None and new_subtech.name != subtech.name
     for field, value in new_subtech.model_dump(exclude_none=True).items():
         setattr(subtech, field, value)
 
     session.add(subtech)
-    session.commit()
+    if renamed:
+        # exercises carry the subtech name in their subtech lists
+        await record_changes(
+            session,
+            Entity.EXERCISE,
+            select(ExerciseToSubtech.exercise_id)
+            .where(col(ExerciseToSubtech.subtech_id) == subtech_id)
+            .distinct(),
+        )
+    await catalog_cache.bump(session)
+    await session.commit()
 
     return Status(status="success", detail="Subtech updated")
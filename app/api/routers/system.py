@@ -1,46 +1,270 @@
+from typing import Any, Awaitable, Callable, Dict, List
 from uuid import UUID
 
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Request
 from fastapi_pagination import Page, paginate
-from sqlmodel import select, Session
+from sqlmodel import select, col
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from app.core.db import engine
-from app.data.db import File
-from app.data.utils import Status
+from app.api.deps import get_coach, require_debug_endpoints
+from app.core.cache import bootstrap_cache
+from app.core.config import settings
+from app.data.db import (
+    Action,
+    ChangeLog,
+    File,
+    Game,
+    Tech,
+    Subtech,
+    Exercise,
+    Player,
+    Team,
+)
+from app.data.utils import Entity, Status
 from app.data.create import FileCreate
-from app.data.public import FilePublic
-from app.core.db import get_session
+from app.data.public import (
+    ChangePublic,
+    ChangesPublic,
+    FilePublic,
+    BootstrapPublic,
+    SlowQueryPublic,
+    TechPublic,
+    SubtechPublic,
+)
+from app.core.db import get_session, get_write_session
 from app.core.logger import logger
+from app.core.profiling import slow_query_summary
 
 from app.api.routers import algorithm
+from app.api.routers.actions import actions_statement, to_public_actions
+from app.api.routers.exercises import exercise_public_columns, to_public_exercises
+from app.api.routers.games import games_statement, to_public_games
+from app.api.routers.players import player_public_columns, to_public_players
+from app.api.routers.teams import team_load_options, to_public_team
 
 router = APIRouter()
 
 
 @router.get("/files", response_model=Page[FilePublic])
-def get_files(*, session: Session = Depends(get_session)) -> Page[FilePublic]:
-    files = session.exec(select(File)).all()
+async def get_files(
+    *, session: AsyncSession = Depends(get_session)
+) -> Page[FilePublic]:
+    files = (await session.exec(select(File))).all()
     return paginate(files)
 
 
 @router.get("/files/{file_id}", response_model=FilePublic)
-def get_file(*, session: Session = Depends(get_session), file_id: UUID) -> FilePublic:
-    file = session.get(File, file_id)
+async def get_file(
+    *, session: AsyncSession = Depends(get_session), file_id: UUID
+) -> FilePublic:
+    file = await session.get(File, file_id)
     if not file:
         raise HTTPException(status_code=404, detail="File not found")
     return file
 
 
 @router.post("/files", response_model=Status)
-def create_file(*, session: Session = Depends(get_session), file: FileCreate) -> Status:
+async def create_file(
+    *, session: AsyncSession = Depends(get_session), file: FileCreate
+) -> Status:
     new_file = File(**file.model_dump())
     session.add(new_file)
-    session.commit()
+    await session.commit()
     return Status(status="success", detail=str(new_file.id))
 
 
+async def build_bootstrap(session: AsyncSession) -> Dict[str, Any]:
+    """Collect all reference data the client needs on start."""
+    techs = (
+        await session.exec(
+            select(
+                *[Tech.__table__.c[name] for name in TechPublic.model_fields]
+            ).order_by(col(Tech.id))
+        )
+    ).all()
+    subtechs = (
+        await session.exec(
+            select(
+                *[Subtech.__table__.c[name] for name in SubtechPublic.model_fields],
+                Tech.name.label("tech_name"),
+            )
+            .outerjoin(Tech, col(Tech.id) == col(Subtech.tech))
+            .order_by(col(Subtech.id))
+        )
+    ).all()
+    exercises = (
+        await session.exec(
+            select(*exercise_public_columns)
+            .where(col(Exercise.id) >= 0)
+            .order_by(col(Exercise.id))
+        )
+    ).all()
+    players = (
+        await session.exec(select(*player_public_columns).order_by(col(Player.id)))
+    ).all()
+    teams = (
+        await session.exec(
+            select(Team).options(*team_load_options).order_by(col(Team.id))
+        )
+    ).all()
+
+    public_subtechs = []
+    for row in subtechs:
+        subtech = row._asdict()
+        subtech["tech"] = {"id": subtech["tech"], "name": subtech.pop("tech_name")}
+        public_subtechs.append(subtech)
+
+    return {
+        "techs": [tech._asdict() for tech in techs],
+        "subtechs": public_subtechs,
+        "exercises": await to_public_exercises(session, exercises),
+        "teams": [to_public_team(team) for team in teams],
+        "players": await to_public_players(session, players),
+    }
+
+
+@router.get("/bootstrap", response_model=BootstrapPublic)
+async def get_bootstrap(
+    *, request: Request, session: AsyncSession = Depends(get_session)
+) -> BootstrapPublic:
+    """Get all reference data (techs, subtechs, exercises, teams, players) at once
+
+    The payload is built once per data version, served gzip compressed when
+    accepted and answers If-None-Match with 304.
+    """
+    return await bootstrap_cache.response(
+        request, session, lambda: build_bootstrap(session), BootstrapPublic
+    )
+
+
+async def load_players(session: AsyncSession, ids: List[int]) -> List[Dict[str, Any]]:
+    rows = await session.exec(
+        select(*player_public_columns).where(col(Player.id).in_(ids))
+    )
+    return await to_public_players(session, rows.all())
+
+
+async def load_teams(session: AsyncSession, ids: List[int]) -> List[Dict[str, Any]]:
+    teams = await session.exec(
+        select(Team).options(*team_load_options).where(col(Team.id).in_(ids))
+    )
+    return [to_public_team(team).model_dump() for team in teams.all()]
+
+
+async def load_games(session: AsyncSession, ids: List[int]) -> List[Dict[str, Any]]:
+    rows = await session.exec(games_statement().where(col(Game.id).in_(ids)))
+    return to_public_games(rows.all())
+
+
+async def load_actions(session: AsyncSession, ids: List[int]) -> List[Dict[str, Any]]:
+    rows = await session.exec(
+        actions_statement(None, None).where(col(Action.id).in_(ids))
+    )
+    return to_public_actions(rows.all())
+
+
+async def load_exercises(
+    session: AsyncSession, ids: List[int]
+) -> List[Dict[str, Any]]:
+    rows = await session.exec(
+        select(*exercise_public_columns).where(col(Exercise.id).in_(ids))
+    )
+    return await to_public_exercises(session, rows.all())
+
+
+# entity -> current rows shaped like its *Public model, one batch per entity
+change_loaders: Dict[
+    Entity, Callable[[AsyncSession, List[int]], Awaitable[List[Dict[str, Any]]]]
+] = {
+    Entity.PLAYER: load_players,
+    Entity.TEAM: load_teams,
+    Entity.GAME: load_games,
+    Entity.ACTION: load_actions,
+    Entity.EXERCISE: load_exercises,
+}
+
+
+@router.get("/changes", response_model=ChangesPublic)
+async def get_changes(
+    *,
+    session: AsyncSession = Depends(get_session),
+    since: int = 0,
+    limit: int = settings.CHANGES_PAGE_SIZE,
+) -> ChangesPublic:
+    """Get players, teams, games, actions and exercises changed after since
+
+    Start with since=0 (or after a full download, with the seq of the last
+    sync) and pass the returned seq on the next call; while more is true
+    another page is waiting. Every entity appears once with its current
+    data, or with deleted=true when it no longer exists.
+
+    :param limit: Log entries per page, at most CHANGES_PAGE_SIZE
+    """
+    limit = max(1, min(limit, settings.CHANGES_PAGE_SIZE))
+    entries = (
+        await session.exec(
+            select(ChangeLog)
+            .where(col(ChangeLog.seq) > since)
+            .order_by(col(ChangeLog.seq))
+            .limit(limit + 1)
+        )
+    ).all()
+    more = len(entries) > limit
+    entries = entries[:limit]
+
+    # newest entry per entity, older ones in the page are superseded
+    latest: Dict[Any, ChangeLog] = {}
+    for entry in entries:
+        latest[(entry.entity, entry.entity_id)] = entry
+
+    data: Dict[Any, Dict[str, Any]] = {}
+    for entity, load in change_loaders.items():
+        ids = [
+            entity_id
+            for (kind, entity_id), entry in latest.items()
+            if kind == entity and not entry.deleted
+        ]
+        if ids:
+            for item in await load(session, ids):
+                data[(entity, item["id"])] = item
+
+    changes = []
+    for key, entry in sorted(latest.items(), key=lambda item: item[1].seq):
+        item = data.get(key)
+        changes.append(
+            ChangePublic(
+                seq=entry.seq,
+                entity=entry.entity,
+                id=entry.entity_id,
+                # logged as changed but deleted since
+                deleted=item is None,
+                data=item,
+            )
+        )
+    return ChangesPublic(
+        seq=entries[-1].seq if entries else since, more=more, changes=changes
+    )
+
+
+@router.get(
+    "/slow_queries",
+    response_model=List[SlowQueryPublic],
+    dependencies=[Depends(require_debug_endpoints), Depends(get_coach)],
+)
+async def get_slow_queries(limit: int = 20) -> List[SlowQueryPublic]:
+    """Get the statements that took longer than SLOW_QUERY_MS
+
+    Grouped by SQL and ordered by cumulative time, counted over the newest
+    SLOW_QUERY_LOG_SIZE slow runs since startup. Only parameter types are
+    kept. Available when DEBUG_ENDPOINTS is enabled.
+    """
+    return slow_query_summary(limit)
+
+
 @router.get("/test/{player_id}")
-async def test(*, session: Session = Depends(get_session), player_id: int):
+async def test(
+    *, session: AsyncSession = Depends(get_write_session), player_id: int
+):
     logger.info("Test")
     await algorithm.block4(session, player_id)
     return {"status": "ok"}
\ No newline at end of file
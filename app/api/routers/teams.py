@@ -1,12 +1,18 @@
-from typing import List
+from typing import Any, Dict, List
 
 from fastapi import APIRouter, HTTPException, Depends
-from fastapi_pagination import Page, paginate
-from sqlmodel import select, Session, delete, col, and_
-
-from app.core.db import engine, get_session
+from fastapi_pagination import Page
+from sqlalchemy.orm import selectinload
+from sqlmodel import select, delete, col, and_
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.api.deps import page_response, paginate_rows
+from app.core.cache import bootstrap_cache
+from app.core.changes import record_changes
+from app.core.db import get_session
+from app.core.dialect import insert_ignore
 from app.data.db import Team, Player, TeamToPlayer
-from app.data.utils import Status
+from app.data.utils import Entity, Status
 from app.data.update import TeamUpdate
 from app.data.create import TeamCreate
 from app.data.public import TeamPublic, TeamToPlayerPublic
@@ -16,37 +22,15 @@ from app.data.utils import NameWithId
 
 router = APIRouter()
 
+# load team -> players -> player in a fixed number of queries
+team_load_options = (selectinload(Team.players).selectinload(TeamToPlayer.player),)
+team_public_columns = [
+    column for column in Team.__table__.columns if column.name in TeamPublic.model_fields
+]
 
-@router.get("/", response_model=Page[TeamPublic])
-async def get_teams(*, session: Session = Depends(get_session)) -> Page[TeamPublic]:
-    """Get all teams"""
-    db_teams = session.exec(select(Team)).all()
-    teams = []
-
-    for db_team in db_teams:
-        team = TeamPublic(**db_team.model_dump(exclude={"players"}))
-        for t_team_player in db_team.players:
-            team_player_player = TeamToPlayerPublic(
-                player=NameWithId(
-                    id=t_team_player.player.id, name=t_team_player.player.first_name + ' ' + t_team_player.player.last_name
-                ),
-                amplua=t_team_player.amplua,
-            )
-            team.players.append(team_player_player)
-        teams.append(team)
-
-    return paginate(teams)
-
-
-@router.get("/{team_id}", response_model=TeamPublic)
-async def get_team(
-    *, session: Session = Depends(get_session), team_id: str
-) -> TeamPublic:
-    """Get team by id"""
-    db_team = session.get(Team, team_id)
-    if not db_team:
-        raise HTTPException(status_code=404, detail="Team not found")
 
+def to_public_team(db_team: Team) -> TeamPublic:
+    """Build TeamPublic from a team loaded with team_load_options."""
     team = TeamPublic(**db_team.model_dump(exclude={"players"}))
     for t_team_player in db_team.players:
         team_player_player = TeamToPlayerPublic(
@@ -56,21 +40,66 @@ async def get_team(
             amplua=t_team_player.amplua,
         )
         team.players.append(team_player_player)
-
     return team
 
 
+async def to_public_teams(session: AsyncSession, rows) -> List[Dict[str, Any]]:
+    """Shape team rows like TeamPublic, loading their players in one query."""
+    teams = {row.id: {**row._asdict(), "players": []} for row in rows}
+    links = await session.exec(
+        select(
+            TeamToPlayer.team_id,
+            TeamToPlayer.player_id,
+            Player.first_name,
+            Player.last_name,
+            TeamToPlayer.amplua,
+        )
+        .join(Player, col(Player.id) == col(TeamToPlayer.player_id))
+        .where(col(TeamToPlayer.team_id).in_(teams))
+        .order_by(col(TeamToPlayer.team_id), col(TeamToPlayer.player_id))
+    )
+    for team_id, player_id, first_name, last_name, amplua in links.all():
+        teams[team_id]["players"].append(
+            {
+                "team": None,
+                "player": {"id": player_id, "name": first_name + " " + last_name},
+                "amplua": amplua,
+            }
+        )
+    return list(teams.values())
+
+
+@router.get("/", response_model=Page[TeamPublic])
+async def get_teams(
+    *, session: AsyncSession = Depends(get_session)
+) -> Page[TeamPublic]:
+    """Get all teams"""
+    statement = select(*team_public_columns).order_by(col(Team.id))
+    page = await paginate_rows(session, statement)
+    page["items"] = await to_public_teams(session, page["items"])
+    return page_response(page)
+
+
+@router.get("/{team_id}", response_model=TeamPublic)
+async def get_team(
+    *, session: AsyncSession = Depends(get_session), team_id: int
+) -> TeamPublic:
+    """Get team by id"""
+    db_team = await session.get(Team, team_id, options=team_load_options)
+    if not db_team:
+        raise HTTPException(status_code=404, detail="Team not found")
+
+    return to_public_team(db_team)
+
+
 @router.post("/", response_model=Status)
 async def new_team(
-    *, session: Session = Depends(get_session), team: TeamCreate
+    *, session: AsyncSession = Depends(get_session), team: TeamCreate
 ) -> Status:
-    """Create new team"""
-    new_team = Team(**team.model_dump(exclude={"players"}))
-    # get new id
-    new_id = (
-        session.exec(select(col(Team.id)).order_by(Team.id.desc())).first() or 0
-    ) + 1
-    logger.debug("creating new team with id %s", new_id)
+    """Create new team
+
+    A team with an already uploaded client_id is not inserted again.
+    """
     player_ids = list(map(lambda x: x.player, team.players))
 
     if len(set(player_ids)) != len(player_ids):
@@ -78,38 +107,60 @@ async def new_team(
 
     player_ampluas = list(map(lambda x: x.amplua, team.players))
     statement = select(Player).where(Player.id.in_(player_ids))
-    players: List[Player] = session.exec(statement).all()
+    players: List[Player] = (await session.exec(statement)).all()
 
     if len(players) != len(player_ids) or None in players:
         raise HTTPException(status_code=404, detail="Player not found")
 
+    new_id = (
+        await session.exec(
+            insert_ignore(Team, "client_id")
+            .values(**team.model_dump(exclude={"players"}))
+            .returning(col(Team.id))
+        )
+    ).scalar()
+    if new_id is None:
+        return Status(status="success", detail="Team already exists")
+    logger.debug("creating new team with id %s", new_id)
+
     for player, amplua in zip(players, player_ampluas):
         relation = TeamToPlayer(team_id=new_id, player_id=player.id, amplua=amplua)
         session.add(relation)
-    session.add(new_team)
-    session.commit()
+    await record_changes(session, Entity.TEAM, [new_id])
+    await record_changes(session, Entity.PLAYER, player_ids)
+    await bootstrap_cache.bump(session)
+    await session.commit()
     return Status(status="success", detail="Team created")
 
 
 @router.delete("/{team_id}")
 async def delete_team(
-    *, session: Session = Depends(get_session), team_id: str
+    *, session: AsyncSession = Depends(get_session), team_id: int
 ) -> Status:
     """Delete team by id"""
-    team = session.get(Team, team_id)
+    team = await session.get(Team, team_id)
     if team is None:
         raise HTTPException(status_code=404, detail="Team not found")
-    session.delete(team)
-    session.commit()
+    # the team drops out of its players' team lists
+    player_ids = (
+        await session.exec(
+            select(TeamToPlayer.player_id).where(col(TeamToPlayer.team_id) == team_id)
+        )
+    ).all()
+    await session.delete(team)
+    await record_changes(session, Entity.PLAYER, player_ids)
+    await record_changes(session, Entity.TEAM, [team_id], deleted=True)
+    await bootstrap_cache.bump(session)
+    await session.commit()
     return Status(status="success", detail="Team deleted")
 
 
 @router.put("/{team_id}", response_model=Status)
 async def update_team(
-    *, session: Session = Depends(get_session), team_id: str, new_team: TeamUpdate
+    *, session: AsyncSession = Depends(get_session), team_id: int, new_team: TeamUpdate
 ) -> Status:
     """Update team by id"""
-    team = session.get(Team, team_id)
+    team = await session.get(Team, team_id)
     if team is None:
         raise HTTPException(status_code=404, detail="Team not found")
 
@@ -117,26 +168,26 @@ async def update_team(
     new_team_data["players"] = []
 
     # teardown relations
-    old_relations = session.exec(
-        select(TeamToPlayer).where(TeamToPlayer.team_id == team_id)
+    old_relations = (
+        await session.exec(select(TeamToPlayer).where(TeamToPlayer.team_id == team_id))
     ).all()
     player_ids = list(map(lambda x: x.player.id, new_team.players))
     logger.debug("check relation %s", player_ids)
     for relation in old_relations:
         if relation.player_id not in player_ids:
             logger.debug("deleting relation %s", relation)
-            session.exec(
+            await session.exec(
                 delete(TeamToPlayer).where(
                     and_(
                         col(TeamToPlayer.team_id) == team_id,
-                        col(TeamToPlayer.player_id) == relation.player.id,
+                        col(TeamToPlayer.player_id) == relation.player_id,
                     )
                 )
             )
 
     # add new ones
     for relation in new_team.players:
-        db_relation = session.get(TeamToPlayer, (team_id, relation.player.id))
+        db_relation = await session.get(TeamToPlayer, (team_id, relation.player.id))
         if db_relation:
             continue  # skip if exists
         db_relation = TeamToPlayer(
@@ -145,6 +196,13 @@ async def update_team(
         session.add(db_relation)
 
     session.add(team)
-    session.commit()
+    await record_changes(session, Entity.TEAM, [team_id])
+    await record_changes(
+        session,
+        Entity.PLAYER,
+        player_ids + [relation.player_id for relation in old_relations],
+    )
+    await bootstrap_cache.bump(session)
+    await session.commit()
 
     return Status(status="success", detail="Team updated")
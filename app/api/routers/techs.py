@@ -1,10 +1,13 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Request
 from fastapi_pagination import Page, paginate
-from sqlmodel import select, Session
+from sqlmodel import col, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
+from app.core.cache import catalog_cache
+from app.core.changes import record_changes
 from app.core.db import get_session
-from app.data.db import Tech
-from app.data.utils import Status
+from app.data.db import ExerciseToSubtech, Subtech, Tech
+from app.data.utils import Entity, Status
 from app.data.update import TechUpdate
 from app.data.create import TechCreate
 from app.data.public import TechPublic  
@@ -14,50 +17,75 @@ router = APIRouter()
 
 
 @router.get("/", response_model=Page[TechPublic])
-async def get_techs(*, session: Session = Depends(get_session)) -> Page[TechPublic]:
+async def get_techs(
+    *, request: Request, session: AsyncSession = Depends(get_session)
+) -> Page[TechPublic]:
     """Get all techs"""
-    return paginate(session.exec(select(Tech)).all())
+
+    async def build() -> Page[TechPublic]:
+        return paginate(
+            (await session.exec(select(Tech).order_by(col(Tech.id)))).all()
+        )
+
+    return await catalog_cache.response(request, session, build, Page[TechPublic])
 
 
 @router.get("/{tech_id}", response_model=TechPublic)
-async def get_tech(*, session: Session = Depends(get_session), tech_id: str) -> TechPublic:
+async def get_tech(
+    *, request: Request, session: AsyncSession = Depends(get_session), tech_id: int
+) -> TechPublic:
     """Get tech by id"""
-    db_tech = session.get(Tech, tech_id)
-    if not db_tech:
-        raise HTTPException(status_code=404, detail="Tech not found")
-    return db_tech
+
+    async def build() -> TechPublic:
+        db_tech = await session.get(Tech, tech_id)
+        if not db_tech:
+            raise HTTPException(status_code=404, detail="Tech not found")
+        return TechPublic.model_validate(db_tech)
+
+    return await catalog_cache.response(request, session, build, TechPublic)
 
 
 @router.post("/", response_model=Status)
 async def create_tech(
-    *, session: Session = Depends(get_session), new_tech: TechCreate
+    *, session: AsyncSession = Depends(get_session), new_tech: TechCreate
 ) -> Status:
     """Create new tech"""
     tech = Tech(**new_tech.model_dump())
     session.add(tech)
-    session.commit()
+    await catalog_cache.bump(session)
+    await session.commit()
     return Status(status="success", detail="Tech created")
 
 
 @router.delete("/{tech_id}")
 async def delete_tech(
-    *, session: Session = Depends(get_session), tech_id: str
+    *, session: AsyncSession = Depends(get_session), tech_id: int
 ) -> Status:
     """Delete tech by id"""
-    tech = session.get(Tech, tech_id)
+    tech = await session.get(Tech, tech_id)
     if tech is None:
         raise HTTPException(status_code=404, detail="Tech not found")
-    session.delete(tech)
-    session.commit()
+    # its subtechs are deleted with it and drop out of these exercises
+    exercise_ids = (
+        await session.exec(
+            select(ExerciseToSubtech.exercise_id)
+            .join(Subtech, col(Subtech.id) == col(ExerciseToSubtech.subtech_id))
+            .where(col(Subtech.tech) == tech_id)
+        )
+    ).all()
+    await session.delete(tech)
+    await record_changes(session, Entity.EXERCISE, exercise_ids)
+    await catalog_cache.bump(session)
+    await session.commit()
     return Status(status="success", detail="Tech deleted")
 
 
 @router.put("/{tech_id}")
 async def update_tech(
-    *, session: Session = Depends(get_session), tech_id: str, new_tech: TechUpdate
+    *, session: AsyncSession = Depends(get_session), tech_id: int, new_tech: TechUpdate
 ) -> Status:
     """Update tech by id"""
-    tech = session.get(Tech, tech_id)
+    tech = await session.get(Tech, tech_id)
     if tech is None:
         raise HTTPException(status_code=404, detail="Tech not found")
 
@@ -65,6 +93,7 @@ async def update_tech(
         setattr(tech, field, value)
 
     session.add(tech)
-    session.commit()
+    await catalog_cache.bump(session)
+    await session.commit()
 
     return Status(status="success", detail="Tech updated")
@@ -3,7 +3,8 @@ from typing import Annotated, List
 import aiofiles
 from starlette.responses import FileResponse
 from fastapi import APIRouter, Depends, UploadFile, HTTPException, File
-from sqlmodel import Session, select
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from app.data.public import UpdatePublic
 from app.data.db import Update
@@ -37,30 +38,32 @@ async def get_releases(release_id: str) -> FileResponse:
 
 @router.post("/")
 async def post_update(
-    *, update: UpdatePublic, session: Session = Depends(get_session)
+    *, update: UpdatePublic, session: AsyncSession = Depends(get_session)
 ) -> Status:
     """Post update"""
     update_db = Update(**update.model_dump())
 
     session.add(update_db)
-    session.commit()
+    await session.commit()
 
     return Status(status="success", detail="Update created")
 
 
 @router.get("/")
-async def get_updates(*, session: Session = Depends(get_session)) -> List[UpdatePublic]:
+async def get_updates(
+    *, session: AsyncSession = Depends(get_session)
+) -> List[UpdatePublic]:
     """Get updates"""
-    updates = session.exec(select(Update)).all()
+    updates = (await session.exec(select(Update))).all()
     return updates
 
 
 @router.get("/{update_id}")
 async def get_update(
-    *, update_id: str, session: Session = Depends(get_session)
+    *, update_id: str, session: AsyncSession = Depends(get_session)
 ) -> UpdatePublic:
     """Get update"""
-    update = session.get(Update, update_id)
+    update = await session.get(Update, update_id)
     if not update:
         raise HTTPException(status_code=404, detail="Update not found")
     return update
@@ -1,23 +1,15 @@
 from math import floor
 from random import randint
 from enum import Enum
+from typing import Iterable
 
 from fastapi import HTTPException
-from sqlmodel import (
-    Session,
-    SQLModel,
-    and_,
-    col,
-    delete,
-    desc,
-    func,
-    not_,
-    or_,
-    select,
-    text,
-)
+from sqlmodel import SQLModel, and_, col, delete, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from app.core.config import settings
+from app.core.dialect import disable_foreign_keys
+from app.core import statements
 from app.core.logger import logger
 from app.data.algorithm import *
 from app.data.db import *
@@ -40,7 +32,7 @@ class PlanCreator:
     tailored to their strengths and weaknesses.
 
     Attributes:
-        session (Session): Database session for data operations
+        session (AsyncSession): Database session for data operations
         player (int): Player ID for whom the plan is being created
         WEEK_COUNT (int): Total number of weeks in the plan (default: 13)
         DEFAULT_PLAN_ID (int): Default plan identifier (default: 1)
@@ -48,12 +40,12 @@ class PlanCreator:
 
     amplua: Amplua = Amplua.UNIVERSAL
 
-    def __init__(self, session: Session, player: int):
+    def __init__(self, session: AsyncSession, player: int):
         """
         Initialize the PlanCreator with database session and player ID.
 
         Args:
-            session (Session): SQLModel database session
+            session (AsyncSession): SQLModel database session
             player (int): Unique identifier for the player
         """
         self.session = session
@@ -90,22 +82,23 @@ class PlanCreator:
         The method distinguishes between used techniques (those the player has
         performed) and unused techniques to create appropriate training focus.
         """
-        self.used_techs = self.session.exec(
-            select(TechSum)
-            .where(col(TechSum.player) == self.player)
-            .order_by(desc(TechSum.prozent))
+        self.used_techs = (
+            await self.session.exec(
+                statements.tech_sums_by_player, params={"player": self.player}
+            )
         ).all()
-        self.unused_techs = self.session.exec(
-            select(Tech).where(
-                col(Tech.id).not_in(map(lambda x: x.tech, self.used_techs)),
+        self.unused_techs = (
+            await self.session.exec(
+                statements.techs_not_in,
+                params={"ids": [tech_sum.tech for tech_sum in self.used_techs]},
             )
         ).all()
         self.plan = Plan(
             player=self.player, start_date=datetime.now(), id=self.DEFAULT_PLAN_ID
         )
         self.session.add(self.plan)
-        self.session.commit()
-        self.session.refresh(self.plan)
+        await self.session.commit()
+        await self.session.refresh(self.plan)
 
         # end loop flags
         self._end_tech_loop = False
@@ -142,12 +135,8 @@ class PlanCreator:
         based on predefined percentages for normal, old, and learning exercises.
         """
         # Disable foreign keys for the duration of plan creation
-        try:
-            self.session.exec(text("PRAGMA foreign_keys = OFF"))
-            logger.debug("Foreign keys disabled for plan creation")
-        except:
-            self.session.rollback()
-            return await self.create_plan()
+        await disable_foreign_keys(self.session)
+        logger.debug("Foreign keys disabled for plan creation")
         try:
             # teardown first
             await self.teardown()
@@ -174,17 +163,17 @@ class PlanCreator:
                     player=self.player, plan=self.DEFAULT_PLAN_ID, week=week
                 )
                 self.session.add(plan_week)
-                self.session.commit()
-                self.session.refresh(plan_week)
+                await self.session.commit()
+                await self.session.refresh(plan_week)
 
                 await self.process_week(plan_week)
                 await self.fill_with_game(plan_week)
 
-            self.session.commit()
+            await self.session.commit()
 
         finally:
             # Re-enable foreign keys regardless of success or failure
-            # self.session.exec(text("PRAGMA foreign_keys = ON"))
+            # await self.session.exec(text("PRAGMA foreign_keys = ON"))
             logger.debug("Foreign keys re-enabled after plan creation")
 
         return self.plan
@@ -242,13 +231,14 @@ class PlanCreator:
                     self.reduce_time(exercise_time, PartType.OLD_PART)
 
                     max_id = (
-                        self.session.exec(
-                            select(func.max(PlanExercise.id)).where(
-                                and_(
-                                    col(PlanExercise.player) == self.player,
-                                    col(PlanExercise.plan) == self.plan.id,
-                                    col(PlanExercise.week) == plan_week.week,
-                                )
+                        (
+                            await self.session.exec(
+                                statements.max_plan_exercise_id,
+                                params={
+                                    "player": self.player,
+                                    "plan": self.plan.id,
+                                    "week": plan_week.week,
+                                },
                             )
                         ).first()
                         or 0
@@ -265,15 +255,16 @@ class PlanCreator:
                             from_zone=old_exercise.from_zone,
                             to_zone=old_exercise.to_zone,
                         )
-                        self.session.add(new_exercise)
-                        time_per_exercise = self.session.get(
-                            Exercise, new_exercise.exercise
+                        time_per_exercise = (
+                            await self.session.get(Exercise, new_exercise.exercise)
                         ).time_per_exercise
-                        self.session.flush()  # Flush to catch constraint violations early
+                        # a failed insert only rolls back its savepoint, a full
+                        # rollback would expire self.plan and the loaded sums
+                        async with self.session.begin_nested():
+                            self.session.add(new_exercise)
                         self._week_exercises.append((new_exercise, time_per_exercise))
                     except Exception as e:
                         logger.error(f"Failed to create old PlanExercise: {e}")
-                        self.session.rollback()
                         continue
         self._exercises.append(self._week_exercises)
         self._free_time = floor(self._free_time)
@@ -297,15 +288,11 @@ class PlanCreator:
         """
         self._time_for_tech = settings.MINUTES_IN_WEEK * tech.prozent
         self._end_subtech_loop = False
-        for subtech in self.session.exec(
-            select(SubtechSum)
-            .where(
-                and_(
-                    col(SubtechSum.player) == self.player,
-                    col(SubtechSum.tech) == tech.tech,
-                )
+        for subtech in (
+            await self.session.exec(
+                statements.subtech_sums_by_tech,
+                params={"player": self.player, "tech": tech.tech},
             )
-            .order_by(desc(SubtechSum.prozent))
         ).all():
             if self._end_subtech_loop:
                 break
@@ -324,9 +311,9 @@ class PlanCreator:
         history with the technique.
         """
         self._end_subtech_loop = False
-        subtechs = self.session.exec(
-            select(Subtech).where(
-                col(Subtech.tech) == tech.id,
+        subtechs = (
+            await self.session.exec(
+                statements.subtechs_by_tech, params={"tech": tech.id}
             )
         ).all()
         for subtech in subtechs:
@@ -363,13 +350,14 @@ class PlanCreator:
         self._time_for_subtech = floor(self._time_for_subtech)
         self.check_borders()
 
-        impacts = self.session.exec(
-            select(ImpactSum).where(
-                and_(
-                    col(ImpactSum.player) == self.player,
-                    col(ImpactSum.tech) == tech.tech,
-                    col(ImpactSum.subtech) == subtech.subtech,
-                )
+        impacts = (
+            await self.session.exec(
+                statements.impact_sums_by_subtech,
+                params={
+                    "player": self.player,
+                    "tech": tech.tech,
+                    "subtech": subtech.subtech,
+                },
             )
         ).all()
         if not impacts:
@@ -385,41 +373,18 @@ class PlanCreator:
         # also calculate the time for the impact
         if plan_week.week % 2 == 1:
             if impact_exists(Impact.FAIL) or impact_exists(Impact.MISTAKE):
-                db_exercises = self.session.exec(
-                    select(Exercise).where(
-                        and_(
-                            col(Exercise.id).in_(
-                                select(ExerciseToSubtech.exercise_id).where(
-                                    col(ExerciseToSubtech.subtech_id) == subtech.subtech
-                                )
-                            ),
-                            or_(
-                                col(Exercise.simulation_exercises) == True,
-                                col(Exercise.exercises_with_the_ball_on_your_own)
-                                == True,
-                                col(Exercise.exercises_with_the_ball_in_pairs) == True,
-                            ),
-                            col(Exercise.exercises_for_learning) == False,
-                        )
+                db_exercises = (
+                    await self.session.exec(
+                        statements.reinforcing_exercises,
+                        params={"subtech": subtech.subtech},
                     )
                 ).all()
         elif plan_week.week % 2 == 0:
             if impact_exists(Impact.EFFICIENCY) or impact_exists(Impact.SCORE):
-                db_exercises = self.session.exec(
-                    select(Exercise).where(
-                        and_(
-                            col(Exercise.id).in_(
-                                select(ExerciseToSubtech.exercise_id).where(
-                                    col(ExerciseToSubtech.subtech_id) == subtech.subtech
-                                )
-                            ),
-                            or_(
-                                col(Exercise.exercises_with_the_ball_in_pairs) == True,
-                                col(Exercise.exercises_with_the_ball_in_groups) == True,
-                                col(Exercise.exercises_in_difficult_conditions) == True,
-                            ),
-                            col(Exercise.exercises_for_learning) == False,
-                        )
+                db_exercises = (
+                    await self.session.exec(
+                        statements.improving_exercises,
+                        params={"subtech": subtech.subtech},
                     )
                 ).all()
 
@@ -466,14 +431,15 @@ class PlanCreator:
             exercise_counter += 1
 
             # Calculate best zone
-            zone_result = self.session.exec(
-                select(col(ZoneSum.zone), func.max(col(ZoneSum.prozent))).where(
-                    and_(
-                        col(ZoneSum.player) == self.player,
-                        col(ZoneSum.tech) == tech.tech,
-                        col(ZoneSum.subtech) == subtech.subtech,
-                        col(ZoneSum.impact) == current_impact.name,
-                    )
+            zone_result = (
+                await self.session.exec(
+                    statements.best_zone,
+                    params={
+                        "player": self.player,
+                        "tech": tech.tech,
+                        "subtech": subtech.subtech,
+                        "impact": current_impact.name,
+                    },
                 )
             ).first()
 
@@ -486,13 +452,14 @@ class PlanCreator:
             zone = zone_result
 
             max_id = (
-                self.session.exec(
-                    select(func.max(PlanExercise.id)).where(
-                        and_(
-                            col(PlanExercise.player) == self.player,
-                            col(PlanExercise.plan) == self.plan.id,
-                            col(PlanExercise.week) == plan_week.week,
-                        )
+                (
+                    await self.session.exec(
+                        statements.max_plan_exercise_id,
+                        params={
+                            "player": self.player,
+                            "plan": self.plan.id,
+                            "week": plan_week.week,
+                        },
                     )
                 ).first()
                 or 0
@@ -522,21 +489,16 @@ class PlanCreator:
                     self._end_exercise_loop = True
                     self._end_subtech_loop = True
                     self._end_tech_loop = True
-                self.session.add(db_exercise)
 
-                # Flush to catch constraint violations early
-                self.session.flush()
+                # flushed in a savepoint, a failed insert only rolls back itself
+                async with self.session.begin_nested():
+                    self.session.add(db_exercise)
                 self._week_exercises.append((db_exercise, exercise.time_per_exercise))
             except (ValueError, IndexError) as e:
                 logger.error(f"Error parsing zone or creating PlanExercise: {e}")
                 continue
             except Exception as e:
                 logger.error(f"Failed to create PlanExercise: {e}")
-                # Roll back the failed transaction so the Session can continue
-                try:
-                    self.session.rollback()
-                except Exception:
-                    pass
                 continue
 
     async def process_unused_subtech(
@@ -570,16 +532,9 @@ class PlanCreator:
 
         self.check_borders()
 
-        db_exercises = self.session.exec(
-            select(Exercise).where(
-                and_(
-                    col(Exercise.id).in_(
-                        select(ExerciseToSubtech.exercise_id).where(
-                            col(ExerciseToSubtech.subtech_id) == subtech.id
-                        )
-                    ),
-                    col(Exercise.exercises_for_learning) == True,
-                )
+        db_exercises = (
+            await self.session.exec(
+                statements.learning_exercises, params={"subtech": subtech.id}
             )
         ).all()
 
@@ -605,13 +560,14 @@ class PlanCreator:
             exercise_counter += 1
 
             max_id = (
-                self.session.exec(
-                    select(func.max(PlanExercise.id)).where(
-                        and_(
-                            col(PlanExercise.player) == self.player,
-                            col(PlanExercise.plan) == self.plan.id,
-                            col(PlanExercise.week) == plan_week.week,
-                        )
+                (
+                    await self.session.exec(
+                        statements.max_plan_exercise_id,
+                        params={
+                            "player": self.player,
+                            "plan": self.plan.id,
+                            "week": plan_week.week,
+                        },
                     )
                 ).first()
                 or 0
@@ -632,18 +588,13 @@ class PlanCreator:
                     self._end_exercise_loop = True
                     self._end_subtech_loop = True
                     self._end_tech_loop = True
-                self.session.add(db_exercise)
 
-                # Flush to catch constraint violations early
-                self.session.flush()
+                # flushed in a savepoint, a failed insert only rolls back itself
+                async with self.session.begin_nested():
+                    self.session.add(db_exercise)
                 self._week_exercises.append((db_exercise, exercise.time_per_exercise))
             except Exception as e:
                 logger.error(f"Failed to create PlanExercise: {e}")
-                # Roll back the failed transaction so the Session can continue
-                try:
-                    self.session.rollback()
-                except Exception:
-                    pass
                 continue
 
     async def teardown(self):
@@ -660,16 +611,18 @@ class PlanCreator:
         conflicts from previous planning attempts.
         """
         # teardown last plan if it exists
-        existing_plan = self.session.exec(
-            select(Plan).where(
-                and_(
-                    col(Plan.player) == self.player,
-                    col(Plan.id) == self.DEFAULT_PLAN_ID,
+        existing_plan = (
+            await self.session.exec(
+                select(Plan).where(
+                    and_(
+                        col(Plan.player) == self.player,
+                        col(Plan.id) == self.DEFAULT_PLAN_ID,
+                    )
                 )
             )
         ).first()
         if existing_plan:
-            self.session.exec(
+            await self.session.exec(
                 delete(Plan).where(
                     and_(
                         col(Plan.player) == self.player,
@@ -679,16 +632,18 @@ class PlanCreator:
             )
 
         # teardown plan weeks
-        plan_weeks = self.session.exec(
-            select(PlanWeek).where(
-                and_(
-                    col(PlanWeek.player) == self.player,
-                    col(PlanWeek.plan) == self.DEFAULT_PLAN_ID,
+        plan_weeks = (
+            await self.session.exec(
+                select(PlanWeek).where(
+                    and_(
+                        col(PlanWeek.player) == self.player,
+                        col(PlanWeek.plan) == self.DEFAULT_PLAN_ID,
+                    )
                 )
             )
         ).all()
         if plan_weeks:
-            self.session.exec(
+            await self.session.exec(
                 delete(PlanWeek).where(
                     and_(
                         col(PlanWeek.player) == self.player,
@@ -698,17 +653,19 @@ class PlanCreator:
             )
 
         # teardown plan exercises
-        plan_exercises = self.session.exec(
-            select(PlanExercise).where(
-                and_(
-                    col(PlanExercise.player) == self.player,
-                    col(PlanExercise.plan) == self.DEFAULT_PLAN_ID,
+        plan_exercises = (
+            await self.session.exec(
+                select(PlanExercise).where(
+                    and_(
+                        col(PlanExercise.player) == self.player,
+                        col(PlanExercise.plan) == self.DEFAULT_PLAN_ID,
+                    )
                 )
             )
         ).all()
 
         if plan_exercises:
-            self.session.exec(
+            await self.session.exec(
                 delete(PlanExercise).where(
                     and_(
                         col(PlanExercise.player) == self.player,
@@ -716,23 +673,24 @@ class PlanCreator:
                     )
                 )
             )
-        self.session.commit()
+        await self.session.commit()
 
     async def fill_with_game(self, plan_week: PlanWeek):
         time_used = sum(map(lambda x: x[1], self._week_exercises))
         time_unused = settings.MINUTES_IN_WEEK - time_used
         time_unused = floor(time_unused)
         if time_unused <= 0: return
-        game_exercise = self.session.get(Exercise, -time_unused)
+        game_exercise = await self.session.get(Exercise, -time_unused)
 
         max_id = (
-            self.session.exec(
-                select(func.max(PlanExercise.id)).where(
-                    and_(
-                        col(PlanExercise.player) == self.player,
-                        col(PlanExercise.plan) == self.plan.id,
-                        col(PlanExercise.week) == plan_week.week,
-                    )
+            (
+                await self.session.exec(
+                    statements.max_plan_exercise_id,
+                    params={
+                        "player": self.player,
+                        "plan": self.plan.id,
+                        "week": plan_week.week,
+                    },
                 )
             ).first()
             or 0
@@ -747,8 +705,8 @@ class PlanCreator:
                 difficulty=1,
             )
             self.session.add(game_exercise)
-            self.session.commit()
-            self.session.refresh(game_exercise)
+            await self.session.commit()
+            await self.session.refresh(game_exercise)
 
         db_exercise = PlanExercise(
             id=max_id + 1,
@@ -760,11 +718,11 @@ class PlanCreator:
             to_zone=0,
         )
         try:
-            self.session.add(db_exercise)
-            self.session.commit()
+            async with self.session.begin_nested():
+                self.session.add(db_exercise)
         except Exception as e:
             logger.error("Error while adding plan exercise (fill with game)")
-            self.session.rollback()
+        await self.session.commit()
 
     def check_borders(self, part: PartType | None = None):
         if (part == PartType.NORMAL_PART and self._time_for_normal_part < self.BORDER_PARTS_MINUTES) or \
@@ -800,47 +758,55 @@ class PlanCreator:
             self._time_for_learning_part -= time_for_exercise
 
 
-async def calculate_sums(session: Session, player: int):
+async def invalidate_player_sums(session: AsyncSession, players: Iterable[int]):
+    """Delete the stored sums of the players, e.g. after their actions changed.
+
+    Doesn't commit, so the delete is part of the caller's transaction. The
+    stats of these players are gone until they are calculated again.
+    """
+    players = list(players)
+    for model in (PlayerSum, TechSum, SubtechSum, ImpactSum, ZoneSum):
+        await session.exec(delete(model).where(col(model.player).in_(players)))
+
+
+async def calculate_sums(session: AsyncSession, player: int):
     # sums tierdown
-    session.exec(delete(PlayerSum).where(col(PlayerSum.player) == player))
-    session.exec(delete(TechSum).where(col(TechSum.player) == player))
-    session.exec(delete(SubtechSum).where(col(SubtechSum.player) == player))
-    session.exec(delete(ImpactSum).where(col(ImpactSum.player) == player))
-    session.exec(delete(ZoneSum).where(col(ZoneSum.player) == player))
-    session.commit()
+    await invalidate_player_sums(session, [player])
+    await session.commit()
     #
     player_sum = PlayerSum(player=player)
     session.add(player_sum)
-    session.commit()
-    session.refresh(player_sum)
-    for action in session.exec(
-        select(Action).where(col(Action.player) == player)
+    await session.commit()
+    await session.refresh(player_sum)
+    for action in (
+        await session.exec(
+            select(Action).where(col(Action.player) == player)
+        )
     ).all():
         player_sum.sum_actions += 1
 
-        tech = session.get(Subtech, action.subtech).tech
+        tech = (await session.get(Subtech, action.subtech)).tech
         zone = str(action.from_zone) + "-" + str(action.to_zone)
 
-        tech_sum = session.get(TechSum, (player, tech))
-        print(tech_sum)
+        tech_sum = await session.get(TechSum, (player, tech))
         if not tech_sum:
             tech_sum = TechSum(player=player, tech=tech)
             session.add(tech_sum)
-            session.commit()
-            session.refresh(tech_sum)
+            await session.commit()
+            await session.refresh(tech_sum)
 
         tech_sum.sum_actions += 1
 
-        subtech_sum = session.get(SubtechSum, (player, tech, action.subtech))
+        subtech_sum = await session.get(SubtechSum, (player, tech, action.subtech))
         if not subtech_sum:
             subtech_sum = SubtechSum(player=player, tech=tech, subtech=action.subtech)
             session.add(subtech_sum)
-            session.commit()
-            session.refresh(subtech_sum)
+            await session.commit()
+            await session.refresh(subtech_sum)
 
         subtech_sum.sum_actions += 1
 
-        impact_sum = session.get(
+        impact_sum = await session.get(
             ImpactSum, (player, tech, action.subtech, action.impact.name)
         )
         if not impact_sum:
@@ -851,12 +817,12 @@ async def calculate_sums(session: Session, player: int):
                 impact=action.impact.name,
             )
             session.add(impact_sum)
-            session.commit()
-            session.refresh(impact_sum)
+            await session.commit()
+            await session.refresh(impact_sum)
 
         impact_sum.sum_actions += 1
 
-        zone_sum = session.get(
+        zone_sum = await session.get(
             ZoneSum, (player, tech, action.subtech, action.impact.name, zone)
         )
         if not zone_sum:
@@ -868,29 +834,34 @@ async def calculate_sums(session: Session, player: int):
                 zone=zone,
             )
             session.add(zone_sum)
-            session.commit()
-            session.refresh(zone_sum)
+            await session.commit()
+            await session.refresh(zone_sum)
         zone_sum.sum_actions += 1
         session.add(player_sum)
         session.add(tech_sum)
         session.add(subtech_sum)
         session.add(impact_sum)
         session.add(zone_sum)
-        session.commit()
+        await session.commit()
 
     if player_sum.sum_actions == 0:
-        session.close()
+        await session.close()
         raise HTTPException(status_code=404, detail="No actions found for player")
-    calc_prozent(session, PlayerSum, player_sum.sum_actions, player)
-    calc_prozent(session, TechSum, player_sum.sum_actions, player)
-    calc_prozent(session, SubtechSum, player_sum.sum_actions, player)
-    calc_prozent(session, ImpactSum, player_sum.sum_actions, player)
-    calc_prozent(session, ZoneSum, player_sum.sum_actions, player)
-    session.commit()
-    session.close()
-
-
-def calc_prozent(session: Session, model: SQLModel, total: int, player: int):
-    for row in session.exec(select(model).where(col(model.player) == player)).all():
+    await calc_prozent(session, PlayerSum, player_sum.sum_actions, player)
+    await calc_prozent(session, TechSum, player_sum.sum_actions, player)
+    await calc_prozent(session, SubtechSum, player_sum.sum_actions, player)
+    await calc_prozent(session, ImpactSum, player_sum.sum_actions, player)
+    await calc_prozent(session, ZoneSum, player_sum.sum_actions, player)
+    await session.commit()
+    await session.close()
+
+
+async def calc_prozent(
+    session: AsyncSession, model: SQLModel, total: int, player: int
+):
+    rows = await session.exec(
+        statements.sums_by_player[model], params={"player": player}
+    )
+    for row in rows.all():
         row.prozent = row.sum_actions / total
         session.add(row)
@@ -0,0 +1,264 @@
+import gzip
+import os
+from glob import glob
+from hashlib import sha1
+from time import monotonic, time
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional
+
+import orjson
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+from sqlalchemy import event
+from sqlmodel import col, select, update
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core.config import settings
+from app.core.dialect import insert_ignore
+from app.core.logger import logger
+from app.core.migrations import MIGRATIONS
+from app.data.db import CacheVersion, Coach
+
+
+class CachedBody(NamedTuple):
+    etag: str
+    body: bytes
+    gzip_body: bytes
+
+
+class VersionedCache:
+    """
+    Pre-serialized JSON responses kept in memory per data version.
+
+    Write handlers call bump() before commit, which increments the version
+    row of the cache (and of dependent caches) in the same transaction. Read
+    handlers go through response(), which serves the body built for the
+    current version, so a repeated request costs an ETag comparison instead
+    of queries and serialization. The version row is read at most once per
+    CACHE_VERSION_TTL_MS: a write in another worker is seen within that time,
+    one in this worker right after its commit. With a directory the
+    bodies are also written to disk and survive restarts until the next bump;
+    file names carry the app and schema version, so files written by another
+    release are never served and are removed on first use.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        directory: Optional[str] = None,
+        dependents: Optional[List["VersionedCache"]] = None,
+    ):
+        self.name = name
+        self.version = -1  # newest version seen, entries belong to it
+        self.checked_at = float("-inf")  # monotonic time version was read
+        self.directory = directory
+        self.dependents = dependents or []
+        self._entries: Dict[str, CachedBody] = {}
+
+    def names(self) -> List[str]:
+        names = [self.name]
+        for dependent in self.dependents:
+            names.extend(dependent.names())
+        return names
+
+    async def bump(self, session: AsyncSession):
+        """Invalidate all cached responses when the session commits."""
+        names = self.names()
+        await session.exec(
+            insert_ignore(CacheVersion, "name"),
+            params=[{"name": name, "version": 0} for name in names],
+        )
+        await session.exec(
+            update(CacheVersion)
+            .where(col(CacheVersion.name).in_(names))
+            .values(version=CacheVersion.version + 1)
+        )
+        event.listen(session.sync_session, "after_commit", self.expire, once=True)
+
+    def expire(self, *args):
+        """Read the version row again on the next request."""
+        self.checked_at = float("-inf")
+        for dependent in self.dependents:
+            dependent.expire()
+
+    async def current_version(self, session: AsyncSession) -> int:
+        now = monotonic()
+        if (now - self.checked_at) * 1000 < settings.CACHE_VERSION_TTL_MS:
+            return self.version
+        version = (
+            await session.exec(
+                select(CacheVersion.version).where(col(CacheVersion.name) == self.name)
+            )
+        ).first()
+        if (version or 0) >= self.version:
+            self.checked_at = now
+        return version or 0
+
+    async def get(
+        self,
+        request: Request,
+        session: AsyncSession,
+        build: Callable[[], Awaitable[Any]],
+        model: Any = None,
+    ) -> CachedBody:
+        """Return the cached body for the request, building it on a miss.
+
+        Unless FAST_RESPONSES is enabled a built payload is validated against
+        model, the route's response model, and serialized from the result.
+        """
+        version = await self.current_version(session)
+        if version > self.version:
+            self._entries.clear()
+            self.version = version
+            if self.directory:
+                self._remove_stale_files()
+
+        key = request.url.path + "?" + request.url.query
+        # a reader that started before the last bump sees an older version,
+        # it gets a fresh body that is not stored
+        if version == self.version:
+            entry = self._entries.get(key)
+            if entry is None and self.directory:
+                entry = self._load(key)
+                if entry is not None:
+                    self._entries[key] = entry
+            if entry is not None:
+                return entry
+
+        payload = await build()
+        if model is not None and not settings.FAST_RESPONSES:
+            adapter = TypeAdapter(model)
+            payload = adapter.dump_python(
+                adapter.validate_python(payload, from_attributes=True), mode="json"
+            )
+        body = orjson.dumps(jsonable_encoder(payload))
+        entry = CachedBody(
+            etag='"{}"'.format(sha1(body).hexdigest()),
+            body=body,
+            gzip_body=gzip.compress(body),
+        )
+        if version == self.version:
+            if len(self._entries) >= settings.RESPONSE_CACHE_MAX_ENTRIES:
+                self._entries.pop(next(iter(self._entries)))
+            self._entries[key] = entry
+            if self.directory:
+                self._store(key, entry)
+        return entry
+
+    async def response(
+        self,
+        request: Request,
+        session: AsyncSession,
+        build: Callable[[], Awaitable[Any]],
+        model: Any = None,
+    ) -> Response:
+        """Serve the cached body, or 304 when the client already has it."""
+        entry = await self.get(request, session, build, model)
+        headers = {
+            "ETag": entry.etag,
+            "Cache-Control": settings.CATALOG_CACHE_CONTROL,
+            "Vary": "Accept-Encoding",
+        }
+        if etag_matches(request, entry.etag):
+            return Response(status_code=304, headers=headers)
+        if "gzip" in request.headers.get("Accept-Encoding", ""):
+            headers["Content-Encoding"] = "gzip"
+            return Response(
+                entry.gzip_body, media_type="application/json", headers=headers
+            )
+        return Response(entry.body, media_type="application/json", headers=headers)
+
+    def _prefix(self) -> str:
+        return "{}-{}-{}-{}-".format(
+            self.name, settings.VERSION, MIGRATIONS[-1].version, self.version
+        )
+
+    def _path(self, key: str) -> str:
+        return os.path.join(
+            self.directory,
+            "{}{}.json.gz".format(self._prefix(), sha1(key.encode()).hexdigest()),
+        )
+
+    def _remove_stale_files(self):
+        current = self._prefix()
+        for path in glob(os.path.join(self.directory, self.name + "-*.json.gz")):
+            if not os.path.basename(path).startswith(current):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass  # already removed by another worker
+
+    def _load(self, key: str) -> Optional[CachedBody]:
+        try:
+            with open(self._path(key), "rb") as f:
+                gzip_body = f.read()
+            body = gzip.decompress(gzip_body)
+        except (OSError, EOFError):
+            return None
+        return CachedBody('"{}"'.format(sha1(body).hexdigest()), body, gzip_body)
+
+    def _store(self, key: str, entry: CachedBody):
+        path = self._path(key)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(path + ".tmp", "wb") as f:
+                f.write(entry.gzip_body)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            logger.error("Failed to write %s cache to disk: %s", self.name, e)
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("If-None-Match")
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
+# all reference data for client start, see /system/bootstrap
+bootstrap_cache = VersionedCache("bootstrap", directory=settings.CACHE_DIR)
+# techs, subtechs and exercises
+catalog_cache = VersionedCache("catalog", dependents=[bootstrap_cache])
+
+
+class CachedSession(NamedTuple):
+    coach: Coach
+    expires_at: int  # session expiry timestamp
+    cached_until: float  # monotonic
+
+
+class SessionCache:
+    """
+    Active coach sessions by access token, so an authenticated request
+    needs no session or coach query.
+
+    Login, refresh and logout write through. Entries are trusted for at most
+    SESSION_CACHE_TTL seconds, which bounds how long a session revoked by
+    another worker keeps working in this one.
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, CachedSession] = {}
+
+    def get(self, access_token: str) -> Optional[Coach]:
+        entry = self._entries.get(access_token)
+        if entry is None:
+            return None
+        if entry.cached_until < monotonic() or entry.expires_at <= time():
+            self._entries.pop(access_token, None)
+            return None
+        return entry.coach
+
+    def put(self, access_token: str, coach: Coach, expires_at: int):
+        if len(self._entries) >= settings.SESSION_CACHE_MAX_ENTRIES:
+            self._entries.pop(next(iter(self._entries)))
+        self._entries[access_token] = CachedSession(
+            coach, expires_at, monotonic() + settings.SESSION_CACHE_TTL
+        )
+
+    def discard(self, access_token: str):
+        self._entries.pop(access_token, None)
+
+
+session_cache = SessionCache()
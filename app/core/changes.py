@@ -0,0 +1,52 @@
+from datetime import datetime
+from typing import Iterable, Union
+
+from sqlalchemy import Select
+from sqlmodel import insert, literal, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core.dialect import lock_change_log
+from app.data.db import ChangeLog
+from app.data.utils import Entity
+
+change_log_columns = ["entity", "entity_id", "deleted", "changed_at"]
+
+
+async def record_changes(
+    session: AsyncSession,
+    entity: Entity,
+    ids: Union[Iterable[int], Select],
+    deleted: bool = False,
+):
+    """Log entities as changed (or deleted) in the session's transaction.
+
+    Write handlers call this after their own writes, right before commit;
+    GET /system/changes serves the log to syncing clients. ids can also be a
+    select of ids, logged with a single INSERT ... SELECT. Log writers are
+    serialized from here until commit (see lock_change_log), so seqs become
+    visible in order; rows the handler deletes or whose filtered columns it
+    changes are collected first (or with RETURNING) and logged as a list.
+    """
+    await lock_change_log(session)
+    changed_at = int(datetime.now().timestamp())
+    if isinstance(ids, Select):
+        subquery = ids.subquery()
+        rows = select(
+            literal(entity, ChangeLog.__table__.c.entity.type),
+            *subquery.c,
+            literal(deleted),
+            literal(changed_at),
+        )
+        await session.exec(insert(ChangeLog).from_select(change_log_columns, rows))
+        return
+    params = [
+        {
+            "entity": entity,
+            "entity_id": entity_id,
+            "deleted": deleted,
+            "changed_at": changed_at,
+        }
+        for entity_id in set(ids)
+    ]
+    if params:
+        await session.exec(insert(ChangeLog), params=params)
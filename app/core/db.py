@@ -1,26 +1,93 @@
-from typing import Iterator
+from typing import AsyncIterator
 
-from sqlmodel import create_engine, SQLModel, Session
+from fastapi import Request
 from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from app.core.config import settings
+from app.core.dialect import database_url, is_sqlite, read_only_connect_args
+from app.core.profiling import track_queries
 
-connect_args = {"check_same_thread": False}
-engine = create_engine(
-    "sqlite:///" + settings.SQLITE_DB, echo=False, connect_args=connect_args
+engine = create_async_engine(
+    database_url(),
+    echo=False,
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_pre_ping=settings.DB_POOL_PRE_PING,
+    pool_recycle=settings.DB_POOL_RECYCLE,
 )
+# separate pool for GET requests, so long writes can't hold up reads
+read_engine = create_async_engine(
+    database_url(),
+    echo=False,
+    pool_size=settings.DB_READ_POOL_SIZE,
+    max_overflow=settings.DB_READ_MAX_OVERFLOW,
+    pool_pre_ping=settings.DB_POOL_PRE_PING,
+    pool_recycle=settings.DB_POOL_RECYCLE,
+    connect_args=read_only_connect_args(),
+)
+READ_METHODS = ("GET", "HEAD")
+track_queries(engine)
+track_queries(read_engine)
+
+sqlite_pragmas = {
+    "journal_mode": settings.SQLITE_JOURNAL_MODE,
+    "synchronous": settings.SQLITE_SYNCHRONOUS,
+    "mmap_size": settings.SQLITE_MMAP_SIZE,
+    "cache_size": settings.SQLITE_CACHE_SIZE,
+    "temp_store": settings.SQLITE_TEMP_STORE,
+    "busy_timeout": settings.SQLITE_BUSY_TIMEOUT,
+}
+
 
-@event.listens_for(engine, "connect")
 def set_sqlite_pragma(dbapi_connection, connection_record):
     # Ensure PRAGMA foreign_keys=ON is set for new connections
     cursor = dbapi_connection.cursor()
     cursor.execute("PRAGMA foreign_keys=ON")
+    for pragma, value in sqlite_pragmas.items():
+        cursor.execute("PRAGMA {}={}".format(pragma, value))
     cursor.close()
 
-def get_session() -> Iterator[Session]:
-    with Session(engine) as session:
+
+def set_sqlite_query_only(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA query_only=ON")
+    cursor.close()
+
+
+if is_sqlite():
+    event.listen(engine.sync_engine, "connect", set_sqlite_pragma)
+    event.listen(read_engine.sync_engine, "connect", set_sqlite_pragma)
+    event.listen(read_engine.sync_engine, "connect", set_sqlite_query_only)
+
+
+def create_session() -> AsyncSession:
+    # objects stay usable after commit, there is no lazy IO on attribute access
+    return AsyncSession(engine, expire_on_commit=False)
+
+
+def create_read_session() -> AsyncSession:
+    return AsyncSession(read_engine, expire_on_commit=False)
+
+
+async def get_session(request: Request) -> AsyncIterator[AsyncSession]:
+    """Read-only session for GET/HEAD requests, writable otherwise."""
+    if request.method in READ_METHODS:
+        session = create_read_session()
+    else:
+        session = create_session()
+    async with session:
+        yield session
+
+
+async def get_write_session() -> AsyncIterator[AsyncSession]:
+    """Writable session for GET routes that change data."""
+    async with create_session() as session:
         yield session
 
 
-def init_db():
-    SQLModel.metadata.create_all(engine)
+async def init_db():
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
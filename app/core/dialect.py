@@ -0,0 +1,110 @@
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List
+
+from sqlalchemy import Column, Integer, MetaData, Table
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+from sqlalchemy.sql.dml import Insert
+from sqlmodel import delete, insert, text
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core.config import settings
+
+
+def database_url() -> str:
+    """DATABASE_URL when set, otherwise the SQLITE_DB file."""
+    return settings.DATABASE_URL or "sqlite+aiosqlite:///" + settings.SQLITE_DB
+
+
+def is_sqlite() -> bool:
+    return make_url(database_url()).get_backend_name() == "sqlite"
+
+
+def read_only_connect_args() -> Dict[str, Any]:
+    """Connection arguments that make every transaction read only.
+
+    sqlite has no such argument, its connections get PRAGMA query_only.
+    """
+    if is_sqlite():
+        return {}
+    return {"server_settings": {"default_transaction_read_only": "on"}}
+
+
+async def disable_foreign_keys(session: AsyncSession):
+    """Stop enforcing foreign keys on the session's connection (sqlite only).
+
+    PostgreSQL constraints are not deferrable here, they stay enforced and
+    violations surface on flush like any other integrity error.
+    """
+    if is_sqlite():
+        await session.exec(text("PRAGMA foreign_keys = OFF"))
+
+
+def insert_ignore(model, *conflict_columns: str) -> Insert:
+    """INSERT ... ON CONFLICT (conflict_columns) DO NOTHING.
+
+    Rows clashing with an existing one on the unique conflict_columns are
+    skipped instead of failing the statement; with RETURNING only the rows
+    actually inserted come back.
+    """
+    insert_ = sqlite.insert if is_sqlite() else postgresql.insert
+    return insert_(model).on_conflict_do_nothing(index_elements=list(conflict_columns))
+
+
+# pg_advisory_xact_lock key serializing ChangeLog writers
+CHANGE_LOG_LOCK = 4805
+
+
+async def lock_change_log(session: AsyncSession):
+    """Hold the change log lock until the session's transaction ends.
+
+    Writers then take ChangeLog seqs in commit order, so a reader never sees
+    a higher seq before a lower one commits. sqlite already holds its single
+    write lock from the first write until commit.
+
+    The cost is throughput: on PostgreSQL transactions that log changes run
+    their ChangeLog insert, cache bump and commit one at a time, so they top
+    out at about one commit latency each (a few thousand per second locally,
+    far fewer across a network). The lock is therefore taken last, after the
+    handler's own writes, which still run concurrently.
+    """
+    if not is_sqlite():
+        await session.exec(
+            text("SELECT pg_advisory_xact_lock(:key)"), params={"key": CHANGE_LOG_LOCK}
+        )
+
+
+@asynccontextmanager
+async def temp_id_map(
+    session: AsyncSession, name: str, mapping: Dict[int, int]
+) -> AsyncIterator[Table]:
+    """Temporary (old_id, new_id) table on the session's connection.
+
+    Lets a single UPDATE or INSERT ... SELECT join against an id mapping.
+    sqlite runs the CREATE outside the transaction, so a table left behind
+    by a failed request is reused and emptied first; it is dropped on exit.
+    """
+    table = Table(
+        name,
+        MetaData(),
+        Column("old_id", Integer, primary_key=True),
+        Column("new_id", Integer, nullable=False),
+        prefixes=["TEMPORARY"],
+    )
+    connection = await session.connection()
+    await connection.run_sync(table.create, checkfirst=True)
+    await session.exec(delete(table))
+    if mapping:
+        await session.exec(
+            insert(table),
+            params=[{"old_id": old, "new_id": new} for old, new in mapping.items()],
+        )
+    yield table
+    await connection.run_sync(table.drop)
+
+
+def maintenance_statements() -> List[str]:
+    """Periodic housekeeping run by the scheduler."""
+    if is_sqlite():
+        return ["PRAGMA optimize", "PRAGMA wal_checkpoint(TRUNCATE)"]
+    return ["ANALYZE"]
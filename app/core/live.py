@@ -0,0 +1,143 @@
+import asyncio
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+)
+
+from fastapi import WebSocket
+
+from app.core.config import settings
+from app.core.logger import logger
+
+class CommitResult(NamedTuple):
+    id: Optional[int]  # stored id, None when the event was rejected
+    error: Optional[str] = None
+    # stored before (resent client_id), acked but not pushed to viewers again
+    duplicate: bool = False
+
+
+Commit = Callable[[List[Any]], Awaitable[List[CommitResult]]]
+
+
+class PendingEvent(NamedTuple):
+    websocket: WebSocket
+    ref: Any  # client reference echoed in the ack
+    event: Any
+
+
+class LiveGame:
+    """
+    Viewers of one game and the events waiting for the next group commit.
+
+    Events are stored together, every LIVE_COMMIT_EVENTS events or
+    LIVE_COMMIT_MS after the first pending one, so a busy match costs one
+    transaction per batch instead of one per tap. After the commit every
+    sender gets an ack with the stored id and the other viewers get the new
+    rows; a resent event is acked again but not pushed twice.
+    """
+
+    def __init__(self, game_id: int, commit: Commit):
+        self.game_id = game_id
+        self.commit = commit
+        self.connections: Set[WebSocket] = set()
+        self.pending: List[PendingEvent] = []
+        self._timer: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    async def submit(self, websocket: WebSocket, ref: Any, event: Any):
+        self.pending.append(PendingEvent(websocket, ref, event))
+        if len(self.pending) >= settings.LIVE_COMMIT_EVENTS:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(settings.LIVE_COMMIT_MS / 1000)
+        self._timer = None
+        await self.flush()
+
+    async def flush(self):
+        """Commit the pending events, ack the senders and notify the viewers."""
+        async with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            batch, self.pending = self.pending, []
+            if not batch:
+                return
+            try:
+                results = await self.commit([pending.event for pending in batch])
+            except Exception as e:
+                logger.error(
+                    "Live commit for game {} failed: {}".format(self.game_id, e)
+                )
+                results = [CommitResult(None, "Commit failed")] * len(batch)
+
+        created = []
+        for pending, result in zip(batch, results):
+            if result.error is not None:
+                await self.send(
+                    pending.websocket,
+                    {"type": "error", "ref": pending.ref, "detail": result.error},
+                )
+                continue
+            await self.send(
+                pending.websocket,
+                {"type": "ack", "ref": pending.ref, "id": result.id},
+            )
+            if not result.duplicate:
+                created.append((pending.websocket, result.id, pending.event))
+
+        for websocket in list(self.connections):
+            actions = [
+                {**event.model_dump(mode="json"), "id": event_id}
+                for sender, event_id, event in created
+                if sender is not websocket
+            ]
+            if actions:
+                await self.send(websocket, {"type": "actions", "actions": actions})
+
+    async def send(self, websocket: WebSocket, message: Dict[str, Any]):
+        try:
+            await websocket.send_json(message)
+        except Exception:
+            # the viewer is gone, its receive loop cleans up
+            self.connections.discard(websocket)
+
+
+class LiveGames:
+    """Open LiveGame per game id, dropped when the last viewer leaves."""
+
+    def __init__(self):
+        self.games: Dict[int, LiveGame] = {}
+
+    def join(self, game_id: int, websocket: WebSocket, commit: Commit) -> LiveGame:
+        live_game = self.games.get(game_id)
+        if live_game is None:
+            live_game = self.games[game_id] = LiveGame(game_id, commit)
+        live_game.connections.add(websocket)
+        return live_game
+
+    async def leave(self, game_id: int, websocket: WebSocket):
+        live_game = self.games.get(game_id)
+        if live_game is None:
+            return
+        live_game.connections.discard(websocket)
+        if not live_game.connections:
+            # store what the last viewer sent before forgetting the game
+            await live_game.flush()
+            if not live_game.connections:
+                self.games.pop(game_id, None)
+
+    async def flush_all(self):
+        for live_game in list(self.games.values()):
+            await live_game.flush()
+
+
+live_games = LiveGames()
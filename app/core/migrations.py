@@ -0,0 +1,124 @@
+from datetime import datetime
+from time import perf_counter
+from typing import List, NamedTuple, Tuple
+
+from sqlalchemy import inspect
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import SQLModel, select, text
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core.db import create_session
+from app.core.logger import logger
+from app.data.db import SchemaMigration
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    statements: Tuple[str, ...]
+    # (table, column) of the models added before the statements run
+    columns: Tuple[Tuple[str, str], ...] = ()
+
+
+# append only, statements must be idempotent (IF NOT EXISTS) and columns
+# are only added when missing, databases created by init_db already have
+# the current schema
+MIGRATIONS: List[Migration] = [
+    Migration(
+        1,
+        "hot path indexes",
+        (
+            "CREATE INDEX IF NOT EXISTS ix_action_player ON action (player)",
+            "CREATE INDEX IF NOT EXISTS ix_action_game ON action (game)",
+            "CREATE INDEX IF NOT EXISTS ix_coachsession_access_token "
+            "ON coachsession (access_token)",
+            "CREATE INDEX IF NOT EXISTS ix_coachsession_expires_at "
+            "ON coachsession (expires_at)",
+            "CREATE INDEX IF NOT EXISTS ix_subtech_tech ON subtech (tech)",
+            "CREATE INDEX IF NOT EXISTS ix_exercisetosubtech_subtech_id "
+            "ON exercisetosubtech (subtech_id)",
+            "CREATE INDEX IF NOT EXISTS ix_teamtoplayer_player_id "
+            "ON teamtoplayer (player_id)",
+            "CREATE INDEX IF NOT EXISTS ix_game_team_a ON game (team_a)",
+            "CREATE INDEX IF NOT EXISTS ix_game_team_b ON game (team_b)",
+        ),
+    ),
+    Migration(
+        2,
+        "client ids",
+        (
+            "CREATE UNIQUE INDEX IF NOT EXISTS ix_action_client_id "
+            "ON action (client_id)",
+            "CREATE UNIQUE INDEX IF NOT EXISTS ix_game_client_id ON game (client_id)",
+            "CREATE UNIQUE INDEX IF NOT EXISTS ix_team_client_id ON team (client_id)",
+        ),
+        columns=(("action", "client_id"), ("game", "client_id"), ("team", "client_id")),
+    ),
+]
+
+
+async def add_missing_columns(
+    session: AsyncSession, columns: Tuple[Tuple[str, str], ...]
+):
+    """ALTER TABLE ... ADD COLUMN for the model columns the database lacks."""
+    if not columns:
+        return
+    connection = await session.connection()
+
+    def missing(sync_connection) -> List[str]:
+        inspector = inspect(sync_connection)
+        statements = []
+        for table, name in columns:
+            existing = {column["name"] for column in inspector.get_columns(table)}
+            if name in existing:
+                continue
+            column = SQLModel.metadata.tables[table].c[name]
+            statements.append(
+                "ALTER TABLE {} ADD COLUMN {} {}".format(
+                    table, name, column.type.compile(dialect=sync_connection.dialect)
+                )
+            )
+        return statements
+
+    for statement in await connection.run_sync(missing):
+        await session.exec(text(statement))
+
+
+async def run_migrations():
+    """Apply pending migrations in version order and record each of them.
+
+    The version row is inserted before any DDL runs and the migration commits
+    with it. A worker starting at the same time blocks on that row until the
+    first one commits and then skips the migration, so columns are never
+    added twice.
+    """
+    async with create_session() as session:
+        applied = set((await session.exec(select(SchemaMigration.version))).all())
+        for migration in MIGRATIONS:
+            if migration.version in applied:
+                continue
+            record = SchemaMigration(
+                version=migration.version,
+                name=migration.name,
+                applied_at=int(datetime.now().timestamp()),
+                duration_ms=0,
+            )
+            session.add(record)
+            try:
+                await session.flush()
+            except IntegrityError:
+                # another worker applied it first
+                await session.rollback()
+                continue
+            start = perf_counter()
+            await add_missing_columns(session, migration.columns)
+            for statement in migration.statements:
+                await session.exec(text(statement))
+            record.duration_ms = (perf_counter() - start) * 1000
+            await session.commit()
+            logger.info(
+                "Applied migration %s (%s) in %.1f ms",
+                migration.version,
+                migration.name,
+                record.duration_ms,
+            )
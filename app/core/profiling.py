@@ -0,0 +1,240 @@
+import re
+from collections import Counter, deque
+from contextvars import ContextVar
+from datetime import datetime
+from time import perf_counter
+from typing import Any, Deque, Dict, List, NamedTuple, Optional
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from app.core.config import settings
+from app.core.dialect import is_sqlite
+from app.core.logger import logger
+
+
+class QueryStats:
+    """Queries executed while handling a single request."""
+
+    def __init__(self, scope: Optional[Dict[str, Any]] = None):
+        self.scope = scope
+        self.count = 0
+        self.duration = 0.0  # seconds
+        self.statements: Counter = Counter()
+
+    def record(self, statement: str, duration: float):
+        self.count += 1
+        self.duration += duration
+        self.statements[statement] += 1
+
+    def repeated(self):
+        """Statements executed at least N_PLUS_ONE_THRESHOLD times."""
+        return [
+            (statement, count)
+            for statement, count in self.statements.most_common()
+            if count >= settings.N_PLUS_ONE_THRESHOLD
+        ]
+
+    @property
+    def route(self) -> str:
+        """Route template of the request, e.g. GET /games/{game_id}."""
+        if self.scope is None:
+            return ""
+        # the router stores the matched route in the (shared) scope
+        route = self.scope.get("route")
+        path = getattr(route, "path", None) or self.scope["path"]
+        return "{} {}".format(self.scope["method"], path)
+
+
+class SlowQuery(NamedTuple):
+    statement: str
+    parameters: str
+    route: str
+    duration_ms: float
+    plan: List[str]
+    timestamp: int
+
+
+current_stats: ContextVar[Optional[QueryStats]] = ContextVar(
+    "current_stats", default=None
+)
+
+
+# newest SLOW_QUERY_LOG_SIZE slow statements, see slow_query_summary
+slow_queries: Deque[SlowQuery] = deque(maxlen=settings.SLOW_QUERY_LOG_SIZE)
+EXPLAINABLE = ("select", "insert", "update", "delete", "with")
+
+
+def mask_parameters(parameters) -> str:
+    """Shape of the bound parameters without their values.
+
+    Slow statements on coach and coachsession bind tokens and password
+    hashes, so only the parameter types are logged, e.g. (str, int).
+    """
+    if isinstance(parameters, dict):
+        return repr({key: type(value).__name__ for key, value in parameters.items()})
+    if isinstance(parameters, list):
+        # executemany, one parameter set per row
+        if not parameters:
+            return "[]"
+        return "{} x {}".format(len(parameters), mask_parameters(parameters[0]))
+    if isinstance(parameters, tuple):
+        return "({})".format(", ".join(type(value).__name__ for value in parameters))
+    return type(parameters).__name__
+
+
+# quoted literals in plan lines, PostgreSQL prints the bound values there
+QUOTED_LITERAL = re.compile(r"'(?:[^']|'')*'")
+
+
+def explain(conn, statement: str, parameters) -> List[str]:
+    """Query plan of an already executed statement, one line per step.
+
+    On PostgreSQL the EXPLAIN runs inside the request's transaction, so it is
+    wrapped in a savepoint: a failing EXPLAIN is rolled back to it instead of
+    aborting the transaction the handler is still using.
+    """
+    if not statement.lstrip().lower().startswith(EXPLAINABLE):
+        return []
+    # raw DBAPI cursor, so the explain itself doesn't go through these hooks
+    cursor = conn.connection.cursor()
+    try:
+        if is_sqlite():
+            # rows are (id, parent, notused, detail)
+            cursor.execute("EXPLAIN QUERY PLAN " + statement, parameters)
+            return [row[3] for row in cursor.fetchall()]
+        cursor.execute("SAVEPOINT slow_query_explain")
+        try:
+            cursor.execute("EXPLAIN " + statement, parameters)
+            plan = [QUOTED_LITERAL.sub("'?'", row[0]) for row in cursor.fetchall()]
+        except Exception:
+            cursor.execute("ROLLBACK TO SAVEPOINT slow_query_explain")
+            raise
+        finally:
+            cursor.execute("RELEASE SAVEPOINT slow_query_explain")
+        return plan
+    except Exception as e:
+        return ["EXPLAIN failed: {}".format(e)]
+    finally:
+        cursor.close()
+
+
+def record_slow_query(conn, statement, parameters, executemany, duration):
+    stats = current_stats.get()
+    route = stats.route if stats is not None else ""
+    # an executemany is a batch of rows, the plan of one of them says little
+    plan = [] if executemany else explain(conn, statement, parameters)
+    slow_query = SlowQuery(
+        statement=" ".join(statement.split()),
+        parameters=mask_parameters(parameters),
+        route=route,
+        duration_ms=duration * 1000,
+        plan=plan,
+        timestamp=int(datetime.now().timestamp()),
+    )
+    slow_queries.append(slow_query)
+    logger.warning(
+        "Slow query %.1f ms in %s: %s %s plan: %s",
+        slow_query.duration_ms,
+        route or "background task",
+        slow_query.statement,
+        slow_query.parameters,
+        " | ".join(plan),
+    )
+
+
+def slow_query_summary(limit: int) -> List[Dict[str, Any]]:
+    """Slow statements in the log grouped by SQL, by cumulative time."""
+    summary: Dict[str, Dict[str, Any]] = {}
+    for slow_query in slow_queries:
+        entry = summary.setdefault(
+            slow_query.statement,
+            {
+                "statement": slow_query.statement,
+                "count": 0,
+                "total_ms": 0.0,
+                "max_ms": 0.0,
+                "routes": [],
+            },
+        )
+        entry["count"] += 1
+        entry["total_ms"] += slow_query.duration_ms
+        if slow_query.route and slow_query.route not in entry["routes"]:
+            entry["routes"].append(slow_query.route)
+        if slow_query.duration_ms >= entry["max_ms"]:
+            # parameters and plan of the slowest run
+            entry["max_ms"] = slow_query.duration_ms
+            entry["parameters"] = slow_query.parameters
+            entry["plan"] = slow_query.plan
+            entry["last_seen"] = slow_query.timestamp
+    entries = sorted(summary.values(), key=lambda e: e["total_ms"], reverse=True)
+    return entries[:limit]
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration = perf_counter() - conn.info["query_start"].pop()
+    stats = current_stats.get()
+    if stats is not None:
+        stats.record(statement, duration)
+    if settings.SLOW_QUERY_MS and duration * 1000 >= settings.SLOW_QUERY_MS:
+        record_slow_query(conn, statement, parameters, executemany, duration)
+
+
+def track_queries(engine: AsyncEngine):
+    """Count and time queries of the current request, keep the slow ones."""
+    event.listen(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine.sync_engine, "after_cursor_execute", after_cursor_execute)
+
+
+class QueryStatsMiddleware:
+    """
+    Adds the request's query count and DB time to the response headers
+    (X-DB-Queries, Server-Timing) and logs statements repeated within one
+    request, which usually means an N+1 loop in the handler.
+
+    Plain ASGI, so the context variable set here is the one the handler and
+    the engine hooks see.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats(scope)
+        token = current_stats.set(stats)
+
+        async def send_with_stats(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"x-db-queries", str(stats.count).encode()))
+                headers.append(
+                    (
+                        b"server-timing",
+                        'db;dur={:.1f};desc="{} queries"'.format(
+                            stats.duration * 1000, stats.count
+                        ).encode(),
+                    )
+                )
+                message["headers"] = headers
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_stats)
+        finally:
+            current_stats.reset(token)
+            for statement, count in stats.repeated():
+                logger.debug(
+                    "Possible N+1 in %s %s: %d x %s",
+                    scope["method"],
+                    scope["path"],
+                    count,
+                    " ".join(statement.split()),
+                )
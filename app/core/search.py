@@ -3,14 +3,14 @@ from typing import List
 from tantivy import Index, SchemaBuilder, Document
 from sqlmodel import SQLModel, select
 
-from app.core.db import get_session
+from app.core.db import create_session
 from app.core.logger import logger
 from app.data.db import Exercise
 
 Exercise_search = None
 
 
-def create_index(model: SQLModel, searchable_fields: List[str]) -> SchemaBuilder:
+async def create_index(model: SQLModel, searchable_fields: List[str]) -> SchemaBuilder:
     schema_builder = SchemaBuilder()
 
     for field in searchable_fields:
@@ -21,8 +21,8 @@ def create_index(model: SQLModel, searchable_fields: List[str]) -> SchemaBuilder
 
     writer = index.writer()
 
-    for session in get_session():
-        documents: List[SQLModel] = session.exec(select(model)).all()
+    async with create_session() as session:
+        documents: List[SQLModel] = (await session.exec(select(model))).all()
         for document in documents:
             writer.add_document(
                 Document().from_dict(document.model_dump(exclude_none=True))
@@ -30,8 +30,8 @@ def create_index(model: SQLModel, searchable_fields: List[str]) -> SchemaBuilder
         writer.commit()
 
 
-def init_search():
+async def init_search():
     global Exercise_search
 
-    Exercise_search = create_index(Exercise, ["name", "description"])
+    Exercise_search = await create_index(Exercise, ["name", "description"])
     logger.info("Search indexes created")
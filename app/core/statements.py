@@ -0,0 +1,143 @@
+"""
+Prebuilt statements for the stats and plan queries.
+
+These run many times per plan generation and per stats request. Building a
+select and computing its cache key costs more than the compiled cache
+lookup itself, so they are built once here with bind parameters and
+executed with params=, e.g.
+
+    await session.exec(max_plan_exercise_id, params={"player": 1, ...})
+
+A prebuilt statement memoizes its cache key, so only the parameters change
+between calls.
+"""
+
+from sqlmodel import bindparam, col, desc, func, or_, select
+
+from app.data.algorithm import (
+    ImpactSum,
+    PlanExercise,
+    PlayerSum,
+    SubtechSum,
+    TechSum,
+    ZoneSum,
+)
+from app.data.db import Exercise, ExerciseToSubtech, Subtech, Tech
+
+# stats
+
+player_sum = select(PlayerSum).where(col(PlayerSum.player) == bindparam("player"))
+
+tech_sums_by_player = (
+    select(TechSum)
+    .where(col(TechSum.player) == bindparam("player"))
+    .order_by(desc(TechSum.prozent))
+)
+tech_sum = select(TechSum).where(
+    col(TechSum.player) == bindparam("player"),
+    col(TechSum.tech) == bindparam("tech"),
+)
+
+subtech_sums_by_tech = (
+    select(SubtechSum)
+    .where(
+        col(SubtechSum.player) == bindparam("player"),
+        col(SubtechSum.tech) == bindparam("tech"),
+    )
+    .order_by(desc(SubtechSum.prozent))
+)
+subtech_sum = select(SubtechSum).where(
+    col(SubtechSum.player) == bindparam("player"),
+    col(SubtechSum.tech) == bindparam("tech"),
+    col(SubtechSum.subtech) == bindparam("subtech"),
+)
+
+impact_sums_by_subtech = (
+    select(ImpactSum)
+    .where(
+        col(ImpactSum.player) == bindparam("player"),
+        col(ImpactSum.tech) == bindparam("tech"),
+        col(ImpactSum.subtech) == bindparam("subtech"),
+    )
+    .order_by(desc(ImpactSum.prozent))
+)
+impact_sum = select(ImpactSum).where(
+    col(ImpactSum.player) == bindparam("player"),
+    col(ImpactSum.tech) == bindparam("tech"),
+    col(ImpactSum.subtech) == bindparam("subtech"),
+    col(ImpactSum.impact) == bindparam("impact"),
+)
+
+zone_sums_by_impact = (
+    select(ZoneSum)
+    .where(
+        col(ZoneSum.player) == bindparam("player"),
+        col(ZoneSum.tech) == bindparam("tech"),
+        col(ZoneSum.subtech) == bindparam("subtech"),
+        col(ZoneSum.impact) == bindparam("impact"),
+    )
+    .order_by(desc(ZoneSum.prozent))
+)
+# zone with the highest prozent, ties go to the lowest zone
+best_zone = (
+    select(col(ZoneSum.zone), col(ZoneSum.prozent))
+    .where(
+        col(ZoneSum.player) == bindparam("player"),
+        col(ZoneSum.tech) == bindparam("tech"),
+        col(ZoneSum.subtech) == bindparam("subtech"),
+        col(ZoneSum.impact) == bindparam("impact"),
+    )
+    .order_by(desc(ZoneSum.prozent), col(ZoneSum.zone))
+    .limit(1)
+)
+
+# every sum row of a player, used by calc_prozent
+sums_by_player = {
+    model: select(model).where(col(model.player) == bindparam("player"))
+    for model in (PlayerSum, TechSum, SubtechSum, ImpactSum, ZoneSum)
+}
+
+techs_by_id = select(Tech).where(col(Tech.id).in_(bindparam("ids", expanding=True)))
+techs_not_in = select(Tech).where(
+    col(Tech.id).not_in(bindparam("ids", expanding=True))
+)
+subtechs_by_id = select(Subtech).where(
+    col(Subtech.id).in_(bindparam("ids", expanding=True))
+)
+subtechs_by_tech = select(Subtech).where(col(Subtech.tech) == bindparam("tech"))
+
+# plan
+
+exercise_ids_for_subtech = select(ExerciseToSubtech.exercise_id).where(
+    col(ExerciseToSubtech.subtech_id) == bindparam("subtech")
+)
+# odd weeks: exercises against FAIL/MISTAKE impacts
+reinforcing_exercises = select(Exercise).where(
+    col(Exercise.id).in_(exercise_ids_for_subtech),
+    or_(
+        col(Exercise.simulation_exercises) == True,
+        col(Exercise.exercises_with_the_ball_on_your_own) == True,
+        col(Exercise.exercises_with_the_ball_in_pairs) == True,
+    ),
+    col(Exercise.exercises_for_learning) == False,
+)
+# even weeks: exercises building on EFFICIENCY/SCORE impacts
+improving_exercises = select(Exercise).where(
+    col(Exercise.id).in_(exercise_ids_for_subtech),
+    or_(
+        col(Exercise.exercises_with_the_ball_in_pairs) == True,
+        col(Exercise.exercises_with_the_ball_in_groups) == True,
+        col(Exercise.exercises_in_difficult_conditions) == True,
+    ),
+    col(Exercise.exercises_for_learning) == False,
+)
+learning_exercises = select(Exercise).where(
+    col(Exercise.id).in_(exercise_ids_for_subtech),
+    col(Exercise.exercises_for_learning) == True,
+)
+
+max_plan_exercise_id = select(func.max(PlanExercise.id)).where(
+    col(PlanExercise.player) == bindparam("player"),
+    col(PlanExercise.plan) == bindparam("plan"),
+    col(PlanExercise.week) == bindparam("week"),
+)
@@ -1,25 +1,96 @@
 from datetime import datetime
+from time import perf_counter
 
-from apscheduler.schedulers.background import BackgroundScheduler
-from sqlmodel import Session, delete, col 
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from sqlalchemy.orm import aliased
+from sqlmodel import delete, col, exists, select, text
 
-from app.core.db import engine, get_session
-from app.data.db import CoachSession
+from app.core.config import settings
+from app.core.db import create_session
+from app.core.dialect import maintenance_statements
+from app.data.db import ChangeLog, CoachSession
 from app.core.logger import logger
 
 
-def _remove_expired_sessions():
-    """Remove expired sessions."""
+async def _remove_expired_sessions():
+    """Delete expired sessions in batches of SESSION_CLEANUP_BATCH rows.
+
+    Expiry itself is enforced when a token is used, this only keeps the
+    table small. Each batch is its own short transaction found through the
+    expires_at index, so logins are not held up by a large purge.
+    """
     current_time = int(datetime.now().timestamp())
-    session = next(get_session())
-    session.exec(delete(CoachSession).where(col(CoachSession.expires_at) < current_time))
-    session.commit()
+    start = perf_counter()
+    removed = 0
+    async with create_session() as session:
+        while True:
+            expired = (
+                select(CoachSession.refresh_token)
+                .where(col(CoachSession.expires_at) < current_time)
+                .limit(settings.SESSION_CLEANUP_BATCH)
+            )
+            result = await session.exec(
+                delete(CoachSession).where(
+                    col(CoachSession.refresh_token).in_(expired.scalar_subquery())
+                )
+            )
+            await session.commit()
+            removed += result.rowcount
+            if not result.rowcount or result.rowcount < settings.SESSION_CLEANUP_BATCH:
+                break
+    logger.info(
+        "Removed %d expired sessions in %.1f ms",
+        removed,
+        (perf_counter() - start) * 1000,
+    )
+
+
+async def _optimize_database():
+    """Refresh query planner statistics (and truncate the sqlite WAL file)."""
+    async with create_session() as session:
+        for statement in maintenance_statements():
+            await session.exec(text(statement))
+            await session.commit()
+
+
+async def _compact_change_log():
+    """Drop change log entries superseded by a newer one for the same entity.
+
+    Payloads are read when the changes are requested, so only the newest
+    entry per entity matters to a syncing client.
+    """
+    newer = aliased(ChangeLog)
+    async with create_session() as session:
+        result = await session.exec(
+            delete(ChangeLog).where(
+                exists().where(
+                    newer.entity == ChangeLog.entity,
+                    newer.entity_id == ChangeLog.entity_id,
+                    col(newer.seq) > col(ChangeLog.seq),
+                )
+            )
+        )
+        await session.commit()
+    logger.info("Compacted change log, removed %d entries", result.rowcount)
 
 
 def start_scheduler():
-    logger.info("Starting scheduler for removing expired sessions")
-    scheduler = BackgroundScheduler()
-    scheduler.add_job(
-        _remove_expired_sessions, "interval", seconds=10
-    )
+    logger.info("Starting scheduler for maintenance jobs")
+    scheduler = AsyncIOScheduler()
+    if settings.SESSION_CLEANUP_MINUTES:
+        scheduler.add_job(
+            _remove_expired_sessions,
+            "interval",
+            minutes=settings.SESSION_CLEANUP_MINUTES,
+        )
+    if settings.CHANGE_LOG_COMPACT_MINUTES:
+        scheduler.add_job(
+            _compact_change_log,
+            "interval",
+            minutes=settings.CHANGE_LOG_COMPACT_MINUTES,
+        )
+    if settings.DB_MAINTENANCE_MINUTES:
+        scheduler.add_job(
+            _optimize_database, "interval", minutes=settings.DB_MAINTENANCE_MINUTES
+        )
     scheduler.start()
@@ -42,7 +42,7 @@ class ZoneSum(SQLModel, table=True):
     player: int = Field(primary_key=True, foreign_key="player.id", ondelete="CASCADE")
     tech: int = Field(primary_key=True)
     subtech: int = Field(primary_key=True)
-    impact: int = Field(primary_key=True)
+    impact: Impact = Field(primary_key=True)
     zone: str = Field(primary_key=True)
     sum_actions: int = Field(default=0)
     prozent: float = Field(default=0)
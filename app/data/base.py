@@ -39,8 +39,8 @@ class GameBase(SQLModel):
     description: Optional[str] = Field(None, description="Description")
     from_timestamp: Optional[int] = Field(None, description="Start timestamp")
     to_timestamp: Optional[int] = Field(None, description="End timestamp")
-    team_a: int = Field(..., foreign_key="team.id")
-    team_b: int = Field(..., foreign_key="team.id")
+    team_a: int = Field(..., foreign_key="team.id", index=True)
+    team_b: int = Field(..., foreign_key="team.id", index=True)
 
     @field_validator("from_timestamp", "to_timestamp", mode="before")
     def timestamp_validator(cls, v) -> Optional[int]:
@@ -57,7 +57,7 @@ class TechBase(SQLModel):
 
 
 class SubtechBase(SQLModel):
-    tech: int = Field(..., foreign_key="tech.id", ondelete="CASCADE")
+    tech: int = Field(..., foreign_key="tech.id", ondelete="CASCADE", index=True)
     name: str
     description: Optional[str] = Field(None, description="Description")
     difficulty: int = Field(..., description="Difficulty", ge=1, le=3)
@@ -66,7 +66,7 @@ class SubtechBase(SQLModel):
 class ActionBase(SQLModel):
     game: int = Field(..., foreign_key="game.id")
     team: int = Field(..., foreign_key="team.id")
-    player: int = Field(..., foreign_key="player.id")
+    player: int = Field(..., foreign_key="player.id", index=True)
     subtech: int = Field(..., foreign_key="subtech.id")
     from_zone: int
     to_zone: int
@@ -109,7 +109,7 @@ class UpdateBase(SQLModel):
 
 
 class CoachSessionBase(SQLModel):
-    access_token: str = Field(...)
+    access_token: str = Field(..., index=True)
     refresh_token: str = Field(..., primary_key=True)
 
 class AuthBase(SQLModel):
@@ -1,4 +1,5 @@
 from typing import List, Optional
+from uuid import UUID
 
 from sqlmodel import Field
 
@@ -6,7 +7,9 @@ from app.data.base import *
 
 
 class GameCreate(GameBase):
-    pass
+    client_id: Optional[UUID] = Field(
+        None, description="Client generated id, uploading it again is a no-op"
+    )
 
 
 class CoachCreate(CoachBase):
@@ -29,6 +32,9 @@ class PlayerCreate(PlayerBase):
 
 
 class TeamCreate(TeamBase):
+    client_id: Optional[UUID] = Field(
+        None, description="Client generated id, uploading it again is a no-op"
+    )
     players: List["TeamToPlayerCreate"] = Field(
         ..., description="List of TeamToPlayer relations"
     )
@@ -44,7 +50,9 @@ class FileCreate(FileBase):
 
 
 class ActionCreate(ActionBase):
-    pass
+    client_id: Optional[UUID] = Field(
+        None, description="Client generated id, uploading it again is a no-op"
+    )
 
 
 class TechCreate(TechBase):
@@ -3,7 +3,7 @@ from uuid import UUID, uuid4
 
 from sqlmodel import Field, SQLModel, Relationship
 
-from app.data.utils import Impact, Amplua
+from app.data.utils import Impact, Amplua, Entity
 from app.data.base import *
 
 
@@ -12,7 +12,7 @@ class TeamToPlayer(TeamToPlayerBase, SQLModel, table=True):
         None, foreign_key="team.id", primary_key=True, ondelete="CASCADE"
     )
     player_id: int = Field(
-        None, foreign_key="player.id", primary_key=True, ondelete="CASCADE"
+        None, foreign_key="player.id", primary_key=True, ondelete="CASCADE", index=True
     )
     amplua: Amplua
 
@@ -34,6 +34,7 @@ class Player(PlayerBase, SQLModel, table=True):
 
 class Team(TeamBase, SQLModel, table=True):
     id: Optional[int] = Field(primary_key=True)
+    client_id: Optional[UUID] = Field(None, unique=True, index=True)
     players: List[TeamToPlayer] = Relationship(
         back_populates="team", cascade_delete=True
     )
@@ -42,6 +43,7 @@ class Team(TeamBase, SQLModel, table=True):
 
 class Game(GameBase, SQLModel, table=True):
     id: Optional[int] = Field(primary_key=True)
+    client_id: Optional[UUID] = Field(None, unique=True, index=True)
     coach: Optional[int] = Field(None, foreign_key="coach.id", ondelete="CASCADE")
 
 
@@ -60,7 +62,10 @@ class Subtech(SubtechBase, SQLModel, table=True):
 
 class Action(ActionBase, SQLModel, table=True):
     id: Optional[int] = Field(primary_key=True)
-    game: Optional[int] = Field(None, foreign_key="game.id", ondelete="CASCADE")
+    client_id: Optional[UUID] = Field(None, unique=True, index=True)
+    game: Optional[int] = Field(
+        None, foreign_key="game.id", ondelete="CASCADE", index=True
+    )
     coach: Optional[int] = Field(None, foreign_key="coach.id", ondelete="CASCADE")
 
 
@@ -82,7 +87,9 @@ class Update(UpdateBase, SQLModel, table=True):
 
 class CoachSession(CoachSessionBase, SQLModel, table=True):
     coach: int = Field(..., foreign_key="coach.id", ondelete="CASCADE")
-    expires_at: int = Field(..., description="Session expiration timestamp")
+    expires_at: int = Field(
+        ..., description="Session expiration timestamp", index=True
+    )
 
 
 class ExerciseToSubtech(ExerciseToSubtechBase, SQLModel, table=True):
@@ -90,7 +97,27 @@ class ExerciseToSubtech(ExerciseToSubtechBase, SQLModel, table=True):
         None, foreign_key="exercise.id", primary_key=True, ondelete="CASCADE"
     )
     subtech_id: int = Field(
-        None, foreign_key="subtech.id", primary_key=True, ondelete="CASCADE"
+        None, foreign_key="subtech.id", primary_key=True, ondelete="CASCADE", index=True
     )
     exercise: Exercise = Relationship(back_populates="subtechs")
     subtech: Subtech = Relationship(back_populates="exercises")
+
+
+class SchemaMigration(SQLModel, table=True):
+    version: int = Field(..., primary_key=True)
+    name: str
+    applied_at: int = Field(..., description="Apply timestamp")
+    duration_ms: float = Field(..., description="Time the migration took")
+
+
+class ChangeLog(SQLModel, table=True):
+    seq: Optional[int] = Field(None, primary_key=True)
+    entity: Entity
+    entity_id: int = Field(..., index=True)
+    deleted: bool = Field(False)
+    changed_at: int = Field(..., description="Change timestamp")
+
+
+class CacheVersion(SQLModel, table=True):
+    name: str = Field(..., primary_key=True)
+    version: int = Field(0, description="Bumped by every write to the cached data")
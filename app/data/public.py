@@ -1,9 +1,9 @@
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 from uuid import UUID, uuid4
 
 from sqlmodel import Field, SQLModel
 
-from app.data.utils import Impact, Amplua, NameWithId
+from app.data.utils import Impact, Amplua, Entity, NameWithId, Status
 from app.data.base import *
 
 
@@ -20,6 +20,7 @@ class PlayerPublic(PlayerBase):
 
 class TeamPublic(TeamBase):
     id: int = Field(primary_key=True, description="Team ID")
+    client_id: Optional[UUID] = Field(None, description="Client generated id")
     players: List["TeamToPlayerPublic"] = Field(
         [], description="List of TeamToPlayer relations"
     )
@@ -27,6 +28,7 @@ class TeamPublic(TeamBase):
 
 class GamePublic(GameBase):
     id: int = Field(None, description="Game ID")
+    client_id: Optional[UUID] = Field(None, description="Client generated id")
     team_a: Optional[NameWithId] = Field(None, description="Team A id")
     team_b: Optional[NameWithId] = Field(None, description="Team B id")
 
@@ -42,12 +44,33 @@ class SubtechPublic(SubtechBase):
 
 class ActionPublic(ActionBase):
     id: int = Field(None, description="Action ID")
+    client_id: Optional[UUID] = Field(None, description="Client generated id")
     game: Optional[NameWithId] = Field(None, description="Game id")
     team: Optional[NameWithId] = Field(None, description="Team id")
     player: Optional[NameWithId] = Field(None, description="Player id")
     subtech: Optional[NameWithId] = Field(None, description="Subtech id")
 
 
+class ActionBulkErrorPublic(SQLModel):
+    index: int = Field(..., description="Position of the action in the request")
+    detail: str = Field(..., description="Why the action was rejected")
+
+
+class ActionBulkPublic(SQLModel):
+    status: str = Field(..., description="Status")
+    created: int = Field(0, description="Number of inserted actions")
+    skipped: int = Field(
+        0, description="Actions whose client_id was already uploaded"
+    )
+    errors: List[ActionBulkErrorPublic] = Field(
+        [], description="Rejected actions, the others are inserted"
+    )
+
+
+class ActionsBatchUpdatePublic(Status):
+    updated: int = Field(0, description="Number of updated actions")
+
+
 class ExercisePublic(ExerciseBase):
     id: int = Field(None, description="Exercise ID")
     subtechs: List["ExerciseToSubtechPublic"] = Field(
@@ -145,3 +168,42 @@ class ImpactStatsPublic(SQLModel):
 class ExerciseToSubtechPublic(ExerciseToSubtechBase):
     exercise: Optional[NameWithId] = Field(None, description="Exercise id with name")
     subtech: Optional[NameWithId] = Field(None, description="Subtech id with name")
+
+
+class BootstrapPublic(SQLModel):
+    techs: List[TechPublic] = Field([], description="All techs")
+    subtechs: List[SubtechPublic] = Field([], description="All subtechs")
+    exercises: List[ExercisePublic] = Field(
+        [], description="All exercises with subtech relations"
+    )
+    teams: List[TeamPublic] = Field([], description="All teams with players")
+    players: List[PlayerPublic] = Field([], description="All players with teams")
+
+
+class SlowQueryPublic(SQLModel):
+    statement: str = Field(..., description="SQL statement")
+    count: int = Field(..., description="Slow runs in the log")
+    total_ms: float = Field(..., description="Cumulative time of the slow runs")
+    max_ms: float = Field(..., description="Slowest run")
+    routes: List[str] = Field([], description="Routes that ran the statement")
+    parameters: str = Field(
+        ..., description="Parameter types of the slowest run, values are not kept"
+    )
+    plan: List[str] = Field([], description="Query plan of the slowest run")
+    last_seen: int = Field(..., description="Timestamp of the slowest run")
+
+
+class ChangePublic(SQLModel):
+    seq: int = Field(..., description="Position in the change log")
+    entity: Entity = Field(..., description="Kind of the changed entity")
+    id: int = Field(..., description="Entity ID")
+    deleted: bool = Field(False, description="Entity no longer exists")
+    data: Optional[Dict[str, Any]] = Field(
+        None, description="Current entity, shaped like its *Public model"
+    )
+
+
+class ChangesPublic(SQLModel):
+    seq: int = Field(..., description="Pass as since to get the next changes")
+    more: bool = Field(False, description="More changes are waiting")
+    changes: List[ChangePublic] = Field([], description="Changes in log order")
@@ -66,11 +66,31 @@ class UpdateUpdate(UpdateBase):
     pass
 
 
+class ActionsFilter(SQLModel):
+    game: Optional[int] = Field(None, description="Game ID")
+    player: Optional[int] = Field(None, description="Player ID")
+    subtech: Optional[int] = Field(None, description="Subtech ID")
+    impact: Optional[Impact] = Field(None, description="Impact")
+
+
 class ActionsBatchUpdateOptions(SQLModel):
-    actions: List[int] = Field(..., description="List of action IDs to update")
+    actions: Optional[List[int]] = Field(
+        None, description="List of action IDs to update"
+    )
+    filter: Optional[ActionsFilter] = Field(
+        None, description="Update the actions matching all given fields instead"
+    )
     main_action: ActionUpdate = Field(..., description="Fields to update")
 
 
+class GameCloneOptions(SQLModel):
+    team_a: Optional[int] = Field(None, description="Team A of the copy")
+    team_b: Optional[int] = Field(None, description="Team B of the copy")
+    players: List["GamePlayerUpdate"] = Field(
+        [], description="Players to replace in the copied actions"
+    )
+
+
 class GamePlayerUpdate(SQLModel):
     player_before: int = Field(None, description="Player ID before update")
     player_after: int = Field(None, description="Player ID after update")
@@ -24,6 +24,21 @@ class Impact(Enum):
     FAIL = "FAIL"  # - score
 
 
+class ExportFormat(Enum):
+    NDJSON = "ndjson"
+    CSV = "csv"
+
+
+class Entity(Enum):
+    """Entities tracked in the change log."""
+
+    PLAYER = "player"
+    TEAM = "team"
+    GAME = "game"
+    ACTION = "action"
+    EXERCISE = "exercise"
+
+
 class NameWithId(SQLModel):
     id: Optional[int] = Field(None, description="ID")
     name: Optional[str] = Field(None, description="Name")
@@ -1,23 +1,33 @@
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, Depends
+from fastapi import FastAPI
 from fastapi_pagination import add_pagination
 from fastapi_pagination.utils import disable_installed_extensions_check
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.core.config import settings
-from app.core.logger import logger
 from app.api.main import api_router
-from app.core.db import init_db
+from app.core.db import engine, init_db, read_engine
+from app.core.live import live_games
 from app.core.logger import init_logging, logger
+from app.core.migrations import run_migrations
+from app.core.profiling import QueryStatsMiddleware
 from app.core.search import init_search
 from app.core.utils import start_scheduler
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    await init_db()
+    await run_migrations()
+    await init_search()
+    logger.info("Database initialized")
     start_scheduler()
     yield
+    await live_games.flush_all()
+    # pooled aiosqlite connections run on their own threads
+    await engine.dispose()
+    await read_engine.dispose()
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
@@ -28,17 +38,15 @@ app = FastAPI(
 add_pagination(app)
 disable_installed_extensions_check()
 
-init_db()
-init_search()
-logger.info("Database initialized")
-
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-DB-Queries", "Server-Timing"],
 )
+app.add_middleware(QueryStatsMiddleware)
 
 init_logging(app)
 
@@ -0,0 +1,312 @@
+"""
+Read/write concurrency of the sqlite performance profile (SQLITE_* settings)
+against the legacy defaults (rollback journal, synchronous=FULL).
+
+Run from the repository root:
+
+    python -m benchmarks.sqlite_profile connections [seconds]
+    python -m benchmarks.sqlite_profile api [seconds] [workers] [write_ratio]
+
+connections: one writer process committing single inserts and two reader
+processes running indexed aggregates on a 50k row table, straight through
+sqlite3.
+
+api: uvicorn with several workers on a seeded database, 32 clients sending
+GET /actions/ and, write_ratio of the time, POST /actions/. Needs httpx.
+"""
+
+import asyncio
+import multiprocessing
+import os
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+legacy = {
+    "journal_mode": "DELETE",
+    "synchronous": "FULL",
+    "mmap_size": 0,
+    "cache_size": -2000,
+    "temp_store": "DEFAULT",
+    "busy_timeout": 5000,
+}
+profile = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -64000,
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000,
+}
+profiles = {"legacy": legacy, "profile": profile}
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)] * 1000
+
+
+def connect(path: str, pragmas: Dict) -> sqlite3.Connection:
+    connection = sqlite3.connect(path, timeout=30)
+    for pragma, value in pragmas.items():
+        connection.execute("PRAGMA {}={}".format(pragma, value))
+    return connection
+
+
+def write_loop(path: str, pragmas: Dict, seconds: float, results):
+    connection = connect(path, pragmas)
+    latencies = []
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        start = time.perf_counter()
+        connection.execute(
+            "INSERT INTO action (game, value) VALUES (?, ?)",
+            (len(latencies) % 20, len(latencies)),
+        )
+        connection.commit()
+        latencies.append(time.perf_counter() - start)
+    results.put(("write", latencies))
+
+
+def read_loop(path: str, pragmas: Dict, seconds: float, results):
+    connection = connect(path, pragmas)
+    latencies = []
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        start = time.perf_counter()
+        connection.execute(
+            "SELECT count(*), sum(value) FROM action WHERE game = ?",
+            (len(latencies) % 20,),
+        ).fetchall()
+        latencies.append(time.perf_counter() - start)
+    results.put(("read", latencies))
+
+
+def run_connections(seconds: float):
+    directory = tempfile.mkdtemp()
+    for name, pragmas in profiles.items():
+        path = os.path.join(directory, name + ".sqlite")
+        connection = connect(path, pragmas)
+        connection.execute(
+            "CREATE TABLE action (id INTEGER PRIMARY KEY, game INT, value INT)"
+        )
+        connection.execute("CREATE INDEX ix_action_game ON action (game)")
+        connection.executemany(
+            "INSERT INTO action (game, value) VALUES (?, ?)",
+            [(i % 20, i) for i in range(50000)],
+        )
+        connection.commit()
+        connection.close()
+
+        results = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(
+                target=write_loop, args=(path, pragmas, seconds, results)
+            )
+        ] + [
+            multiprocessing.Process(
+                target=read_loop, args=(path, pragmas, seconds, results)
+            )
+            for _ in range(2)
+        ]
+        for process in processes:
+            process.start()
+        measured = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+        writes = [lat for kind, lats in measured if kind == "write" for lat in lats]
+        reads = [lat for kind, lats in measured if kind == "read" for lat in lats]
+        print(
+            "{:8} {:7.0f} commits/s (p99 {:7.1f} ms) {:7.0f} reads/s "
+            "(p99 {:7.1f} ms)".format(
+                name,
+                len(writes) / seconds,
+                percentile(writes, 0.99),
+                len(reads) / seconds,
+                percentile(reads, 0.99),
+            )
+        )
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+def start_server(path: str, pragmas: Dict, port: int, workers: int):
+    import httpx
+
+    env = dict(
+        os.environ,
+        SQLITE_DB=path,
+        DATABASE_URL="",
+        PROJECT_NAME=os.environ.get("PROJECT_NAME", "benchmark"),
+        VERSION=os.environ.get("VERSION", "benchmark"),
+        **{"SQLITE_" + pragma.upper(): str(value) for pragma, value in pragmas.items()},
+    )
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "app.main:app",
+            "--port",
+            str(port),
+            "--workers",
+            str(workers),
+            "--log-level",
+            "error",
+        ],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    for _ in range(150):
+        try:
+            httpx.get("http://127.0.0.1:{}/techs/".format(port))
+            return server
+        except httpx.TransportError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("uvicorn did not start")
+
+
+def seed(base_url: str, players: int = 40):
+    """Players, teams of two, a game per team pair and 5 actions per player."""
+    import httpx
+
+    def post(url: str, payload):
+        client.post(url, json=payload).raise_for_status()
+
+    with httpx.Client(base_url=base_url) as client:
+        post("/techs/", {"name": "serve"})
+        post("/subtechs/", {"tech": 1, "name": "jump", "difficulty": 1})
+        for i in range(players):
+            post("/players/", {"first_name": "P{}".format(i), "last_name": "L"})
+        teams = players // 2
+        for team in range(teams):
+            post(
+                "/teams/",
+                {
+                    "name": "T{}".format(team),
+                    "players": [
+                        {"player": 2 * team + 1, "amplua": "ATTACKER"},
+                        {"player": 2 * team + 2, "amplua": "DEFENDER"},
+                    ],
+                },
+            )
+        for game in range(teams):
+            post(
+                "/games/",
+                {
+                    "name": "G{}".format(game),
+                    "team_a": 1 + game,
+                    "team_b": 1 + (game + 1) % teams,
+                },
+            )
+        post(
+            "/actions/bulk",
+            [
+                new_action(1 + i % teams, 1 + 2 * (i % teams))
+                for i in range(players * 5)
+            ],
+        )
+
+
+def new_action(game: int, player: int) -> Dict:
+    return {
+        "game": game,
+        "team": game,
+        "player": player,
+        "subtech": 1,
+        "from_zone": 1,
+        "to_zone": 2,
+        "impact": "SCORE",
+    }
+
+
+async def load(base_url: str, seconds: float, write_ratio: float, clients: int = 32):
+    import httpx
+
+    latencies: Dict[str, List[float]] = {"read": [], "write": []}
+    errors = 0
+
+    async def client_loop(client, seed_value: int):
+        nonlocal errors
+        rnd = random.Random(seed_value)
+        while time.perf_counter() < end:
+            start = time.perf_counter()
+            if rnd.random() < write_ratio:
+                kind = "write"
+                response = await client.post("/actions/", json=new_action(1, 1))
+            else:
+                kind = "read"
+                response = await client.get(
+                    "/actions/", params={"game_id": 1 + rnd.randrange(20)}
+                )
+            if response.status_code == 200:
+                latencies[kind].append(time.perf_counter() - start)
+            else:
+                errors += 1
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        end = time.perf_counter() + seconds
+        await asyncio.gather(*[client_loop(client, i) for i in range(clients)])
+    return latencies, errors
+
+
+def run_api(seconds: float, workers: int, write_ratio: float):
+    directory = tempfile.mkdtemp()
+    seeded = os.path.join(directory, "seed.sqlite")
+    server = start_server(seeded, profile, 8770, 1)
+    try:
+        seed("http://127.0.0.1:8770")
+    finally:
+        server.terminate()
+        server.wait()
+
+    for name, pragmas in profiles.items():
+        path = os.path.join(directory, name + ".sqlite")
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(seeded + suffix):
+                shutil.copy(seeded + suffix, path + suffix)
+        server = start_server(path, pragmas, 8771, workers)
+        try:
+            latencies, errors = asyncio.run(
+                load("http://127.0.0.1:8771", seconds, write_ratio)
+            )
+        finally:
+            server.terminate()
+            server.wait()
+        reads, writes = latencies["read"], latencies["write"]
+        print(
+            "{:8} {:6.1f} req/s  reads p50 {:6.1f} p95 {:7.1f} ms  "
+            "writes p50 {:6.1f} p95 {:7.1f} ms  errors {}".format(
+                name,
+                (len(reads) + len(writes)) / seconds,
+                percentile(reads, 0.5),
+                percentile(reads, 0.95),
+                percentile(writes, 0.5),
+                percentile(writes, 0.95),
+                errors,
+            )
+        )
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    mode = sys.argv[1] if len(sys.argv) > 1 else "connections"
+    args = sys.argv[2:]
+    if mode == "connections":
+        run_connections(float(args[0]) if args else 5)
+    elif mode == "api":
+        run_api(
+            float(args[0]) if args else 8,
+            int(args[1]) if len(args) > 1 else 4,
+            float(args[2]) if len(args) > 2 else 0.2,
+        )
+    else:
+        sys.exit(__doc__)
@@ -0,0 +1,147 @@
+"""
+Python-side cost of the hot stats and plan statements, rebuilt on every call
+versus prebuilt in app/core/statements.py.
+
+Run from the repository root:
+
+    python -m benchmarks.statements [calls]
+
+A throwaway sqlite database is used unless DATABASE_URL is set. Reported
+times are the best of three runs, in microseconds per call: building the
+construct and its cache key, and executing it through an AsyncSession.
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import timeit
+from time import perf_counter
+from typing import Any, Callable, Dict, Optional, Tuple
+
+os.environ.setdefault("PROJECT_NAME", "benchmark")
+os.environ.setdefault("VERSION", "benchmark")
+os.environ.setdefault("SQLITE_DB", os.path.join(tempfile.mkdtemp(), "db.sqlite"))
+
+from sqlmodel import and_, col, desc, func, select  # noqa: E402
+
+from app.core import db, statements  # noqa: E402
+from app.data.algorithm import (  # noqa: E402
+    ImpactSum,
+    PlanExercise,
+    SubtechSum,
+    ZoneSum,
+)
+
+Statement = Callable[[], Tuple[Any, Optional[Dict[str, Any]]]]
+
+# what the call sites built before the statements module
+fresh: Dict[str, Statement] = {
+    "max_plan_exercise_id": lambda: (
+        select(func.max(PlanExercise.id)).where(
+            and_(
+                col(PlanExercise.player) == 1,
+                col(PlanExercise.plan) == 1,
+                col(PlanExercise.week) == 3,
+            )
+        ),
+        None,
+    ),
+    "best_zone": lambda: (
+        select(col(ZoneSum.zone), col(ZoneSum.prozent))
+        .where(
+            and_(
+                col(ZoneSum.player) == 1,
+                col(ZoneSum.tech) == 1,
+                col(ZoneSum.subtech) == 1,
+                col(ZoneSum.impact) == "FAIL",
+            )
+        )
+        .order_by(desc(ZoneSum.prozent), col(ZoneSum.zone))
+        .limit(1),
+        None,
+    ),
+    "subtech_sums_by_tech": lambda: (
+        select(SubtechSum)
+        .where(and_(col(SubtechSum.player) == 1, col(SubtechSum.tech) == 1))
+        .order_by(desc(SubtechSum.prozent)),
+        None,
+    ),
+    "impact_sums_by_subtech": lambda: (
+        select(ImpactSum).where(
+            and_(
+                col(ImpactSum.player) == 1,
+                col(ImpactSum.tech) == 1,
+                col(ImpactSum.subtech) == 1,
+            )
+        ),
+        None,
+    ),
+}
+
+prebuilt: Dict[str, Statement] = {
+    "max_plan_exercise_id": lambda: (
+        statements.max_plan_exercise_id,
+        {"player": 1, "plan": 1, "week": 3},
+    ),
+    "best_zone": lambda: (
+        statements.best_zone,
+        {"player": 1, "tech": 1, "subtech": 1, "impact": "FAIL"},
+    ),
+    "subtech_sums_by_tech": lambda: (
+        statements.subtech_sums_by_tech,
+        {"player": 1, "tech": 1},
+    ),
+    "impact_sums_by_subtech": lambda: (
+        statements.impact_sums_by_subtech,
+        {"player": 1, "tech": 1, "subtech": 1},
+    ),
+}
+
+
+def build_time(statement: Statement, calls: int) -> float:
+    def run():
+        construct, _ = statement()
+        construct._generate_cache_key()
+
+    return min(timeit.repeat(run, number=calls, repeat=3)) / calls * 1e6
+
+
+async def execute_time(statement: Statement, calls: int) -> float:
+    async with db.create_session() as session:
+        for _ in range(min(calls, 200)):  # warm up the compiled cache
+            construct, params = statement()
+            (await session.exec(construct, params=params)).all()
+        best = float("inf")
+        for _ in range(3):
+            start = perf_counter()
+            for _ in range(calls):
+                construct, params = statement()
+                (await session.exec(construct, params=params)).all()
+            best = min(best, perf_counter() - start)
+        return best / calls * 1e6
+
+
+async def main(calls: int):
+    await db.init_db()
+    print(
+        "{:24} {:>12} {:>9} {:>12} {:>9}  (us/call)".format(
+            "statement", "build fresh", "prebuilt", "exec fresh", "prebuilt"
+        )
+    )
+    for name in fresh:
+        print(
+            "{:24} {:12.1f} {:9.1f} {:12.1f} {:9.1f}".format(
+                name,
+                build_time(fresh[name], calls),
+                build_time(prebuilt[name], calls),
+                await execute_time(fresh[name], calls),
+                await execute_time(prebuilt[name], calls),
+            )
+        )
+    await db.engine.dispose()
+    await db.read_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 3000))
@@ -0,0 +1,129 @@
+"""Behaviour that goes through dialect specific SQL, see app/core/dialect.py."""
+
+from uuid import uuid4
+
+from sqlalchemy import text
+
+from app.core import db
+from app.core.profiling import explain
+from tests.conftest import action
+
+
+def action_count(client, game_id: int) -> int:
+    return client.get("/actions/", params={"game_id": game_id}).json()["total"]
+
+
+def test_bulk_upload_skips_known_client_ids(client, game):
+    actions = [action(game, client_id=str(uuid4())) for _ in range(20)]
+
+    first = client.post("/actions/bulk", json=actions).json()
+    retry = client.post("/actions/bulk", json=actions + [action(game)]).json()
+
+    assert (first["created"], first["skipped"]) == (20, 0)
+    assert (retry["created"], retry["skipped"]) == (1, 20)
+    assert action_count(client, game) == 21
+
+
+def test_clone_game_copies_actions(client, game):
+    client.post("/actions/bulk", json=[action(game) for _ in range(5)])
+
+    response = client.get(f"/games/clone/{game}")
+    # the GET is deprecated in favour of the POST
+    copy = client.post(f"/games/clone/{game}", json={})
+
+    assert response.status_code == 200, response.text
+    assert action_count(client, int(response.json()["detail"])) == 5
+    assert action_count(client, int(copy.json()["detail"])) == 5
+    assert client.get("/openapi.json").json()["paths"]["/games/clone/{game_id}"][
+        "get"
+    ]["deprecated"]
+
+
+def test_changes_since_cursor(client, game):
+    since = client.get("/system/changes").json()["seq"]
+    client.put("/players/1", json={"first_name": "Renamed"})
+    client.delete("/players/4")
+
+    changes = client.get("/system/changes", params={"since": since}).json()
+
+    assert [
+        (change["entity"], change["id"], change["deleted"])
+        for change in changes["changes"]
+        if change["entity"] == "player"
+    ] == [("player", 1, False), ("player", 4, True)]
+    assert changes["changes"][0]["data"]["first_name"] == "Renamed"
+    assert client.get("/system/changes", params={"since": changes["seq"]}).json()[
+        "changes"
+    ] == []
+
+
+def test_failed_explain_keeps_the_transaction(client, game):
+    async def explain_then_query():
+        async with db.engine.begin() as connection:
+            plan = await connection.run_sync(
+                explain, "SELECT missing FROM player", ()
+            )
+            count = await connection.scalar(text("SELECT count(*) FROM player"))
+        return plan, count
+
+    plan, count = client.portal.call(explain_then_query)
+
+    assert plan[0].startswith("EXPLAIN failed")
+    assert count == 4
+
+
+def test_changes_logged_after_writes(client, game):
+    client.post("/actions/bulk", json=[action(game) for _ in range(3)])
+    since = client.get("/system/changes").json()["seq"]
+
+    def changed_actions():
+        changes = client.get("/system/changes", params={"since": since}).json()
+        return sorted(
+            (change["id"], change["deleted"])
+            for change in changes["changes"]
+            if change["entity"] == "action"
+        )
+
+    # the filtered field itself changes
+    response = client.put(
+        "/actions/batch_update",
+        json={"filter": {"player": 1}, "main_action": {"player": 2}},
+    )
+    assert response.json()["updated"] == 3
+    assert changed_actions() == [(1, False), (2, False), (3, False)]
+
+    since = client.get("/system/changes").json()["seq"]
+    response = client.put(
+        f"/games/{game}",
+        json={
+            "name": "G",
+            "team_a": 1,
+            "team_b": 2,
+            "player_updates": [{"player_before": 2, "player_after": 3}],
+        },
+    )
+    assert response.status_code == 200, response.text
+    assert changed_actions() == [(1, False), (2, False), (3, False)]
+
+    since = client.get("/system/changes").json()["seq"]
+    client.delete(f"/games/{game}")
+    assert changed_actions() == [(1, True), (2, True), (3, True)]
+
+
+def test_update_game_with_unknown_player(client, game):
+    client.post("/actions/bulk", json=[action(game)])
+
+    response = client.put(
+        f"/games/{game}",
+        json={
+            "name": "G",
+            "team_a": 1,
+            "team_b": 2,
+            "player_updates": [{"player_before": 1, "player_after": 999}],
+        },
+    )
+
+    assert response.status_code == 404
+    assert response.json()["detail"] == "Player not found"
+    actions = client.get("/actions/", params={"game_id": game}).json()["items"]
+    assert actions[0]["player"]["id"] == 1
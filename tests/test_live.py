@@ -0,0 +1,67 @@
+from uuid import uuid4
+
+from tests.conftest import action
+
+
+def receive_actions(websocket, count: int):
+    actions = []
+    while len(actions) < count:
+        message = websocket.receive_json()
+        assert message["type"] == "actions", message
+        actions.extend(message["actions"])
+    return actions
+
+
+def acks(websocket, count: int):
+    messages = [websocket.receive_json() for _ in range(count)]
+    assert all(message["type"] == "ack" for message in messages), messages
+    return {message["ref"]: message["id"] for message in messages}
+
+
+def test_resent_client_id_is_acked_but_not_pushed_again(client, game):
+    resent, repeated, new = (str(uuid4()) for _ in range(3))
+    with client.websocket_connect(f"/actions/ws/{game}") as sender:
+        with client.websocket_connect(f"/actions/ws/{game}") as viewer:
+            sender.send_json({"ref": 1, "action": action(game, client_id=resent)})
+            first = acks(sender, 1)
+            assert [a["id"] for a in receive_actions(viewer, 1)] == [first[1]]
+
+            # a retry of the stored action, a repeat within the group, a new one
+            resends = [(2, resent), (3, repeated), (4, repeated), (5, new)]
+            for ref, client_id in resends:
+                sender.send_json(
+                    {"ref": ref, "action": action(game, client_id=client_id)}
+                )
+            ids = acks(sender, 4)
+            assert ids[2] == first[1]
+            assert ids[3] == ids[4]
+            pushed = receive_actions(viewer, 2)
+            assert sorted(a["id"] for a in pushed) == sorted([ids[3], ids[5]])
+
+
+def test_client_id_stored_concurrently_is_a_duplicate(client, game, monkeypatch):
+    from app.api.routers import actions
+
+    raced = str(uuid4())
+    client.post("/actions/", json=action(game, client_id=raced))
+    stored_client_ids = actions.stored_client_ids
+    calls = []
+
+    async def stored_after_lookup(session, client_ids):
+        # the first lookup runs before the other upload commits
+        calls.append(client_ids)
+        if len(calls) == 1:
+            return {}
+        return await stored_client_ids(session, client_ids)
+
+    monkeypatch.setattr(actions, "stored_client_ids", stored_after_lookup)
+    with client.websocket_connect(f"/actions/ws/{game}") as sender:
+        with client.websocket_connect(f"/actions/ws/{game}") as viewer:
+            sender.send_json({"ref": 1, "action": action(game, client_id=raced)})
+            sender.send_json({"ref": 2, "action": action(game)})
+            ids = acks(sender, 2)
+            pushed = receive_actions(viewer, 1)
+
+    stored = client.get("/actions/", params={"game_id": game}).json()["items"]
+    assert [a["id"] for a in stored if a["client_id"] == raced] == [ids[1]]
+    assert [a["id"] for a in pushed] == [ids[2]]
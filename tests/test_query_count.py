@@ -0,0 +1,83 @@
+import pytest
+
+from app.core.config import settings
+
+# list endpoints that load relationships, see user-026
+LIST_ENDPOINTS = ["/players/", "/teams/", "/exercises/"]
+
+
+def seed(client, start: int, stop: int):
+    """Players start..stop, a team per two players and an exercise per player."""
+    if start == 0:
+        client.post("/techs/", json={"name": "serve"})
+        for i in range(4):
+            client.post(
+                "/subtechs/", json={"tech": 1, "name": f"subtech {i}", "difficulty": 1}
+            )
+    for i in range(start, stop):
+        client.post("/players/", json={"first_name": f"P{i}", "last_name": "L"})
+        client.post(
+            "/exercises/",
+            json={
+                "name": f"E{i}",
+                "description": "",
+                "difficulty": 1,
+                "time_per_exercise": 10,
+                "subtechs": [{"subtech": 1 + i % 4}, {"subtech": 1 + (i + 1) % 4}],
+            },
+        )
+    for i in range(start, stop, 2):
+        client.post(
+            "/teams/",
+            json={
+                "name": f"T{i}",
+                "players": [
+                    {"player": i + 1, "amplua": "ATTACKER"},
+                    {"player": i + 2, "amplua": "DEFENDER"},
+                ],
+            },
+        )
+
+
+def list_page(client, url: str):
+    """Items and query count of the first page (a cache miss after writes)."""
+    response = client.get(url, params={"size": 100})
+    assert response.status_code == 200, response.text
+    return response.json()["items"], int(response.headers["x-db-queries"])
+
+
+@pytest.mark.parametrize("url", LIST_ENDPOINTS)
+def test_list_query_count_does_not_grow_with_rows(client, url):
+    seed(client, 0, 10)
+    items, small = list_page(client, url)
+    assert len(items) >= 5
+    seed(client, 10, 100)
+    items, large = list_page(client, url)
+    assert len(items) >= 50
+    assert large == small
+
+
+def test_teams_are_paginated_in_sql(client):
+    seed(client, 0, 10)
+    response = client.get("/teams/", params={"page": 2, "size": 2})
+    assert response.status_code == 200, response.text
+    page = response.json()
+    assert (page["total"], page["pages"]) == (5, 3)
+    assert [team["name"] for team in page["items"]] == ["T4", "T6"]
+    assert page["items"][0]["players"] == [
+        {"team": None, "player": {"id": 5, "name": "P4 L"}, "amplua": "ATTACKER"},
+        {"team": None, "player": {"id": 6, "name": "P5 L"}, "amplua": "DEFENDER"},
+    ]
+
+
+def test_cache_hit_needs_no_query(client, monkeypatch):
+    monkeypatch.setattr(settings, "CACHE_VERSION_TTL_MS", 1000)
+    client.post("/techs/", json={"name": "serve"})
+    client.get("/techs/")
+
+    response = client.get("/techs/")
+    assert response.headers["x-db-queries"] == "0"
+
+    # this worker's own write is seen right after its commit
+    client.post("/techs/", json={"name": "block"})
+    assert client.get("/techs/").json()["total"] == 2